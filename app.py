@@ -6,12 +6,20 @@ import logging
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, make_response, send_from_directory
 from flask_cors import CORS
 import requests
-import json
 from datetime import datetime
 import gspread
-from google.oauth2.service_account import Credentials
 from config import get_config, SHEETS_CONFIG
 from auth_manager import AuthManager
+from backend.database.sheets_cache import table_cache
+from backend.database.log_buffer import BufferedLogSink
+from backend.database.sheets_client import sheet_handles, get_sheets_client
+from backend.database.quota import quota_governor
+from backend.database.resilience import sheets_resilience
+from backend.database.refresher import CacheRefresher
+from backend.database.tombstones import live_rows, live_records, mark_deleted, tombstone_column
+from backend.database.patient_stats import CLINICAL_COLUMNS, ROW_KEY_COLUMNS, STATUS_COLUMN, patient_counters, patient_version
+from backend.database.patient_history import MAX_PAGE_SIZE, history_page
+from backend.database.records import Consulta, Examen, Familiar, Medicamento, Usuario, convert_date_format
 from werkzeug.utils import secure_filename
 import uuid
 
@@ -38,27 +46,10 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 # Crear directorio de uploads si no existe
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Configuración de Google Sheets
-SCOPES = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive'
-]
-
 def get_google_sheets_client():
-    """Inicializa el cliente de Google Sheets"""
+    """Cliente de Google Sheets compartido con AuthManager"""
     try:
-        if os.path.exists(app.config['GOOGLE_SERVICE_ACCOUNT_FILE']):
-            creds = Credentials.from_service_account_file(
-                app.config['GOOGLE_SERVICE_ACCOUNT_FILE'], 
-                scopes=SCOPES
-            )
-        else:
-            # Para Railway, usar variables de entorno
-            service_account_info = json.loads(os.environ.get('GOOGLE_SERVICE_ACCOUNT_JSON', '{}'))
-            creds = Credentials.from_service_account_info(service_account_info, scopes=SCOPES)
-        
-        client = gspread.authorize(creds)
-        return client
+        return get_sheets_client()
     except Exception as e:
         logger.error(f"Error inicializando Google Sheets: {e}")
         return None
@@ -66,6 +57,11 @@ def get_google_sheets_client():
 # Cliente global de Google Sheets
 sheets_client = get_google_sheets_client()
 
+def patient_rows(worksheet, patient_id):
+    """Filas (número, fila) no eliminadas de un paciente en una hoja clínica"""
+    rows = table_cache.get_patient_rows(worksheet, patient_id, columns=CLINICAL_COLUMNS)
+    return live_rows(rows, STATUS_COLUMN)
+
 # Inicializar AuthManager
 try:
     auth_manager = AuthManager()
@@ -75,14 +71,21 @@ except Exception as e:
     auth_manager = None
 
 def get_spreadsheet():
-    """Obtiene la hoja de cálculo principal"""
+    """Obtiene la hoja de cálculo principal (handle reutilizado entre requests)"""
     if sheets_client:
         try:
-            return sheets_client.open_by_key(app.config['GOOGLE_SHEETS_ID'])
+            return sheet_handles.open(sheets_client, app.config['GOOGLE_SHEETS_ID'])
         except Exception as e:
             logger.error(f"Error abriendo spreadsheet: {e}")
     return None
 
+# Interacciones del bot: se envían en lote desde un hilo en segundo plano
+bot_interactions_log = BufferedLogSink(
+    'bot_interactions',
+    lambda: get_spreadsheet().worksheet(SHEETS_CONFIG['bot_interactions']['name']),
+    id_prefix='INT'
+)
+
 def get_current_user():
     """Obtiene los datos del usuario actual desde la sesión"""
     return session.get('user_data', {})
@@ -115,6 +118,59 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def patient_etag(*sheet_names):
+    """
+    Decorador para las rutas GET de datos de un paciente: la respuesta lleva
+    como ETag la versión de sus filas en sheet_names y un If-None-Match que
+    coincide se responde con 304 sin ejecutar la ruta
+    """
+    from functools import wraps
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(patient_id, *args, **kwargs):
+            etag = None
+            spreadsheet = get_spreadsheet()
+            if spreadsheet:
+                try:
+                    etag = patient_version(spreadsheet, patient_id, sheet_names)
+                except Exception as e:
+                    logger.warning(f"No se pudo calcular el ETag del paciente {patient_id}: {e}")
+            
+            if etag and request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(f(patient_id, *args, **kwargs))
+                if not etag or response.status_code != 200:
+                    return response
+            
+            response.set_etag(etag)
+            # El navegador guarda la respuesta pero la revalida en cada uso
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+# Refresca en segundo plano las hojas más consultadas antes de que venzan
+cache_refresher = CacheRefresher(get_spreadsheet)
+
+@app.before_request
+def reset_stale_flag():
+    """Cada request parte sin datos vencidos (los hilos se reutilizan)"""
+    table_cache.take_stale()
+
+@app.before_request
+def start_cache_refresher():
+    """Inicia el refresco anticipado en este worker (una vez por proceso)"""
+    cache_refresher.start()
+
+@app.after_request
+def mark_stale_response(response):
+    """Avisa al cliente si la respuesta usó copias vencidas de Google Sheets"""
+    if table_cache.take_stale():
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['X-Data-Stale'] = 'true'
+    return response
+
 # Rutas de autenticación
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -428,8 +484,132 @@ def chat():
     user_data = session.get('user_data', {})
     return render_template('chat.html', user=user_data)
 
+def page_args():
+    """limit y cursor de la query (?limit=20&cursor=...); sin limit se entrega todo"""
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return limit, request.args.get('cursor') or None
+
+def clinical_page(worksheet, patient_id, limit=None, cursor=None):
+    """
+    Filas de un paciente en una hoja clínica, más recientes primero, y el
+    cursor de la página siguiente (None si no hay más o si no hay limit)
+    """
+    all_values = table_cache.get_columns(worksheet, CLINICAL_COLUMNS)
+    if len(all_values) <= 1:
+        return [], None
+    
+    headers = all_values[0]
+    logger.info(f"📋 Headers de {worksheet.title}: {headers}")
+    # Se recorre solo el historial ordenado del paciente (índice por patient_id)
+    return history_page(
+        worksheet, patient_id,
+        keep=lambda row: len(row) >= len(headers) and any(cell.strip() for cell in row),
+        limit=limit, cursor=cursor
+    )
+
+def build_consultations(worksheet, patient_id, limit=None, cursor=None):
+    """Consultas de un paciente en el formato de la plataforma web, y el cursor siguiente"""
+    rows, next_cursor = clinical_page(worksheet, patient_id, limit, cursor)
+    
+    # Headers reales: ['id', 'patient_id', 'doctor', 'specialty', 'date', 'diagnosis', 'treatment', 'notes', 'status']
+    consultations = [Consulta.from_row(row).to_json() for row in rows]
+    
+    logger.info(f"🔍 Consultas encontradas para paciente {patient_id}: {len(consultations)}")
+    return consultations, next_cursor
+
+def build_medications(worksheet, patient_id, limit=None, cursor=None):
+    """Medicamentos de un paciente en el formato de la plataforma web, y el cursor siguiente"""
+    rows, next_cursor = clinical_page(worksheet, patient_id, limit, cursor)
+    
+    # Headers reales: ['id', 'patient_id', 'medication', 'dosage', 'frequency', 'start_date', 'end_date', 'prescribed_by', 'status']
+    medications = [Medicamento.from_row(row).to_json() for row in rows]
+    
+    logger.info(f"🔍 Medicamentos encontrados para paciente {patient_id}: {len(medications)}")
+    return medications, next_cursor
+
+def build_exams(worksheet, patient_id, limit=None, cursor=None):
+    """Exámenes de un paciente (hoja 'Examenes') en el formato de la plataforma web, y el cursor siguiente"""
+    rows, next_cursor = clinical_page(worksheet, patient_id, limit, cursor)
+    
+    # Headers reales: ['id', 'patient_id', 'exam_type', 'date', 'results', 'lab', 'doctor', 'file_url', 'status']
+    patient_exams = []
+    for row in rows:
+        exam = Examen.from_row(row).to_json()
+        logger.info(f"📅 Fecha original: '{row[3] if len(row) > 3 else ''}' → Convertida: '{exam['date']}'")
+        patient_exams.append(exam)
+    
+    logger.info(f"🔍 Exámenes encontrados para paciente {patient_id}: {len(patient_exams)}")
+    return patient_exams, next_cursor
+
+def build_legacy_exams(worksheet, patient_id):
+    """Exámenes de un paciente leídos como registros (estructura antigua)"""
+    all_records = live_records(table_cache.get_records_by(worksheet, 'patient_id', patient_id), 'status')
+    
+    patient_exams = []
+    for record in all_records:
+        if str(record.get('patient_id', '')) == str(patient_id):
+            original_date = record.get('date', '')
+            converted_date = convert_date_format(original_date)
+            logger.info(f"📅 Fecha original (antigua): '{original_date}' → Convertida: '{converted_date}'")
+            
+            patient_exams.append({
+                'id': record.get('id', ''),
+                'patient_id': record.get('patient_id', ''),
+                'exam_type': record.get('exam_type', ''),
+                'date': converted_date,
+                'results': record.get('results', ''),
+                'lab': record.get('lab', ''),
+                'doctor': record.get('doctor', ''),
+                'file_url': record.get('file_url', ''),
+                'status': record.get('status', 'completado')
+            })
+    
+    # Más recientes primero, como la estructura nueva (sin paginar)
+    patient_exams.sort(key=lambda exam: exam['date'], reverse=True)
+    logger.info(f"🔍 Exámenes encontrados en estructura antigua para paciente {patient_id}: {len(patient_exams)}")
+    return patient_exams
+
+def build_family(worksheet, patient_id):
+    """Familiares vigentes de un paciente (filtrados con el índice de patient_id)"""
+    patient_family = [
+        member.to_json() for member in
+        table_cache.get_objects_by(worksheet, Familiar, 'patient_id', patient_id, columns=CLINICAL_COLUMNS)
+        if not member.is_deleted()
+    ]
+    logger.info(f"🔍 Familiares encontrados para paciente {patient_id}: {len(patient_family)}")
+    return patient_family
+
+def build_stats(consultations, medications, exams, last_activity=''):
+    """Estadísticas del dashboard a partir de los conteos del paciente (medicamentos activos)"""
+    stats = {
+        'consultations': consultations,
+        'medications': medications,
+        'exams': exams,
+        'last_activity': last_activity,
+        'health_score': 95  # Valor base, se puede calcular dinámicamente
+    }
+    
+    # Calcular puntuación de salud básica
+    # Fórmula simple: base 85% + bonificaciones
+    health_score = 85
+    
+    # Bonificación por tener consultas recientes
+    if stats['consultations'] > 0:
+        health_score += min(stats['consultations'] * 2, 10)  # Máximo +10%
+    
+    # Bonificación por seguir tratamiento
+    if stats['medications'] > 0:
+        health_score += min(stats['medications'] * 3, 5)  # Máximo +5%
+    
+    # Asegurar que no exceda 100%
+    stats['health_score'] = min(health_score, 100)
+    return stats
+
 # API Routes para el frontend
 @app.route('/api/patient/<patient_id>/consultations')
+@patient_etag('Consultas')
 def get_patient_consultations(patient_id):
     """Obtiene las consultas de un paciente"""
     try:
@@ -439,50 +619,21 @@ def get_patient_consultations(patient_id):
         
         # Leer datos de la hoja Consultas manualmente para evitar errores de headers
         try:
-            worksheet = spreadsheet.worksheet('Consultas')
-            all_values = worksheet.get_all_values()
-            
-            consultations = []
-            
-            if len(all_values) > 1:
-                headers = all_values[0]
-                logger.info(f"📋 Headers de Consultas: {headers}")
-                
-                # Headers reales: ['id', 'patient_id', 'doctor', 'specialty', 'date', 'diagnosis', 'treatment', 'notes', 'status']
-                for row in all_values[1:]:
-                    if len(row) >= len(headers) and any(cell.strip() for cell in row):
-                        # Verificar si pertenece al paciente
-                        patient_id_cell = row[1] if len(row) > 1 else ''
-                        
-                        if str(patient_id_cell) == str(patient_id):
-                            # Transformar al formato esperado por la plataforma web
-                            consultation_formatted = {
-                                'id': row[0] if len(row) > 0 else '',  # id
-                                'patient_id': patient_id,
-                                'doctor': row[2] if len(row) > 2 else '',  # doctor
-                                'specialty': row[3] if len(row) > 3 else '',  # specialty
-                                'date': convert_date_format(row[4] if len(row) > 4 else ''),  # date
-                                'diagnosis': row[5] if len(row) > 5 else '',  # diagnosis
-                                'treatment': row[6] if len(row) > 6 else '',  # treatment
-                                'notes': row[7] if len(row) > 7 else '',  # notes
-                                'status': row[8] if len(row) > 8 else 'completada'  # status
-                            }
-                            
-                            consultations.append(consultation_formatted)
-            
-            logger.info(f"🔍 Consultas encontradas para paciente {patient_id}: {len(consultations)}")
-            
-            return jsonify({'consultations': consultations})
+            consultations, next_cursor = build_consultations(spreadsheet.worksheet('Consultas'), patient_id, *page_args())
+            return jsonify({'consultations': consultations, 'next_cursor': next_cursor})
             
         except gspread.WorksheetNotFound:
             logger.warning("📝 Hoja 'Consultas' no encontrada")
-            return jsonify({'consultations': []})
+            return jsonify({'consultations': [], 'next_cursor': None})
             
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error obteniendo consultas: {e}")
         return jsonify({'error': 'Error interno del servidor'}), 500
 
 @app.route('/api/patient/<patient_id>/medications')
+@patient_etag('Medicamentos')
 def get_patient_medications(patient_id):
     """Obtiene los medicamentos de un paciente"""
     try:
@@ -492,51 +643,21 @@ def get_patient_medications(patient_id):
         
         # Leer datos de la hoja Medicamentos manualmente para evitar errores de headers
         try:
-            worksheet = spreadsheet.worksheet('Medicamentos')
-            all_values = worksheet.get_all_values()
-            
-            medications = []
-            
-            if len(all_values) > 1:
-                headers = all_values[0]
-                logger.info(f"📋 Headers de Medicamentos: {headers}")
-                
-                # Headers reales: ['id', 'patient_id', 'medication', 'dosage', 'frequency', 'start_date', 'end_date', 'prescribed_by', 'status']
-                for row in all_values[1:]:
-                    if len(row) >= len(headers) and any(cell.strip() for cell in row):
-                        # Verificar si pertenece al paciente
-                        patient_id_cell = row[1] if len(row) > 1 else ''
-                        
-                        if str(patient_id_cell) == str(patient_id):
-                            # Transformar al formato esperado por la plataforma web
-                            medication_formatted = {
-                                'id': row[0] if len(row) > 0 else '',  # id
-                                'patient_id': patient_id,
-                                'name': row[2] if len(row) > 2 else '',  # medication
-                                'dosage': row[3] if len(row) > 3 else '',  # dosage
-                                'frequency': row[4] if len(row) > 4 else '',  # frequency
-                                'prescribing_doctor': row[7] if len(row) > 7 else '',  # prescribed_by
-                                'start_date': convert_date_format(row[5] if len(row) > 5 else ''),  # start_date
-                                'end_date': convert_date_format(row[6] if len(row) > 6 else ''),  # end_date
-                                'instructions': '',  # No disponible en la estructura actual
-                                'status': row[8] if len(row) > 8 else 'activo'  # status
-                            }
-                            
-                            medications.append(medication_formatted)
-            
-            logger.info(f"🔍 Medicamentos encontrados para paciente {patient_id}: {len(medications)}")
-            
-            return jsonify({'medications': medications})
+            medications, next_cursor = build_medications(spreadsheet.worksheet('Medicamentos'), patient_id, *page_args())
+            return jsonify({'medications': medications, 'next_cursor': next_cursor})
             
         except gspread.WorksheetNotFound:
             logger.warning("📝 Hoja 'Medicamentos' no encontrada")
-            return jsonify({'medications': []})
+            return jsonify({'medications': [], 'next_cursor': None})
             
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error obteniendo medicamentos: {e}")
         return jsonify({'error': 'Error interno del servidor'}), 500
 
 @app.route('/api/patient/<patient_id>/exams')
+@patient_etag('Examenes')
 def get_patient_exams(patient_id):
     """Obtiene los exámenes de un paciente"""
     try:
@@ -545,46 +666,11 @@ def get_patient_exams(patient_id):
             return jsonify({'error': 'Error conectando con la base de datos'}), 500
         
         # Leer datos de la hoja 'Examenes' (nueva estructura)
+        limit, cursor = page_args()
         try:
-            examenes_worksheet = spreadsheet.worksheet('Examenes')
-            all_exam_values = examenes_worksheet.get_all_values()
-            
-            patient_exams = []
-            
-            if len(all_exam_values) > 1:
-                headers = all_exam_values[0]
-                logger.info(f"📋 Headers de Examenes: {headers}")
-                
-                # Headers reales: ['id', 'patient_id', 'exam_type', 'date', 'results', 'lab', 'doctor', 'file_url', 'status']
-                for row in all_exam_values[1:]:
-                    if len(row) >= len(headers) and any(cell.strip() for cell in row):
-                        # Verificar si pertenece al paciente
-                        patient_id_cell = row[1] if len(row) > 1 else ''
-                        
-                        if str(patient_id_cell) == str(patient_id):
-                            # Transformar al formato esperado por la plataforma web
-                            original_date = row[3] if len(row) > 3 else ''
-                            converted_date = convert_date_format(original_date)
-                            logger.info(f"📅 Fecha original: '{original_date}' → Convertida: '{converted_date}'")
-                            
-                            exam_formatted = {
-                                'id': row[0] if len(row) > 0 else '',  # id
-                                'patient_id': patient_id,
-                                'exam_type': row[2] if len(row) > 2 else '',  # exam_type
-                                'date': converted_date,  # date
-                                'results': row[4] if len(row) > 4 else '',  # results
-                                'lab': row[5] if len(row) > 5 else '',  # lab
-                                'doctor': row[6] if len(row) > 6 else '',  # doctor
-                                'file_url': row[7] if len(row) > 7 else '',  # file_url
-                                'status': row[8] if len(row) > 8 else 'completado'  # status
-                            }
-                            
-                            patient_exams.append(exam_formatted)
-            
-            logger.info(f"🔍 Exámenes encontrados para paciente {patient_id}: {len(patient_exams)}")
-            
-            if patient_exams:
-                return jsonify({'exams': patient_exams})
+            patient_exams, next_cursor = build_exams(spreadsheet.worksheet('Examenes'), patient_id, limit, cursor)
+            if patient_exams or cursor:
+                return jsonify({'exams': patient_exams, 'next_cursor': next_cursor})
                 
         except gspread.WorksheetNotFound:
             logger.info("📝 Hoja 'Examenes' no encontrada, intentando con estructura antigua")
@@ -592,38 +678,14 @@ def get_patient_exams(patient_id):
         # Si no hay resultados en la nueva hoja, probar con la hoja antigua
         try:
             worksheet = spreadsheet.worksheet(SHEETS_CONFIG['exams']['name'])
-            
-            # Obtener datos usando la estructura antigua como respaldo
-            all_records = worksheet.get_all_records()
-            
-            patient_exams = []
-            for record in all_records:
-                if str(record.get('patient_id', '')) == str(patient_id):
-                    original_date = record.get('date', '')
-                    converted_date = convert_date_format(original_date)
-                    logger.info(f"📅 Fecha original (antigua): '{original_date}' → Convertida: '{converted_date}'")
-                    
-                    exam_formatted = {
-                        'id': record.get('id', ''),
-                        'patient_id': record.get('patient_id', ''),
-                        'exam_type': record.get('exam_type', ''),
-                        'date': converted_date,
-                        'results': record.get('results', ''),
-                        'lab': record.get('lab', ''),
-                        'doctor': record.get('doctor', ''),
-                        'file_url': record.get('file_url', ''),
-                        'status': record.get('status', 'completado')
-                    }
-                    patient_exams.append(exam_formatted)
-            
-            logger.info(f"🔍 Exámenes encontrados en estructura antigua para paciente {patient_id}: {len(patient_exams)}")
-            
-            return jsonify({'exams': patient_exams})
+            return jsonify({'exams': build_legacy_exams(worksheet, patient_id), 'next_cursor': None})
             
         except gspread.WorksheetNotFound:
             logger.warning("📝 Ninguna hoja de exámenes encontrada")
-            return jsonify({'exams': []})
+            return jsonify({'exams': [], 'next_cursor': None})
             
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error obteniendo exámenes: {e}")
         import traceback
@@ -631,6 +693,7 @@ def get_patient_exams(patient_id):
         return jsonify({'error': 'Error interno del servidor'}), 500
 
 @app.route('/api/patient/<patient_id>/family')
+@patient_etag(SHEETS_CONFIG['family_members']['name'])
 def get_patient_family(patient_id):
     """Obtiene los familiares de un paciente"""
     try:
@@ -639,18 +702,67 @@ def get_patient_family(patient_id):
             return jsonify({'error': 'Error conectando con la base de datos'}), 500
         
         worksheet = spreadsheet.worksheet(SHEETS_CONFIG['family_members']['name'])
-        records = worksheet.get_all_records()
+        return jsonify({'family': build_family(worksheet, patient_id)})
+    except Exception as e:
+        logger.error(f"Error obteniendo familiares: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@app.route('/api/patient/<patient_id>/dashboard')
+@patient_etag('Consultas', 'Medicamentos', 'Examenes', SHEETS_CONFIG['family_members']['name'])
+def get_patient_dashboard(patient_id):
+    """
+    Consultas, medicamentos, exámenes, familiares y estadísticas del
+    paciente en una sola respuesta. Las hojas que no estén en caché se
+    descargan juntas con un solo values_batch_get. Con ?limit=N el historial
+    trae solo la primera página de cada sección y en 'cursors' el cursor
+    para pedir la siguiente a su ruta.
+    """
+    try:
+        spreadsheet = get_spreadsheet()
+        if not spreadsheet:
+            return jsonify({'error': 'Error conectando con la base de datos'}), 500
+        
+        sections = {
+            'consultations': ('Consultas', build_consultations),
+            'medications': ('Medicamentos', build_medications),
+            'exams': ('Examenes', build_exams),
+            'family': (SHEETS_CONFIG['family_members']['name'], build_family),
+        }
+        worksheets = {}
+        for section, (sheet_name, _) in sections.items():
+            try:
+                worksheets[section] = spreadsheet.worksheet(sheet_name)
+            except gspread.WorksheetNotFound:
+                logger.warning(f"📝 Hoja '{sheet_name}' no encontrada")
         
-        # Filtrar por patient_id
-        patient_family = [r for r in records if str(r.get('patient_id')) == str(patient_id)]
+        table_cache.prefetch(spreadsheet, list(worksheets.values()), CLINICAL_COLUMNS)
         
-        logger.info(f"🔍 Familiares encontrados para paciente {patient_id}: {len(patient_family)}")
+        limit, _ = page_args()
+        dashboard = {'cursors': {}}
+        for section, (_, build) in sections.items():
+            if section not in worksheets:
+                dashboard[section] = []
+            elif section == 'family':
+                dashboard[section] = build(worksheets[section], patient_id)
+            else:
+                dashboard[section], dashboard['cursors'][section] = build(worksheets[section], patient_id, limit)
+        counters = patient_counters(spreadsheet, patient_id)
+        # Igual que /exams: si la hoja no tiene patient_id en la columna B,
+        # buscar por nombre de campo (estructura antigua)
+        if not dashboard['exams'] and 'exams' in worksheets:
+            exam_headers = table_cache.get_columns(worksheets['exams'], CLINICAL_COLUMNS)[:1]
+            if not exam_headers or exam_headers[0][1] != 'patient_id':
+                dashboard['exams'] = build_legacy_exams(worksheets['exams'], patient_id)
+                dashboard['cursors']['exams'] = None
+                counters['exams'] = len(dashboard['exams'])
+        dashboard['stats'] = build_stats(**counters)
+        
+        logger.info(f"📊 Dashboard para paciente {patient_id}: {dashboard['stats']}")
+        return jsonify(dashboard)
         
-        return jsonify({'family': patient_family})
     except Exception as e:
-        logger.error(f"Error obteniendo familiares: {e}")
+        logger.error(f"Error obteniendo dashboard: {e}")
         return jsonify({'error': 'Error interno del servidor'}), 500
-
 # APIs para eliminar datos
 @app.route('/api/patient/<patient_id>/consultations/<consultation_id>', methods=['DELETE'])
 @login_required
@@ -668,18 +780,15 @@ def delete_consultation(patient_id, consultation_id):
         # Usar la hoja 'Consultas' que existe realmente
         try:
             worksheet = spreadsheet.worksheet('Consultas')
-            all_values = worksheet.get_all_values()
-            
-            # Buscar la fila a eliminar
+            # Buscar la fila a eliminar entre las filas del paciente
             row_to_delete = None
-            if len(all_values) > 1:
-                for i, row in enumerate(all_values[1:], start=2):  # Start from row 2 (after headers)
-                    if len(row) > 1 and str(row[0]) == str(consultation_id) and str(row[1]) == str(patient_id):
-                        row_to_delete = i
-                        break
+            for i, row in patient_rows(worksheet, patient_id):
+                if str(row[0]) == str(consultation_id):
+                    row_to_delete = i
+                    break
             
-            if row_to_delete:
-                worksheet.delete_rows(row_to_delete)
+            if row_to_delete and mark_deleted(worksheet, [(row_to_delete, (consultation_id, patient_id))],
+                                              STATUS_COLUMN, ROW_KEY_COLUMNS):
                 logger.info(f"✅ Consulta {consultation_id} eliminada para paciente {patient_id}")
                 return jsonify({'success': True, 'message': 'Consulta eliminada exitosamente'})
             else:
@@ -708,18 +817,15 @@ def delete_medication(patient_id, medication_id):
         # Usar la hoja 'Medicamentos' que existe realmente
         try:
             worksheet = spreadsheet.worksheet('Medicamentos')
-            all_values = worksheet.get_all_values()
-            
-            # Buscar la fila a eliminar
+            # Buscar la fila a eliminar entre las filas del paciente
             row_to_delete = None
-            if len(all_values) > 1:
-                for i, row in enumerate(all_values[1:], start=2):  # Start from row 2 (after headers)
-                    if len(row) > 1 and str(row[0]) == str(medication_id) and str(row[1]) == str(patient_id):
-                        row_to_delete = i
-                        break
+            for i, row in patient_rows(worksheet, patient_id):
+                if str(row[0]) == str(medication_id):
+                    row_to_delete = i
+                    break
             
-            if row_to_delete:
-                worksheet.delete_rows(row_to_delete)
+            if row_to_delete and mark_deleted(worksheet, [(row_to_delete, (medication_id, patient_id))],
+                                              STATUS_COLUMN, ROW_KEY_COLUMNS):
                 logger.info(f"✅ Medicamento {medication_id} eliminado para paciente {patient_id}")
                 return jsonify({'success': True, 'message': 'Medicamento eliminado exitosamente'})
             else:
@@ -748,18 +854,15 @@ def delete_exam(patient_id, exam_id):
         # Usar la hoja 'Examenes' que existe realmente
         try:
             worksheet = spreadsheet.worksheet('Examenes')
-            all_values = worksheet.get_all_values()
-            
-            # Buscar la fila a eliminar
+            # Buscar la fila a eliminar entre las filas del paciente
             row_to_delete = None
-            if len(all_values) > 1:
-                for i, row in enumerate(all_values[1:], start=2):  # Start from row 2 (after headers)
-                    if len(row) > 1 and str(row[0]) == str(exam_id) and str(row[1]) == str(patient_id):
-                        row_to_delete = i
-                        break
+            for i, row in patient_rows(worksheet, patient_id):
+                if str(row[0]) == str(exam_id):
+                    row_to_delete = i
+                    break
             
-            if row_to_delete:
-                worksheet.delete_rows(row_to_delete)
+            if row_to_delete and mark_deleted(worksheet, [(row_to_delete, (exam_id, patient_id))],
+                                              STATUS_COLUMN, ROW_KEY_COLUMNS):
                 logger.info(f"✅ Examen {exam_id} eliminado para paciente {patient_id}")
                 return jsonify({'success': True, 'message': 'Examen eliminado exitosamente'})
             else:
@@ -786,17 +889,26 @@ def delete_family_member(patient_id, family_id):
             return jsonify({'error': 'Error conectando con la base de datos'}), 500
         
         worksheet = spreadsheet.worksheet(SHEETS_CONFIG['family_members']['name'])
-        records = worksheet.get_all_records()
-        
-        # Buscar la fila a eliminar
+        family_values = table_cache.get_columns(worksheet, CLINICAL_COLUMNS)
+        status_column = tombstone_column(worksheet.title, family_values[0] if family_values else [])
+        # Buscar la fila a eliminar entre las filas vigentes del paciente
         row_to_delete = None
-        for i, record in enumerate(records, start=2):  # Start from row 2 (after headers)
-            if str(record.get('id')) == str(family_id) and str(record.get('patient_id')) == str(patient_id):
+        family_rows = table_cache.get_patient_rows(worksheet, patient_id, columns=CLINICAL_COLUMNS)
+        for i, row in live_rows(family_rows, status_column):
+            if str(row[0]) == str(family_id):
                 row_to_delete = i
                 break
         
         if row_to_delete:
-            worksheet.delete_rows(row_to_delete)
+            row_key = [(row_to_delete, (family_id, patient_id))]
+            if status_column is not None:
+                row_to_delete = mark_deleted(worksheet, row_key, status_column, ROW_KEY_COLUMNS)
+            else:
+                # Sin columna de estado se elimina la fila, en su posición actual
+                row_to_delete = table_cache.confirm_rows(worksheet, row_key, ROW_KEY_COLUMNS)[0]
+                if row_to_delete:
+                    table_cache.delete_rows(worksheet, row_to_delete)
+        if row_to_delete:
             logger.info(f"✅ Familiar {family_id} eliminado para paciente {patient_id}")
             return jsonify({'success': True, 'message': 'Familiar eliminado exitosamente'})
         else:
@@ -847,15 +959,18 @@ def update_personal_info():
             return jsonify({'error': 'Error conectando con la base de datos'}), 500
         
         worksheet = spreadsheet.worksheet(SHEETS_CONFIG['users']['name'])
-        records = worksheet.get_all_records()
+        records = table_cache.get_objects(worksheet, Usuario)
         
-        # Buscar el usuario
+        # Buscar el usuario (sin los duplicados marcados como eliminados)
         user_row = None
         for i, record in enumerate(records, start=2):
-            if record.get('id') == user_id:
+            if record.get('id') == user_id and not record.is_deleted():
                 user_row = i
                 break
         
+        if user_row:
+            # La posición cacheada pudo cambiar por una compactación del bot
+            user_row = table_cache.confirm_rows(worksheet, [(user_row, user_id)])[0]
         if not user_row:
             return jsonify({'error': 'Usuario no encontrado'}), 404
         
@@ -872,11 +987,9 @@ def update_personal_info():
         }
         
         # Actualizar fila en Google Sheets
-        headers = worksheet.row_values(1)
-        for field, value in update_data.items():
-            if field in headers:
-                col_index = headers.index(field) + 1
-                worksheet.update_cell(user_row, col_index, value)
+        headers = table_cache.get_header(worksheet)
+        with table_cache.batch(worksheet) as batch:
+            batch.set_fields(user_row, headers, update_data)
         
         # Actualizar sesión
         user_data = session.get('user_data', {})
@@ -970,15 +1083,12 @@ def telegram_webhook():
 def log_bot_interaction(user_id, username, message, chat_id):
     """Registra la interacción del bot en Google Sheets"""
     try:
-        spreadsheet = get_spreadsheet()
-        if not spreadsheet:
+        if not sheets_client:
             return
         
-        worksheet = spreadsheet.worksheet(SHEETS_CONFIG['bot_interactions']['name'])
-        
         # Preparar datos
         row_data = [
-            len(worksheet.get_all_values()) + 1,  # ID auto-incrementado
+            bot_interactions_log.next_id(),  # ID generado localmente
             user_id,
             username,
             message,
@@ -988,7 +1098,7 @@ def log_bot_interaction(user_id, username, message, chat_id):
             'processed'
         ]
         
-        worksheet.append_row(row_data)
+        bot_interactions_log.append(row_data)
         logger.info(f"Interacción registrada para usuario {user_id}")
     except Exception as e:
         logger.error(f"Error registrando interacción: {e}")
@@ -1307,7 +1417,12 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'sheets_cache': table_cache.stats(),
+        'sheet_handles': sheet_handles.stats(),
+        'sheets_quota': quota_governor.stats(),
+        'sheets_resilience': sheets_resilience.stats(),
+        'sheets_refresher': cache_refresher.stats()
     })
 
 # Ruta para favicon
@@ -1364,19 +1479,23 @@ def upload_exam_file(patient_id):
             
             try:
                 worksheet = spreadsheet.worksheet('Examenes')
-                all_values = worksheet.get_all_values()
                 
-                # Buscar la fila del examen
+                # Buscar la fila del examen entre las filas del paciente
                 exam_row = None
-                if len(all_values) > 1:
-                    for i, row in enumerate(all_values[1:], start=2):
-                        if len(row) > 1 and str(row[0]) == str(exam_id) and str(row[1]) == str(patient_id):
-                            exam_row = i
-                            break
+                exam_values = []
+                for i, row in patient_rows(worksheet, patient_id):
+                    if str(row[0]) == str(exam_id):
+                        exam_row = i
+                        exam_values = row
+                        break
                 
+                if exam_row:
+                    # Posición actual de la fila (la compactación del bot la pudo desplazar)
+                    exam_row = table_cache.confirm_rows(worksheet, [(exam_row, (exam_id, patient_id))],
+                                                        ROW_KEY_COLUMNS)[0]
                 if exam_row:
                     # Obtener URLs existentes de archivos
-                    current_file_urls = all_values[exam_row - 1][7] if len(all_values[exam_row - 1]) > 7 else ''
+                    current_file_urls = exam_values[7] if len(exam_values) > 7 else ''
                     
                     # Agregar nueva URL a las existentes
                     new_file_url = f"/uploads/medical_files/{filename}"
@@ -1389,7 +1508,7 @@ def upload_exam_file(patient_id):
                         updated_file_urls = new_file_url
                     
                     # Actualizar la columna file_url (columna 8, índice H)
-                    worksheet.update_cell(exam_row, 8, updated_file_urls)
+                    table_cache.update_cell(worksheet, exam_row, 8, updated_file_urls)
                     
                     logger.info(f"✅ Archivo agregado al examen {exam_id}: {filename}")
                     logger.info(f"📎 URLs de archivos actualizadas: {updated_file_urls}")
@@ -1436,7 +1555,9 @@ def link_existing_users():
             return jsonify({'error': 'Error conectando con la base de datos'}), 500
         
         users_worksheet = spreadsheet.worksheet('Usuarios')
-        all_records = users_worksheet.get_all_records()
+        # Los usuarios marcados como eliminados se ignoran hasta la compactación
+        all_records = [record for record in table_cache.get_objects(users_worksheet, Usuario)
+                       if not record.is_deleted()]
         
         results = {
             'users_checked': 0,
@@ -1559,11 +1680,13 @@ def link_telegram():
         try:
             logger.info("📄 Accediendo a la hoja de Usuarios...")
             users_worksheet = spreadsheet.worksheet('Usuarios')
-            all_records = users_worksheet.get_all_records()
+            all_records = table_cache.get_objects(users_worksheet, Usuario)
             logger.info(f"📊 Total de registros de usuarios: {len(all_records)}")
             
             user_row = None
             for i, record in enumerate(all_records, start=2):  # Start from row 2 (after headers)
+                if record.is_deleted():
+                    continue
                 record_id = record.get('id') or record.get('user_id', '')
                 if str(record_id) == str(user_id):
                     user_row = i
@@ -1573,7 +1696,7 @@ def link_telegram():
             if user_row:
                 logger.info("🔍 Buscando columna telegram_id...")
                 # Buscar la columna telegram_id
-                headers = users_worksheet.row_values(1)
+                headers = table_cache.get_header(users_worksheet)
                 telegram_col = None
                 
                 if 'telegram_id' in headers:
@@ -1582,13 +1705,17 @@ def link_telegram():
                 else:
                     # Agregar la columna telegram_id si no existe
                     logger.info("➕ Agregando columna telegram_id...")
-                    users_worksheet.update_cell(1, len(headers) + 1, 'telegram_id')
+                    table_cache.update_cell(users_worksheet, 1, len(headers) + 1, 'telegram_id')
                     telegram_col = len(headers) + 1
                     logger.info(f"✅ Columna telegram_id agregada en posición: {telegram_col}")
                 
+                # Posición actual de la fila (la compactación del bot la pudo desplazar)
+                user_row = table_cache.confirm_rows(users_worksheet, [(user_row, user_id)])[0]
+            
+            if user_row:
                 logger.info(f"💾 Actualizando telegram_id en fila {user_row}, columna {telegram_col}...")
                 # Actualizar el telegram_id del usuario
-                users_worksheet.update_cell(user_row, telegram_col, telegram_id)
+                table_cache.update_cell(users_worksheet, user_row, telegram_col, telegram_id)
                 
                 logger.info(f"✅ Usuario {user_id} ({user_name}) vinculado con Telegram ID: {telegram_id}")
                 
@@ -1617,35 +1744,17 @@ Ahora puedes:
                 # Verificar si ya hay datos del bot para este telegram_id
                 try:
                     logger.info("🔍 Buscando exámenes del bot...")
-                    examenes_worksheet = spreadsheet.worksheet('Examenes')
-                    
-                    # Leer datos manualmente para evitar error de headers duplicados
-                    all_exam_values = examenes_worksheet.get_all_values()
-                    examenes_records = []
-                    
-                    if len(all_exam_values) > 1:
-                        headers = all_exam_values[0]
-                        for row in all_exam_values[1:]:
-                            if len(row) <= len(headers):
-                                # Crear diccionario manualmente para evitar conflictos
-                                record = {}
-                                for i, header in enumerate(headers):
-                                    if i < len(row):
-                                        record[header] = row[i]
-                                examenes_records.append(record)
-                    
                     # Buscar exámenes guardados por usuarios del bot con este telegram_id
                     bot_user_ids = []
                     for user_record in all_records:
+                        if user_record.is_deleted():
+                            continue
                         if str(user_record.get('telegram_id', '')) == str(telegram_id):
                             bot_user_id = user_record.get('user_id', '')
                             if str(bot_user_id).startswith('USR_'):
                                 bot_user_ids.append(bot_user_id)
                     
-                    exams_found = 0
-                    for exam_record in examenes_records:
-                        if exam_record.get('user_id', '') in bot_user_ids:
-                            exams_found += 1
+                    exams_found = count_exams_by_user(spreadsheet, bot_user_ids)
                     
                     logger.info(f"📊 Exámenes encontrados: {exams_found}, Bot users: {len(bot_user_ids)}")
                     
@@ -1686,6 +1795,17 @@ Ahora puedes:
         traceback.print_exc()
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+def count_exams_by_user(spreadsheet, user_ids):
+    """
+    Cuenta los exámenes de la hoja Examenes guardados por esos user_id del
+    bot, descargando solo la columna user_id (y nada si no hay usuarios)
+    """
+    if not user_ids:
+        return 0
+    user_ids = {str(user_id) for user_id in user_ids}
+    examenes_worksheet = spreadsheet.worksheet('Examenes')
+    return sum(1 for value in table_cache.get_field(examenes_worksheet, 'user_id') if value in user_ids)
+
 @app.route('/api/user/telegram-status')
 @login_required
 def get_telegram_status():
@@ -1700,7 +1820,9 @@ def get_telegram_status():
             return jsonify({'error': 'Error conectando con la base de datos'}), 500
         
         users_worksheet = spreadsheet.worksheet('Usuarios')
-        all_records = users_worksheet.get_all_records()
+        # Los usuarios marcados como eliminados se ignoran hasta la compactación
+        all_records = [record for record in table_cache.get_objects(users_worksheet, Usuario)
+                       if not record.is_deleted()]
         
         telegram_id = None
         for record in all_records:
@@ -1718,33 +1840,15 @@ def get_telegram_status():
         exams_count = 0
         if is_linked:
             try:
-                examenes_worksheet = spreadsheet.worksheet('Examenes')
-                
-                # Leer datos manualmente para evitar error de headers duplicados
-                all_exam_values = examenes_worksheet.get_all_values()
-                examenes_records = []
-                
-                if len(all_exam_values) > 1:
-                    headers = all_exam_values[0]
-                    for row in all_exam_values[1:]:
-                        if len(row) <= len(headers):
-                            record = {}
-                            for i, header in enumerate(headers):
-                                if i < len(row):
-                                    record[header] = row[i]
-                            examenes_records.append(record)
-                
                 # Buscar usuarios del bot con este telegram_id
                 bot_user_ids = []
                 for user_record in all_records:
                     if str(user_record.get('telegram_id', '')) == str(telegram_id):
                         bot_user_id = user_record.get('user_id', '')
-                        if bot_user_id.startswith('USR_'):
+                        if str(bot_user_id).startswith('USR_'):
                             bot_user_ids.append(bot_user_id)
                 
-                for exam_record in examenes_records:
-                    if exam_record.get('user_id', '') in bot_user_ids:
-                        exams_count += 1
+                exams_count = count_exams_by_user(spreadsheet, bot_user_ids)
                         
             except gspread.WorksheetNotFound:
                 pass
@@ -1760,6 +1864,7 @@ def get_telegram_status():
         return jsonify({'error': 'Error interno del servidor'}), 500
 
 @app.route('/api/patient/<patient_id>/stats')
+@patient_etag('Consultas', 'Medicamentos', 'Examenes')
 def get_patient_stats(patient_id):
     """Obtiene las estadísticas del paciente para el dashboard"""
     try:
@@ -1767,67 +1872,9 @@ def get_patient_stats(patient_id):
         if not spreadsheet:
             return jsonify({'error': 'Error conectando con la base de datos'}), 500
         
-        stats = {
-            'consultations': 0,
-            'medications': 0,
-            'exams': 0,
-            'health_score': 95  # Valor base, se puede calcular dinámicamente
-        }
-        
-        # Contar consultas
-        try:
-            consultations_worksheet = spreadsheet.worksheet('Consultas')
-            all_values = consultations_worksheet.get_all_values()
-            
-            if len(all_values) > 1:
-                for row in all_values[1:]:
-                    if len(row) > 1 and str(row[1]) == str(patient_id):
-                        stats['consultations'] += 1
-        except gspread.WorksheetNotFound:
-            logger.warning("📝 Hoja 'Consultas' no encontrada")
-        
-        # Contar medicamentos activos
-        try:
-            medications_worksheet = spreadsheet.worksheet('Medicamentos')
-            all_values = medications_worksheet.get_all_values()
-            
-            if len(all_values) > 1:
-                for row in all_values[1:]:
-                    if len(row) > 1 and str(row[1]) == str(patient_id):
-                        # Solo contar medicamentos activos
-                        status = row[8] if len(row) > 8 else 'activo'
-                        if status.lower() == 'activo':
-                            stats['medications'] += 1
-        except gspread.WorksheetNotFound:
-            logger.warning("📝 Hoja 'Medicamentos' no encontrada")
-        
-        # Contar exámenes
-        try:
-            exams_worksheet = spreadsheet.worksheet('Examenes')
-            all_values = exams_worksheet.get_all_values()
-            
-            if len(all_values) > 1:
-                for row in all_values[1:]:
-                    if len(row) > 1 and str(row[1]) == str(patient_id):
-                        stats['exams'] += 1
-        except gspread.WorksheetNotFound:
-            logger.warning("📝 Hoja 'Examenes' no encontrada")
-        
-        # Calcular puntuación de salud básica
-        # Fórmula simple: base 85% + bonificaciones
-        health_score = 85
-        
-        # Bonificación por tener consultas recientes
-        if stats['consultations'] > 0:
-            health_score += min(stats['consultations'] * 2, 10)  # Máximo +10%
-        
-        # Bonificación por seguir tratamiento
-        if stats['medications'] > 0:
-            health_score += min(stats['medications'] * 3, 5)  # Máximo +5%
-        
-        # Asegurar que no exceda 100%
-        stats['health_score'] = min(health_score, 100)
-        
+        # Conteos materializados: se mantienen con cada alta, baja o cambio
+        # de estado, sin recorrer las filas del paciente
+        stats = build_stats(**patient_counters(spreadsheet, patient_id))
         logger.info(f"📊 Estadísticas para paciente {patient_id}: {stats}")
         return jsonify(stats)
         
@@ -1835,35 +1882,6 @@ def get_patient_stats(patient_id):
         logger.error(f"Error obteniendo estadísticas: {e}")
         return jsonify({'error': 'Error interno del servidor'}), 500
 
-def convert_date_format(date_str):
-    """Convierte fecha de DD/MM/YYYY a YYYY-MM-DD para compatibilidad web"""
-    if not date_str or date_str.strip() == '':
-        return ''
-    
-    try:
-        # Si ya está en formato YYYY-MM-DD, dejarlo como está
-        if len(date_str) == 10 and date_str[4] == '-' and date_str[7] == '-':
-            return date_str
-        
-        # Si está en formato DD/MM/YYYY, convertir
-        if len(date_str) == 10 and date_str[2] == '/' and date_str[5] == '/':
-            day, month, year = date_str.split('/')
-            return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-        
-        # Si está en formato D/M/YYYY o variaciones, normalizar
-        if '/' in date_str:
-            parts = date_str.split('/')
-            if len(parts) == 3:
-                day, month, year = parts
-                return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-        
-        # Si no coincide con ningún patrón conocido, devolver como está
-        return date_str
-        
-    except Exception as e:
-        logger.warning(f"⚠️ Error convirtiendo fecha '{date_str}': {e}")
-        return date_str
-
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
@@ -6,36 +6,41 @@ Maneja registro, login y gestión de sesiones con Google Sheets
 """
 
 import gspread
-from google.oauth2.service_account import Credentials
-import json
+from gspread.utils import a1_to_rowcol
 import bcrypt
 from datetime import datetime
 import uuid
 import re
 import logging
+import threading
+from config import Config
+from backend.database.sheets_cache import table_cache
+from backend.database.records import Usuario
+from backend.database.sheets_client import get_sheets_client
+from backend.database.tombstones import is_tombstone
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configuración
-GOOGLE_SHEETS_ID = "1UvnO2lpZSyv13Hf2eG--kQcTff5BBh7jrZ6taFLJypU"
-
-# Cargar credenciales
-credentials_file = os.environ.get('GOOGLE_CREDENTIALS_FILE', 'credentials.json')
-with open(credentials_file, 'r') as f:
-    GOOGLE_CREDS = json.load(f)
+GOOGLE_SHEETS_ID = Config.GOOGLE_SHEETS_ID
 
 class AuthManager:
+    # Campos de la hoja Usuarios indexados en memoria
+    INDEXED_FIELDS = ('email', 'id', 'telegram_id')
+
     def __init__(self):
         """Inicializar el gestor de autenticación"""
+        # Índices campo -> valor -> número de fila, construidos desde un
+        # único snapshot de la caché y mantenidos con las escrituras propias
+        self._index_lock = threading.RLock()
+        self._index_token = None
+        self._clear_indexes()
+
         try:
-            # Conectar con Google Sheets
-            credentials = Credentials.from_service_account_info(
-                GOOGLE_CREDS, 
-                scopes=['https://www.googleapis.com/auth/spreadsheets']
-            )
-            self.gc = gspread.authorize(credentials)
+            # Conectar con Google Sheets (cliente compartido del proceso)
+            self.gc = get_sheets_client()
             self.spreadsheet = self.gc.open_by_key(GOOGLE_SHEETS_ID)
             
             # Obtener hoja de usuarios
@@ -51,6 +56,98 @@ class AuthManager:
             logger.error(f"❌ Error inicializando AuthManager: {e}")
             raise
 
+    @staticmethod
+    def _index_key(field, value):
+        """Clave normalizada de un valor indexado (emails en minúsculas)"""
+        key = str(value)
+        return key.lower() if field == 'email' else key
+
+    def _clear_indexes(self):
+        self._records = []
+        self._user_index = {field: {} for field in self.INDEXED_FIELDS}
+        self._max_id = 0
+
+    def _index_row(self, row_index):
+        """Agrega una fila de la hoja a los índices"""
+        record = self._records[row_index - 2]
+        try:
+            self._max_id = max(self._max_id, int(record.get('id', 0)))
+        except (TypeError, ValueError):
+            pass
+        # Los usuarios eliminados conservan su id pero no se encuentran
+        if is_tombstone(record.get('estado', '')):
+            return
+        for field in self.INDEXED_FIELDS:
+            value = record.get(field, '')
+            if value == '':
+                continue
+            # Igual que el recorrido secuencial, gana la primera coincidencia
+            self._user_index[field].setdefault(self._index_key(field, value), row_index)
+
+    def _refresh_indexes(self):
+        """Reconstruye los índices si la hoja cambió desde el último snapshot"""
+        records, token = table_cache.get_objects_snapshot(self.users_sheet, Usuario)
+        if token == self._index_token:
+            return
+        self._clear_indexes()
+        self._records = records
+        # Una sola pasada sobre la hoja (la fila 1 son headers)
+        for row_index in range(2, len(records) + 2):
+            self._index_row(row_index)
+        self._index_token = token
+
+    def _find_user(self, field, value):
+        """Retorna (número de fila, registro) del usuario, o (None, None)"""
+        with self._index_lock:
+            self._refresh_indexes()
+            row_index = self._user_index[field].get(self._index_key(field, value))
+            if row_index is None:
+                return None, None
+            return row_index, self._records[row_index - 2]
+
+    def _find_user_row(self, field, value):
+        """
+        Como _find_user, para escribir en la fila: confirma contra la hoja que
+        la fila sigue teniendo el id del usuario (la compactación del bot, en
+        otro servicio, pudo desplazarla) y retorna su número actual.
+        """
+        row_index, record = self._find_user(field, value)
+        if row_index is None:
+            return None, None
+        row_index = table_cache.confirm_rows(self.users_sheet, [(row_index, record.get('id', ''))])[0]
+        if row_index is None:
+            return None, None
+        return row_index, record
+
+    def _write_users(self, write, row_index=None):
+        """
+        Ejecuta una escritura sobre la hoja de usuarios y mantiene los índices.
+        Si la caché aplicó exactamente este cambio sobre el snapshot indexado,
+        solo se reindexa la fila afectada; si no, se reconstruye en la
+        próxima consulta.
+        """
+        token = self._index_token
+        result = write()
+        with self._index_lock:
+            current = table_cache.snapshot_token(self.users_sheet)
+            if token is None or current != (token[0], token[1] + 1) or self._index_token != token:
+                self._index_token = None
+            else:
+                if row_index is not None:
+                    self._index_row(row_index)
+                self._index_token = current
+        return result
+
+    def _update_user_cell(self, column, row_index, value, reindex=False):
+        """
+        Actualiza una celda de la hoja de usuarios (columna en letra).
+        reindex indica que la columna pertenece a un campo indexado.
+        """
+        return self._write_users(
+            lambda: table_cache.update(self.users_sheet, f'{column}{row_index}', value),
+            row_index if reindex else None
+        )
+
     def validate_email(self, email):
         """Validar formato de email"""
         pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -78,11 +175,8 @@ class AuthManager:
     def email_exists(self, email):
         """Verificar si el email ya está registrado"""
         try:
-            all_records = self.users_sheet.get_all_records()
-            for record in all_records:
-                if record.get('email', '').lower() == email.lower():
-                    return True
-            return False
+            row_index, _ = self._find_user('email', email)
+            return row_index is not None
         except Exception as e:
             logger.error(f"Error verificando email: {e}")
             return True  # En caso de error, asumir que existe para evitar duplicados
@@ -90,11 +184,9 @@ class AuthManager:
     def get_next_user_id(self):
         """Obtener el siguiente ID de usuario"""
         try:
-            all_records = self.users_sheet.get_all_records()
-            if not all_records:
-                return 1
-            max_id = max([int(record.get('id', 0)) for record in all_records])
-            return max_id + 1
+            with self._index_lock:
+                self._refresh_indexes()
+                return self._max_id + 1
         except Exception as e:
             logger.error(f"Error obteniendo siguiente ID: {e}")
             return 1
@@ -147,7 +239,10 @@ class AuthManager:
             ]
             
             # Agregar usuario a la hoja
-            self.users_sheet.append_row(row_data)
+            self._write_users(
+                lambda: table_cache.append_row(self.users_sheet, row_data),
+                row_index=len(self._records) + 2
+            )
             
             logger.info(f"✅ Usuario registrado: {user_data['email']}")
             return True, "Usuario registrado exitosamente"
@@ -166,15 +261,7 @@ class AuthManager:
                 return False, "Email y contraseña son requeridos", None
             
             # Buscar usuario
-            all_records = self.users_sheet.get_all_records()
-            user_record = None
-            row_index = None
-            
-            for i, record in enumerate(all_records, start=2):  # Start=2 porque row 1 son headers
-                if record.get('email', '').lower() == email.lower():
-                    user_record = record
-                    row_index = i
-                    break
+            row_index, user_record = self._find_user_row('email', email)
             
             if not user_record:
                 return False, "Email o contraseña incorrectos", None
@@ -189,7 +276,7 @@ class AuthManager:
             
             # Actualizar último acceso
             current_time = datetime.now().isoformat()
-            self.users_sheet.update(f'L{row_index}', current_time)  # Columna L = ultimo_acceso
+            self._update_user_cell('L', row_index, current_time)  # Columna L = ultimo_acceso
             
             # Preparar datos del usuario (sin password_hash)
             user_data = {
@@ -219,14 +306,13 @@ class AuthManager:
     def get_user_by_id(self, user_id):
         """Obtener usuario por ID"""
         try:
-            all_records = self.users_sheet.get_all_records()
-            for record in all_records:
-                if str(record.get('id', '')) == str(user_id):
-                    # Remover password_hash de la respuesta
-                    user_data = record.copy()
-                    user_data.pop('password_hash', None)
-                    return user_data
-            return None
+            _, record = self._find_user('id', user_id)
+            if record is None:
+                return None
+            # Remover password_hash de la respuesta
+            user_data = record.copy()
+            user_data.pop('password_hash', None)
+            return user_data
         except Exception as e:
             logger.error(f"Error obteniendo usuario: {e}")
             return None
@@ -234,13 +320,7 @@ class AuthManager:
     def update_user_profile(self, user_id, update_data):
         """Actualizar perfil de usuario"""
         try:
-            all_records = self.users_sheet.get_all_records()
-            row_index = None
-            
-            for i, record in enumerate(all_records, start=2):
-                if str(record.get('id', '')) == str(user_id):
-                    row_index = i
-                    break
+            row_index, _ = self._find_user_row('id', user_id)
             
             if not row_index:
                 return False, "Usuario no encontrado"
@@ -252,10 +332,13 @@ class AuthManager:
                 'ciudad': 'J'
             }
             
-            # Actualizar campos
+            # Actualizar campos en una sola llamada
+            batch = table_cache.batch(self.users_sheet, raw=True)
             for field, column in updatable_fields.items():
                 if field in update_data:
-                    self.users_sheet.update(f'{column}{row_index}', update_data[field])
+                    batch.set(row_index, a1_to_rowcol(f'{column}1')[1], update_data[field])
+            if batch:
+                self._write_users(batch.flush)
             
             logger.info(f"✅ Perfil actualizado para usuario ID: {user_id}")
             return True, "Perfil actualizado exitosamente"
@@ -268,15 +351,7 @@ class AuthManager:
         """Cambiar contraseña de usuario"""
         try:
             # Obtener usuario actual
-            all_records = self.users_sheet.get_all_records()
-            user_record = None
-            row_index = None
-            
-            for i, record in enumerate(all_records, start=2):
-                if str(record.get('id', '')) == str(user_id):
-                    user_record = record
-                    row_index = i
-                    break
+            row_index, user_record = self._find_user_row('id', user_id)
             
             if not user_record:
                 return False, "Usuario no encontrado"
@@ -292,7 +367,7 @@ class AuthManager:
             
             # Actualizar contraseña
             new_hash = self.hash_password(new_password)
-            self.users_sheet.update(f'C{row_index}', new_hash)  # Columna C = password_hash
+            self._update_user_cell('C', row_index, new_hash)  # Columna C = password_hash
             
             logger.info(f"✅ Contraseña cambiada para usuario ID: {user_id}")
             return True, "Contraseña actualizada exitosamente"
@@ -304,14 +379,13 @@ class AuthManager:
     def get_user_by_email(self, email):
         """Obtener usuario por email"""
         try:
-            all_records = self.users_sheet.get_all_records()
-            for record in all_records:
-                if record.get('email', '').lower() == email.lower():
-                    # Remover password_hash de la respuesta
-                    user_data = record.copy()
-                    user_data.pop('password_hash', None)
-                    return user_data
-            return None
+            _, record = self._find_user('email', email)
+            if record is None:
+                return None
+            # Remover password_hash de la respuesta
+            user_data = record.copy()
+            user_data.pop('password_hash', None)
+            return user_data
         except Exception as e:
             logger.error(f"Error obteniendo usuario por email: {e}")
             return None
@@ -319,14 +393,13 @@ class AuthManager:
     def get_user_by_telegram_id(self, telegram_id):
         """Obtener usuario por ID de Telegram"""
         try:
-            all_records = self.users_sheet.get_all_records()
-            for record in all_records:
-                if str(record.get('telegram_id', '')) == str(telegram_id):
-                    # Remover password_hash de la respuesta
-                    user_data = record.copy()
-                    user_data.pop('password_hash', None)
-                    return user_data
-            return None
+            _, record = self._find_user('telegram_id', telegram_id)
+            if record is None:
+                return None
+            # Remover password_hash de la respuesta
+            user_data = record.copy()
+            user_data.pop('password_hash', None)
+            return user_data
         except Exception as e:
             logger.error(f"Error obteniendo usuario por Telegram ID: {e}")
             return None
@@ -334,16 +407,8 @@ class AuthManager:
     def link_telegram_account(self, email, telegram_id, telegram_username=""):
         """Vincular cuenta de Telegram con usuario existente"""
         try:
-            all_records = self.users_sheet.get_all_records()
-            row_index = None
-            user_record = None
-            
             # Buscar usuario por email
-            for i, record in enumerate(all_records, start=2):
-                if record.get('email', '').lower() == email.lower():
-                    user_record = record
-                    row_index = i
-                    break
+            row_index, user_record = self._find_user_row('email', email)
             
             if not user_record:
                 return False, "Usuario no encontrado con ese email", None
@@ -353,17 +418,20 @@ class AuthManager:
                 return False, "Esta cuenta ya tiene un Telegram vinculado", None
             
             # Verificar si el Telegram ID ya está en uso
-            for record in all_records:
-                if str(record.get('telegram_id', '')) == str(telegram_id) and record.get('telegram_id'):
-                    return False, "Este Telegram ya está vinculado a otra cuenta", None
+            linked_row, _ = self._find_user('telegram_id', telegram_id)
+            if linked_row is not None:
+                return False, "Este Telegram ya está vinculado a otra cuenta", None
+            
+            # Copia local: los registros de la caché son compartidos
+            user_record = user_record.copy()
             
             # Actualizar las columnas de Telegram
             # Asumo que las columnas están en las posiciones siguientes después de verificado:
             # P = telegram_id, Q = telegram_username
             try:
-                self.users_sheet.update(f'P{row_index}', str(telegram_id))  # Columna P = telegram_id
+                self._update_user_cell('P', row_index, str(telegram_id), reindex=True)  # Columna P = telegram_id
                 if telegram_username:
-                    self.users_sheet.update(f'Q{row_index}', telegram_username)  # Columna Q = telegram_username
+                    self._update_user_cell('Q', row_index, telegram_username)  # Columna Q = telegram_username
                 
                 # Actualizar el registro en memoria
                 user_record['telegram_id'] = str(telegram_id)
@@ -374,9 +442,9 @@ class AuthManager:
                 # Si las columnas no existen, las creamos al final
                 self._ensure_telegram_columns()
                 # Reintentar
-                self.users_sheet.update(f'P{row_index}', str(telegram_id))
+                self._update_user_cell('P', row_index, str(telegram_id), reindex=True)
                 if telegram_username:
-                    self.users_sheet.update(f'Q{row_index}', telegram_username)
+                    self._update_user_cell('Q', row_index, telegram_username)
             
             logger.info(f"✅ Telegram vinculado para usuario: {email}")
             return True, f"Cuenta vinculada exitosamente para {user_record['nombre']} {user_record['apellido']}", user_record
@@ -389,7 +457,7 @@ class AuthManager:
         """Asegura que las columnas de Telegram existan en la hoja"""
         try:
             # Obtener la primera fila (headers)
-            headers = self.users_sheet.row_values(1)
+            headers = table_cache.get_header(self.users_sheet)
             
             # Verificar si ya existen las columnas
             telegram_columns = ['telegram_id', 'telegram_username']
@@ -404,7 +472,7 @@ class AuthManager:
                 start_col = len(headers) + 1
                 for i, col_name in enumerate(missing_columns):
                     col_letter = self._number_to_letter(start_col + i)
-                    self.users_sheet.update(f'{col_letter}1', col_name)
+                    table_cache.update(self.users_sheet, f'{col_letter}1', col_name)
                 
                 logger.info(f"✅ Columnas Telegram agregadas: {missing_columns}")
                 
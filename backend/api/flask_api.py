@@ -62,14 +62,7 @@ def login():
         # Buscar usuario por email o teléfono
         # Por simplicidad, buscamos en ambos campos
         # En producción, implementar búsqueda más robusta
-        users = sheets_db.get_worksheet('Usuarios').get_all_records()
-        user = None
-        
-        for record in users:
-            if (record.get('email') == identifier or 
-                record.get('telefono') == identifier):
-                user = record
-                break
+        user = sheets_db.get_user_by_email(identifier) or sheets_db.get_user_by_phone(identifier)
         
         if not user:
             return jsonify({'error': 'Usuario no encontrado'}), 404
@@ -106,11 +99,9 @@ def register():
                 return jsonify({'error': f'Campo {field} requerido'}), 400
         
         # Verificar si el usuario ya existe
-        existing = sheets_db.get_worksheet('Usuarios').get_all_records()
-        for record in existing:
-            if (record.get('email') == data['email'] or 
-                record.get('telefono') == data['telefono']):
-                return jsonify({'error': 'Usuario ya existe'}), 409
+        if (sheets_db.get_user_by_email(data['email']) or
+                sheets_db.get_user_by_phone(data['telefono'])):
+            return jsonify({'error': 'Usuario ya existe'}), 409
         
         # Crear usuario
         user_data = {
@@ -148,13 +139,7 @@ def register():
 def get_profile(current_user_id):
     """Obtiene el perfil del usuario"""
     try:
-        users = sheets_db.get_worksheet('Usuarios').get_all_records()
-        user = None
-        
-        for record in users:
-            if record.get('user_id') == current_user_id:
-                user = record
-                break
+        user = sheets_db.get_user_by_id(current_user_id)
         
         if not user:
             return jsonify({'error': 'Usuario no encontrado'}), 404
@@ -331,8 +316,7 @@ def create_medicamento(current_user_id):
 def get_examenes(current_user_id):
     """Obtiene los exámenes del usuario"""
     try:
-        examenes = sheets_db.get_worksheet('Examenes').get_all_records()
-        user_examenes = [e for e in examenes if e.get('user_id') == current_user_id]
+        user_examenes = sheets_db.find_records('Examenes', 'user_id', current_user_id)
         
         # Ordenar por fecha más reciente
         user_examenes.sort(
@@ -0,0 +1,371 @@
+"""
+Google Sheets simulado en memoria para pruebas y benchmarks
+Reproduce la parte de la API de gspread que usa MedConnect (Client,
+Spreadsheet y Worksheet) sin conexión a internet. Cada método cuenta como
+una llamada HTTP y puede sumar latencia o fallar con errores de cuota (429)
+configurables, para medir el rendimiento en una máquina sin red.
+
+    client = FakeClient(latency=0.15)
+    client.create_spreadsheet('sheet-id', {'Usuarios': [['id', 'email']]})
+    with install(client):
+        ...  # gspread.authorize() y get_sheets_client() devuelven el cliente simulado
+"""
+import random
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional
+import gspread
+from gspread.exceptions import APIError, SpreadsheetNotFound, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, a1_to_rowcol, fill_gaps
+from google.oauth2.service_account import Credentials
+from backend.database.sheets_cache import to_cell, values_to_records
+from backend.database.sheets_client import shared_client
+
+
+class FakeResponse:
+    """Respuesta HTTP mínima para construir un APIError de gspread"""
+
+    def __init__(self, code: int, message: str, status: str):
+        self.status_code = code
+        self._error = {'code': code, 'message': message, 'status': status}
+        self.text = message
+
+    def json(self):
+        return {'error': self._error}
+
+
+def quota_error() -> APIError:
+    """Error 429 igual al que devuelve la API al exceder la cuota"""
+    return APIError(FakeResponse(
+        429, "Quota exceeded for quota metric 'Read requests'", 'RESOURCE_EXHAUSTED'
+    ))
+
+
+def unavailable_error() -> APIError:
+    """Error 503 de una caída del servicio"""
+    return APIError(FakeResponse(503, 'The service is currently unavailable.', 'UNAVAILABLE'))
+
+
+API_ERRORS = {429: quota_error, 503: unavailable_error}
+
+
+class FakeClient:
+    """
+    Cliente simulado. latency (segundos) se suma a cada llamada, con jitter
+    opcional; error_rate es la probabilidad de un 429; quota_per_minute
+    limita las llamadas en una ventana deslizante de 60 segundos.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 quota_per_minute: Optional[int] = None, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self.calls = Counter()
+        self.errors = 0
+        self._failures_pending = 0
+        self._failure_code = 429
+        self._window = deque()
+        self._random = random.Random(seed)
+        self._spreadsheets: Dict[str, 'FakeSpreadsheet'] = {}
+        self._lock = threading.Lock()
+
+    # Contabilidad de llamadas
+    def request(self, method: str):
+        """Registra una llamada a la API, aplica latencia y errores"""
+        with self._lock:
+            self.calls[method] += 1
+            now = time.monotonic()
+            # Código del error a simular (None si la llamada funciona)
+            fail = None
+            if self._failures_pending:
+                self._failures_pending -= 1
+                fail = self._failure_code
+            elif self.error_rate and self._random.random() < self.error_rate:
+                fail = 429
+            elif self.quota_per_minute is not None:
+                while self._window and now - self._window[0] >= 60:
+                    self._window.popleft()
+                if len(self._window) >= self.quota_per_minute:
+                    fail = 429
+                else:
+                    self._window.append(now)
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            with self._lock:
+                self.errors += 1
+            raise API_ERRORS[fail]()
+
+    def fail_next(self, count: int = 1, code: int = 429):
+        """Hace fallar las próximas llamadas con un error de cuota (429) o de servicio (503)"""
+        with self._lock:
+            self._failures_pending += count
+            self._failure_code = code
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors = 0
+            self._window.clear()
+
+    # Superficie de gspread.Client
+    def create_spreadsheet(self, key: str, sheets: Dict[str, List[List[Any]]] = None,
+                           title: str = 'MedConnect') -> 'FakeSpreadsheet':
+        """Crea una planilla con hojas {nombre: filas} (no cuenta como llamada)"""
+        spreadsheet = FakeSpreadsheet(self, key, title)
+        for sheet_title, rows in (sheets or {}).items():
+            spreadsheet._add(sheet_title, rows)
+        self._spreadsheets[key] = spreadsheet
+        return spreadsheet
+
+    def open_by_key(self, key: str) -> 'FakeSpreadsheet':
+        self.request('open_by_key')
+        if key not in self._spreadsheets:
+            raise SpreadsheetNotFound(key)
+        return self._spreadsheets[key]
+
+
+def _cell_value(cell: Dict[str, Any]) -> Any:
+    """Valor de un CellData (spreadsheets.batchUpdate)"""
+    value = cell.get('userEnteredValue', {})
+    return next(iter(value.values()), '')
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: FakeClient, key: str, title: str):
+        self.client = client
+        self.id = key
+        self.title = title
+        self._worksheets: List['FakeWorksheet'] = []
+
+    def _add(self, title: str, rows: List[List[Any]] = None) -> 'FakeWorksheet':
+        worksheet = FakeWorksheet(self, title, len(self._worksheets), rows or [])
+        self._worksheets.append(worksheet)
+        return worksheet
+
+    def worksheet(self, title: str) -> 'FakeWorksheet':
+        self.client.request('worksheet')
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise WorksheetNotFound(title)
+
+    def worksheets(self) -> List['FakeWorksheet']:
+        self.client.request('worksheets')
+        return list(self._worksheets)
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, index=None) -> 'FakeWorksheet':
+        self.client.request('add_worksheet')
+        return self._add(title)
+
+    def batch_update(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        spreadsheets.batchUpdate; se simulan deleteDimension de filas,
+        appendCells y updateCells de valores (userEnteredValue)
+        """
+        self.client.request('spreadsheet_batch_update')
+        for request in body.get('requests', []):
+            kind, params = next(iter(request.items()))
+            grid = params.get('range', params)
+            worksheet = next(ws for ws in self._worksheets if ws.id == grid['sheetId'])
+            with worksheet._lock:
+                if kind == 'deleteDimension':
+                    del worksheet.values[grid['startIndex']:grid['endIndex']]
+                elif kind == 'appendCells':
+                    worksheet._append([[_cell_value(cell) for cell in row.get('values', [])]
+                                       for row in params['rows']])
+                elif kind == 'updateCells':
+                    for offset, row in enumerate(params['rows']):
+                        for col, cell in enumerate(row.get('values', []), grid['startColumnIndex'] + 1):
+                            worksheet._set(grid['startRowIndex'] + offset + 1, col, _cell_value(cell))
+                else:
+                    raise NotImplementedError(kind)
+        return {'spreadsheetId': self.id, 'replies': [{} for _ in body.get('requests', [])]}
+
+    def values_batch_get(self, ranges: List[str], params=None) -> Dict[str, Any]:
+        """Lee varios rangos ('Hoja!A1:C10' o 'Hoja') en una sola llamada"""
+        self.client.request('values_batch_get')
+        value_ranges = []
+        for range_name in ranges:
+            title, _, cells = range_name.partition('!')
+            worksheet = next((ws for ws in self._worksheets if ws.title == title.strip("'")), None)
+            if worksheet is None:
+                raise WorksheetNotFound(title)
+            value_ranges.append({
+                'range': range_name,
+                'majorDimension': 'ROWS',
+                'values': worksheet._read(cells or None)
+            })
+        return {'spreadsheetId': self.id, 'valueRanges': value_ranges}
+
+    def values_batch_update(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Escribe varios rangos ('Hoja!B2') en una sola llamada"""
+        self.client.request('values_batch_update')
+        for item in body.get('data', []):
+            title, _, cells = item['range'].partition('!')
+            worksheet = next((ws for ws in self._worksheets if ws.title == title.strip("'")), None)
+            if worksheet is None:
+                raise WorksheetNotFound(title)
+            with worksheet._lock:
+                worksheet._write_range(cells, item['values'])
+        return {'spreadsheetId': self.id, 'totalUpdatedCells': sum(
+            len(row) for item in body.get('data', []) for row in item['values']
+        )}
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: FakeSpreadsheet, title: str, index: int, rows: List[List[Any]]):
+        self.spreadsheet = spreadsheet
+        self.client = spreadsheet.client
+        self.title = title
+        self.id = index
+        self.values: List[List[str]] = [[to_cell(v) for v in row] for row in rows]
+        self._lock = threading.Lock()
+
+    @property
+    def row_count(self) -> int:
+        return len(self.values)
+
+    # Utilidades internas (no cuentan como llamadas)
+    def _read(self, range_name: Optional[str] = None) -> List[List[str]]:
+        """Valores de un rango A1 como los devuelve la API"""
+        with self._lock:
+            if not self.values:
+                return []
+            rows = fill_gaps(self.values)
+            if range_name:
+                grid = a1_range_to_grid_range(range_name)
+                rows = [row[grid.get('startColumnIndex', 0):grid.get('endColumnIndex')]
+                        for row in rows[grid.get('startRowIndex', 0):grid.get('endRowIndex')]]
+            # La API omite las filas y celdas vacías del final
+            result = []
+            for row in rows:
+                row = list(row)
+                while row and row[-1] == '':
+                    row.pop()
+                result.append(row)
+            while result and not result[-1]:
+                result.pop()
+            return result
+
+    def _set(self, row: int, col: int, value):
+        while len(self.values) < row:
+            self.values.append([])
+        cells = self.values[row - 1]
+        if len(cells) < col:
+            cells.extend([''] * (col - len(cells)))
+        cells[col - 1] = to_cell(value)
+
+    def _write_range(self, range_name: str, values: List[List[Any]]):
+        row, col = a1_to_rowcol(range_name.split(':')[0])
+        for r, row_values in enumerate(values):
+            for c, value in enumerate(row_values):
+                self._set(row + r, col + c, value)
+
+    # Lecturas
+    def get_all_values(self, **kwargs) -> List[List[str]]:
+        self.client.request('get_all_values')
+        values = self._read()
+        return fill_gaps(values) if values else []
+
+    def get_values(self, range_name: str = None, **kwargs) -> List[List[str]]:
+        self.client.request('get_values')
+        values = self._read(range_name)
+        return fill_gaps(values) if values else []
+
+    def get(self, range_name: str = None, **kwargs) -> List[List[str]]:
+        self.client.request('get')
+        return self._read(range_name)
+
+    def batch_get(self, ranges: List[str], **kwargs) -> List[List[List[str]]]:
+        self.client.request('batch_get')
+        return [self._read(range_name) for range_name in ranges]
+
+    def get_all_records(self, **kwargs) -> List[Dict[str, Any]]:
+        self.client.request('get_all_records')
+        values = self._read()
+        return values_to_records(fill_gaps(values)) if values else []
+
+    def row_values(self, row: int, **kwargs) -> List[str]:
+        self.client.request('row_values')
+        rows = self._read(f'{row}:{row}')
+        return rows[0] if rows else []
+
+    def col_values(self, col: int, **kwargs) -> List[str]:
+        self.client.request('col_values')
+        return [row[col - 1] if len(row) >= col else '' for row in self._read()]
+
+    # Escrituras
+    def update_cell(self, row: int, col: int, value):
+        self.client.request('update_cell')
+        with self._lock:
+            self._set(row, col, value)
+
+    def update(self, range_name, values=None, **kwargs):
+        self.client.request('update')
+        if not isinstance(values, list):
+            values = [[values]]
+        with self._lock:
+            self._write_range(range_name, values)
+
+    def batch_update(self, data: List[Dict[str, Any]], **kwargs):
+        self.client.request('batch_update')
+        with self._lock:
+            for item in data:
+                self._write_range(item['range'], item['values'])
+
+    def append_row(self, values: List[Any], **kwargs):
+        self.client.request('append_row')
+        with self._lock:
+            self._append([values])
+
+    def append_rows(self, values: List[List[Any]], **kwargs):
+        self.client.request('append_rows')
+        with self._lock:
+            self._append(values)
+
+    def _append(self, rows: List[List[Any]]):
+        # Igual que la API: se agrega después de la última fila con datos
+        while self.values and not any(self.values[-1]):
+            self.values.pop()
+        self.values.extend([to_cell(v) for v in row] for row in rows)
+
+    def delete_rows(self, start_index: int, end_index: int = None):
+        self.client.request('delete_rows')
+        with self._lock:
+            del self.values[start_index - 1:end_index or start_index]
+
+    def clear(self):
+        self.client.request('clear')
+        with self._lock:
+            self.values = []
+
+
+@contextmanager
+def install(client: FakeClient):
+    """
+    Hace que gspread.authorize(), el cliente compartido y la carga de
+    credenciales devuelvan el cliente simulado mientras dura el bloque
+    """
+    loaders = ('from_service_account_file', 'from_service_account_info')
+    originals = [gspread.authorize] + [Credentials.__dict__[name] for name in loaders]
+    gspread.authorize = lambda *args, **kwargs: client
+    for name in loaders:
+        setattr(Credentials, name, classmethod(lambda cls, *args, **kwargs: None))
+    shared_client.set(client)
+    try:
+        yield client
+    finally:
+        shared_client.reset()
+        gspread.authorize = originals[0]
+        for name, loader in zip(loaders, originals[1:]):
+            setattr(Credentials, name, loader)
@@ -0,0 +1,113 @@
+"""
+Registro diferido (write-behind) de logs en Google Sheets
+Acumula las filas de log en memoria y las envía en lote con append_rows
+desde un hilo en segundo plano, al alcanzar un número de filas o un
+intervalo de tiempo, y al terminar el proceso.
+"""
+import atexit
+import itertools
+import os
+import threading
+import logging
+from datetime import datetime
+from typing import Any, Callable, List
+from config import Config
+from backend.database.sheets_cache import table_cache
+from backend.database.quota import quota_governor
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedLogSink:
+    """
+    Sink de logs con buffer para una hoja (Interacciones_Bot, Logs_Acceso...).
+    get_worksheet se resuelve en cada envío, de modo que una conexión caída
+    no impide seguir encolando filas.
+    """
+
+    def __init__(self, name: str, get_worksheet: Callable[[], Any], id_prefix: str,
+                 max_rows: int = None, flush_interval: float = None, max_pending: int = 5000):
+        self.name = name
+        self.get_worksheet = get_worksheet
+        self.id_prefix = id_prefix
+        self.max_rows = max_rows or Config.LOG_BUFFER_MAX_ROWS
+        self.flush_interval = flush_interval or Config.LOG_BUFFER_FLUSH_SECONDS
+        self.max_pending = max_pending
+
+        self._rows: List[List[Any]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sequence = itertools.count(1)
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        atexit.register(self.close)
+
+    def next_id(self) -> str:
+        """ID único generado localmente, sin leer la hoja"""
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return f"{self.id_prefix}_{timestamp}_{os.getpid()}_{next(self._sequence)}"
+
+    def append(self, row: List[Any]):
+        """Encola una fila; el envío a Google Sheets ocurre en segundo plano"""
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) > self.max_pending:
+                dropped = len(self._rows) - self.max_pending
+                del self._rows[:dropped]
+                logger.warning(f"Log {self.name}: se descartaron {dropped} filas pendientes")
+            pending = len(self._rows)
+        self._ensure_thread()
+        if pending >= self.max_rows:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self) -> int:
+        """Envía las filas pendientes en una sola llamada. Retorna cuántas se enviaron"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            try:
+                # Prioridad de fondo: cede la cuota a las lecturas interactivas
+                with quota_governor.background():
+                    table_cache.append_rows(self.get_worksheet(), rows)
+                return len(rows)
+            except Exception as e:
+                logger.error(f"Error enviando log {self.name} ({len(rows)} filas): {e}")
+                # Reencolar para el siguiente intento, respetando el orden
+                with self._lock:
+                    self._rows[:0] = rows
+                    if len(self._rows) > self.max_pending:
+                        del self._rows[:len(self._rows) - self.max_pending]
+                return 0
+
+    def close(self):
+        """Detiene el hilo y envía lo pendiente (se llama también al salir)"""
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+
+    def _ensure_thread(self):
+        # Tras un fork (workers de gunicorn) el hilo del padre no existe
+        if self._closed or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name=f"log-sink-{self.name}", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
@@ -0,0 +1,133 @@
+"""
+Historial clínico por paciente ordenado por fecha
+PatientTimeline vive junto a la proyección cacheada de una hoja clínica,
+igual que los contadores de patient_stats: mantiene por paciente sus filas
+ordenadas por (fecha, id, secuencia) y la caché lo actualiza con cada inserción,
+borrado o cambio de estado. Una página (más recientes primero) se sirve
+sin ordenar ni recorrer el resto de las filas del paciente.
+
+La paginación es por cursor (keyset): el cursor es la clave de la última
+fila entregada, así que insertar o borrar filas entre páginas no repite
+ni salta registros. Los ids se generan con resolución de segundos
+(CON_%Y%m%d_%H%M%S) y pueden repetirse; la secuencia (número de fila al
+cargar la hoja, y después orden de inserción) desempata la clave.
+"""
+import base64
+import json
+from bisect import bisect_left, insort
+from typing import Dict, Iterator, List, Optional, Tuple
+from backend.database.sheets_cache import table_cache
+from backend.database.tombstones import is_deleted
+from backend.database.patient_stats import (
+    CLINICAL_COLUMNS, CLINICAL_SHEETS, PATIENT_COLUMN, STATUS_COLUMN, sortable_date
+)
+
+# Tamaño máximo de página aceptado por las rutas
+MAX_PAGE_SIZE = 100
+
+SortKey = Tuple[str, str, int]
+
+
+def encode_cursor(key: SortKey) -> str:
+    """Cursor opaco (base64 URL-safe) a partir de la clave (fecha, id, secuencia)"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> SortKey:
+    """Clave (fecha, id, secuencia) de un cursor; ValueError si no es válido"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        # Cursores anteriores, sin secuencia: continúan antes de toda fila con ese (fecha, id)
+        date, row_id, seq = key if len(key) == 3 else key + [0]
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError(f"Cursor inválido: {cursor}")
+    if not isinstance(date, str) or not isinstance(row_id, str) or type(seq) is not int:
+        raise ValueError(f"Cursor inválido: {cursor}")
+    return date, row_id, seq
+
+
+class PatientTimeline:
+    """Filas vigentes de cada paciente, en orden ascendente por (fecha, id, secuencia)"""
+
+    def __init__(self, values: List[List[str]], date_column: int):
+        self.date_column = date_column
+        self.rows: Dict[str, List[Tuple[str, str, int, List[str]]]] = {}
+        # Secuencia de la próxima fila agregada (las filas se agregan al final de la hoja)
+        self.next_seq = len(values) + 1
+        for number, row in enumerate(values[1:], 2):
+            if self._tracked(row):
+                self.rows.setdefault(row[PATIENT_COLUMN], []).append(self._item(row, number))
+        for items in self.rows.values():
+            items.sort(key=lambda item: item[:3])
+
+    def _tracked(self, row: List[str]) -> bool:
+        return len(row) > PATIENT_COLUMN and not is_deleted(row, STATUS_COLUMN)
+
+    def _item(self, row: List[str], seq: int) -> Tuple[str, str, int, List[str]]:
+        date = sortable_date(row[self.date_column]) if len(row) > self.date_column else ''
+        return date, row[0] if row else '', seq, row
+
+    def add(self, row: List[str]):
+        if self._tracked(row):
+            items = self.rows.setdefault(row[PATIENT_COLUMN], [])
+            insort(items, self._item(row, self.next_seq), key=lambda item: item[:3])
+            self.next_seq += 1
+
+    def remove(self, row: List[str]):
+        if not self._tracked(row):
+            return
+        items = self.rows.get(row[PATIENT_COLUMN])
+        if not items:
+            return
+        key = self._item(row, 0)[:2]
+        pos = bisect_left(items, key, key=lambda item: item[:2])
+        end = pos
+        while end < len(items) and items[end][:2] == key:
+            if items[end][3] is row:
+                break
+            end += 1
+        else:
+            # La misma fila ya no está (p. ej. lista reemplazada): quitar una equivalente
+            end = pos if pos < len(items) and items[pos][:2] == key else None
+        if end is not None:
+            del items[end]
+            if not items:
+                del self.rows[row[PATIENT_COLUMN]]
+
+    def newest_first(self, patient_id, after: Optional[SortKey] = None) -> Iterator[Tuple[SortKey, List[str]]]:
+        """(clave, fila) del paciente de la más reciente a la más antigua, anteriores a after"""
+        items = self.rows.get(str(patient_id), [])
+        end = len(items) if after is None else bisect_left(items, after, key=lambda item: item[:3])
+        # Copia de la porción: la caché puede insertar filas mientras se itera
+        for date, row_id, seq, row in reversed(items[:end]):
+            yield (date, row_id, seq), row
+
+
+def patient_timeline(worksheet) -> PatientTimeline:
+    """Historial ordenado de una hoja clínica, mantenido por la caché de tablas"""
+    date_column = CLINICAL_SHEETS[worksheet.title][1]
+    return table_cache.get_aggregate(
+        worksheet, 'patient_timeline',
+        lambda values: PatientTimeline(values, date_column),
+        columns=CLINICAL_COLUMNS
+    )
+
+
+def history_page(worksheet, patient_id, keep=None, limit: Optional[int] = None,
+                 cursor: Optional[str] = None) -> Tuple[List[List[str]], Optional[str]]:
+    """
+    Filas de un paciente, más recientes primero, desde cursor. keep(fila)
+    descarta filas sin contar para el límite. Retorna (filas, cursor de la
+    página siguiente o None); sin limit retorna todas.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    rows, last_key, next_cursor = [], None, None
+    for key, row in patient_timeline(worksheet).newest_first(patient_id, after):
+        if keep is not None and not keep(row):
+            continue
+        if limit is not None and len(rows) >= limit:
+            next_cursor = encode_cursor(last_key)
+            break
+        rows.append(row)
+        last_key = key
+    return rows, next_cursor
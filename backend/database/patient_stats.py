@@ -0,0 +1,210 @@
+"""
+Contadores materializados por paciente
+PatientActivity vive junto a la proyección cacheada de una hoja clínica
+(TableCache.get_aggregate): se construye en una pasada al cargar la hoja y
+después la caché lo actualiza fila a fila con cada inserción, borrado o
+cambio de estado que hagan app.py y el bot. Las estadísticas de un
+paciente (/stats, resumen médico del bot) son búsquedas en diccionarios.
+
+PatientVersions se mantiene igual con un resumen del contenido de las
+filas de cada paciente: patient_version() da el ETag de sus endpoints sin
+leer la hoja mientras la caché esté vigente.
+"""
+import hashlib
+import zlib
+from collections import Counter
+from typing import Dict, List, Any, Optional
+import gspread
+from backend.database.sheets_cache import table_cache
+from backend.database.tombstones import is_deleted
+
+# Columnas de las hojas clínicas que usan las rutas de pacientes
+# (id, patient_id y los 7 campos hasta status); se leen solo esas
+CLINICAL_COLUMNS = 'A:I'
+# Posición de patient_id y status dentro de CLINICAL_COLUMNS
+PATIENT_COLUMN = 1
+STATUS_COLUMN = 8
+# Columnas (1-based) que identifican una fila al confirmar su posición
+# antes de escribir en ella: id y patient_id
+ROW_KEY_COLUMNS = (1, PATIENT_COLUMN + 1)
+
+# Hoja -> (campo de la estadística, posición de la fecha, estado contado)
+CLINICAL_SHEETS = {
+    'Consultas': ('consultations', 4, None),
+    'Medicamentos': ('medications', 5, 'activo'),
+    'Examenes': ('exams', 3, None),
+}
+
+
+def sortable_date(value) -> str:
+    """Fecha como YYYY-MM-DD (acepta también DD/MM/YYYY); '' si no es fecha"""
+    text = str(value).strip()[:10]
+    if len(text) == 10 and text[4] == '-' and text[7] == '-':
+        return text
+    if len(text) == 10 and text[2] == '/' and text[5] == '/':
+        return f'{text[6:]}-{text[3:5]}-{text[:2]}'
+    return ''
+
+
+class PatientActivity:
+    """
+    Filas vigentes por paciente de una hoja clínica y sus fechas. Con
+    active_status solo se cuentan las filas con ese estado (medicamentos
+    activos); la última actividad considera todas las filas vigentes.
+    """
+
+    def __init__(self, values: List[List[str]], date_column: int,
+                 active_status: Optional[str] = None):
+        self.date_column = date_column
+        self.active_status = active_status
+        self.counts: Counter = Counter()
+        self.dates: Dict[str, Counter] = {}
+        for row in values[1:]:
+            self.add(row)
+
+    def _counted(self, row: List[str]) -> bool:
+        if self.active_status is None:
+            return True
+        # Sin columna de estado la fila se considera activa (como /stats)
+        status = row[STATUS_COLUMN] if len(row) > STATUS_COLUMN else self.active_status
+        return status.lower() == self.active_status
+
+    def _update(self, row: List[str], delta: int):
+        if len(row) <= PATIENT_COLUMN or is_deleted(row, STATUS_COLUMN):
+            return
+        patient_id = row[PATIENT_COLUMN]
+        if self._counted(row):
+            self.counts[patient_id] += delta
+            if self.counts[patient_id] <= 0:
+                del self.counts[patient_id]
+
+        date = sortable_date(row[self.date_column]) if len(row) > self.date_column else ''
+        if date:
+            dates = self.dates.setdefault(patient_id, Counter())
+            dates[date] += delta
+            if dates[date] <= 0:
+                del dates[date]
+                if not dates:
+                    del self.dates[patient_id]
+
+    def add(self, row: List[str]):
+        self._update(row, 1)
+
+    def remove(self, row: List[str]):
+        self._update(row, -1)
+
+    def count(self, patient_id) -> int:
+        return self.counts.get(str(patient_id), 0)
+
+    def last_date(self, patient_id) -> str:
+        dates = self.dates.get(str(patient_id))
+        return max(dates) if dates else ''
+
+
+def row_digest(row: List[str]) -> int:
+    """Hash de 64 bits estable entre procesos de una fila (sin celdas vacías al final)"""
+    data = '\x1f'.join(row).rstrip('\x1f').encode('utf-8')
+    return (zlib.crc32(data) << 32) | zlib.adler32(data)
+
+
+class PatientVersions:
+    """
+    Suma (módulo 2^64) de los hashes de las filas de cada paciente: no
+    depende del orden ni del proceso que cargó la hoja, así que dos workers
+    con los mismos datos dan la misma versión. Si la hoja no tiene
+    patient_id en la columna B (estructura antigua) la versión cubre la
+    hoja completa.
+    """
+
+    MASK = (1 << 64) - 1
+
+    def __init__(self, values: List[List[str]]):
+        header = values[0] if values else []
+        self.by_patient = len(header) > PATIENT_COLUMN and header[PATIENT_COLUMN] == 'patient_id'
+        self.digests: Dict[str, int] = {}
+        self.sizes: Counter = Counter()
+        digests, sizes = self.digests, self.sizes
+        for row in values[1:]:
+            if len(row) > PATIENT_COLUMN:
+                key = self._key(row[PATIENT_COLUMN])
+                digests[key] = digests.get(key, 0) + row_digest(row)
+                sizes[key] += 1
+        for key in digests:
+            digests[key] &= self.MASK
+
+    def _key(self, patient_id) -> str:
+        return str(patient_id) if self.by_patient else '*'
+
+    def _update(self, row: List[str], sign: int):
+        if len(row) <= PATIENT_COLUMN:
+            return
+        key = self._key(row[PATIENT_COLUMN])
+        self.digests[key] = (self.digests.get(key, 0) + sign * row_digest(row)) & self.MASK
+        self.sizes[key] += sign
+        if self.sizes[key] <= 0:
+            del self.sizes[key]
+            self.digests.pop(key, None)
+
+    def add(self, row: List[str]):
+        self._update(row, 1)
+
+    def remove(self, row: List[str]):
+        self._update(row, -1)
+
+    def version(self, patient_id) -> str:
+        key = self._key(patient_id)
+        return f'{self.sizes.get(key, 0)}.{self.digests.get(key, 0):016x}'
+
+
+def patient_activity(worksheet) -> PatientActivity:
+    """Contadores de una hoja clínica, mantenidos por la caché de tablas"""
+    _, date_column, active_status = CLINICAL_SHEETS[worksheet.title]
+    return table_cache.get_aggregate(
+        worksheet, 'patient_activity',
+        lambda values: PatientActivity(values, date_column, active_status),
+        columns=CLINICAL_COLUMNS
+    )
+
+
+def patient_counters(spreadsheet, patient_id) -> Dict[str, Any]:
+    """
+    Consultas, medicamentos activos, exámenes y fecha de última actividad
+    (YYYY-MM-DD o '') de un paciente. Las hojas que falten cuentan 0.
+    """
+    counters: Dict[str, Any] = {field: 0 for field, _, _ in CLINICAL_SHEETS.values()}
+    counters['last_activity'] = ''
+    worksheets = []
+    for sheet_name in CLINICAL_SHEETS:
+        try:
+            worksheets.append(spreadsheet.worksheet(sheet_name))
+        except gspread.WorksheetNotFound:
+            continue
+
+    table_cache.prefetch(spreadsheet, worksheets, CLINICAL_COLUMNS)
+    for worksheet in worksheets:
+        activity = patient_activity(worksheet)
+        counters[CLINICAL_SHEETS[worksheet.title][0]] = activity.count(patient_id)
+        counters['last_activity'] = max(counters['last_activity'], activity.last_date(patient_id))
+    return counters
+
+
+def patient_version(spreadsheet, patient_id, sheet_names: List[str]) -> str:
+    """
+    Versión de los datos de un paciente en varias hojas, apta como ETag:
+    cambia con cualquier escritura de sus filas que pase por la caché o
+    con una recarga de la hoja. Las hojas que no existen no participan.
+    """
+    worksheets = []
+    for sheet_name in sheet_names:
+        try:
+            worksheets.append(spreadsheet.worksheet(sheet_name))
+        except gspread.WorksheetNotFound:
+            continue
+
+    table_cache.prefetch(spreadsheet, worksheets, CLINICAL_COLUMNS)
+    parts = [str(patient_id)]
+    for worksheet in worksheets:
+        versions = table_cache.get_aggregate(worksheet, 'patient_versions', PatientVersions,
+                                             columns=CLINICAL_COLUMNS)
+        parts.append(f'{worksheet.title}:{versions.version(patient_id)}')
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:20]
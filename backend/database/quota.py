@@ -0,0 +1,177 @@
+"""
+Control de cuota de Google Sheets compartido entre procesos
+Los workers de gunicorn y el bot comparten la cuota por minuto del
+proyecto. QuotaGovernor es un token bucket cuyo estado vive en un archivo
+SQLite local (Config.SHEETS_QUOTA_DB), así que todos los procesos de la
+máquina descuentan del mismo balde antes de cada llamada a la API.
+
+Las llamadas interactivas (requests web y mensajes del bot) pueden usar
+todo el balde; las de fondo (logs diferidos, compactación), marcadas con
+`with quota_governor.background():`, dejan libre una reserva para las
+interactivas y esperan más. Si la espera necesaria supera el máximo de la
+prioridad la llamada se rechaza con QuotaExhausted en vez de provocar un
+429 de Google.
+"""
+import os
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+
+class QuotaExhausted(Exception):
+    """La llamada esperaría más que el máximo permitido por un token"""
+
+
+class QuotaGovernor:
+    """
+    Token bucket compartido: `per_minute` tokens por minuto, hasta `burst`
+    acumulados. `reserve` es la fracción del balde reservada a las llamadas
+    interactivas. per_minute=0 lo desactiva.
+    """
+
+    def __init__(self, path: str, per_minute: float, burst: int, reserve: float = 0.25,
+                 max_wait: Optional[Dict[str, float]] = None, bucket: str = 'sheets'):
+        self.path = path
+        self.rate = per_minute / 60.0
+        self.capacity = float(max(burst, 1))
+        self.reserve = self.capacity * reserve
+        self.max_wait = max_wait or {INTERACTIVE: 10.0, BACKGROUND: 60.0}
+        self.bucket = bucket
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid: Optional[int] = None
+        # Métricas de este proceso
+        self.acquired = 0
+        self.waits = 0
+        self.waited_seconds = 0.0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    # Prioridad del hilo actual
+    @property
+    def priority(self) -> str:
+        return getattr(self._local, 'priority', INTERACTIVE)
+
+    @contextmanager
+    def background(self):
+        """Las llamadas del bloque son de fondo (ceden tokens a las interactivas)"""
+        previous = self.priority
+        self._local.priority = BACKGROUND
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    # Estado compartido
+    def _connection(self) -> sqlite3.Connection:
+        # Una conexión por proceso: no se hereda a través de fork
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), mode=0o700, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS quota_buckets '
+                         '(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _take(self, floor: float) -> float:
+        """
+        Descuenta un token si quedan más de `floor`; si no, retorna los
+        segundos que faltan para que lo haya (0 si se obtuvo)
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = conn.execute('SELECT tokens, updated FROM quota_buckets WHERE name = ?',
+                                   (self.bucket,)).fetchone()
+                tokens = self.capacity if row is None else min(
+                    self.capacity, row[0] + max(now - row[1], 0) * self.rate
+                )
+                wait = 0.0
+                if tokens - 1 >= floor:
+                    tokens -= 1
+                else:
+                    wait = (floor + 1 - tokens) / self.rate
+                conn.execute('INSERT OR REPLACE INTO quota_buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                             (self.bucket, tokens, now))
+                conn.execute('COMMIT')
+                return wait
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def acquire(self):
+        """Espera un token según la prioridad del hilo; QuotaExhausted si tardaría demasiado"""
+        if not self.enabled:
+            return
+        priority = self.priority
+        floor = self.reserve if priority == BACKGROUND else 0.0
+        max_wait = self.max_wait.get(priority, 0.0)
+        waited = 0.0
+        while True:
+            wait = self._take(floor)
+            if wait <= 0:
+                break
+            if waited + wait > max_wait:
+                with self._lock:
+                    self.rejected += 1
+                logger.warning(f"Cuota de Google Sheets agotada: llamada {priority} rechazada")
+                raise QuotaExhausted(f"Cuota de Google Sheets agotada (espera de {wait:.1f}s)")
+            # Otro proceso puede tomar el token mientras se duerme: se reintenta
+            time.sleep(wait)
+            waited += wait
+
+        with self._lock:
+            self.acquired += 1
+            if waited:
+                self.waits += 1
+                self.waited_seconds += waited
+
+    def govern(self, client):
+        """Hace que cada llamada HTTP del cliente de gspread pase por acquire()"""
+        if not self.enabled or getattr(client, '_quota_governor', None) is self:
+            return client
+        request = client.request
+
+        def governed_request(*args, **kwargs):
+            self.acquire()
+            return request(*args, **kwargs)
+
+        client.request = governed_request
+        client._quota_governor = self
+        return client
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de este proceso (los tokens son compartidos)"""
+        with self._lock:
+            return {
+                'per_minute': round(self.rate * 60, 2),
+                'burst': self.capacity,
+                'acquired': self.acquired,
+                'waits': self.waits,
+                'waited_seconds': round(self.waited_seconds, 3),
+                'rejected': self.rejected
+            }
+
+
+# Instancia global, compartida por app, bot y los hilos de fondo
+quota_governor = QuotaGovernor(
+    Config.SHEETS_QUOTA_DB,
+    per_minute=Config.SHEETS_QUOTA_PER_MINUTE,
+    burst=Config.SHEETS_QUOTA_BURST
+)
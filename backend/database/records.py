@@ -0,0 +1,226 @@
+"""
+Tipos de registro compactos para las filas de la plataforma web
+Cada clase guarda una fila en atributos con __slots__ (uno por columna de
+SHEETS_CONFIG), sin el diccionario por registro de get_all_records(), y
+la serializa con to_json() al formato que espera el frontend.
+
+Las filas se decodifican por nombre de columna con decoder(header). Una
+columna que la hoja no tiene queda en None y se trata como ausente, igual
+que una clave que falta en un registro de get_all_records(); las columnas
+de la hoja que la clase no declara se guardan aparte (extra: los nombres,
+compartidos por todas las filas, y una tupla de valores). Así un
+registro se puede usar donde antes se usaba el diccionario: get(),
+record['campo'] y copy(), que retorna un dict.
+
+TableCache.get_objects() mantiene una lista de registros junto a la
+entrada cacheada de una hoja (se decodifica una sola vez por carga y se
+actualiza con cada escritura).
+"""
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+from gspread.utils import numericise
+from config import SHEETS_CONFIG
+from backend.database.tombstones import is_tombstone
+
+logger = logging.getLogger(__name__)
+
+
+def convert_date_format(date_str):
+    """Convierte fecha de DD/MM/YYYY a YYYY-MM-DD para compatibilidad web"""
+    if not date_str or date_str.strip() == '':
+        return ''
+
+    try:
+        # Si ya está en formato YYYY-MM-DD, dejarlo como está
+        if len(date_str) == 10 and date_str[4] == '-' and date_str[7] == '-':
+            return date_str
+
+        # Si está en formato DD/MM/YYYY, convertir
+        if len(date_str) == 10 and date_str[2] == '/' and date_str[5] == '/':
+            day, month, year = date_str.split('/')
+            return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+
+        # Si está en formato D/M/YYYY o variaciones, normalizar
+        if '/' in date_str:
+            parts = date_str.split('/')
+            if len(parts) == 3:
+                day, month, year = parts
+                return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+
+        # Si no coincide con ningún patrón conocido, devolver como está
+        return date_str
+
+    except Exception as e:
+        logger.warning(f"⚠️ Error convirtiendo fecha '{date_str}': {e}")
+        return date_str
+
+
+# Decodificadores de from_row() por clase
+_row_decoders: Dict[type, Callable] = {}
+
+
+class SheetRecord:
+    """
+    Fila de una hoja con un atributo por columna de FIELDS. Con NUMERIC los
+    valores se convierten como en get_all_records() (números a int/float).
+    """
+
+    __slots__ = ('extra',)
+    FIELDS: Tuple[str, ...] = ()
+    NUMERIC = False
+    # Columna con el estado (para descartar filas eliminadas)
+    STATUS_FIELD = 'status'
+
+    @classmethod
+    def decoder(cls, header: List[str]) -> Callable[[List[str]], 'SheetRecord']:
+        """Función que decodifica filas de una hoja con estos headers"""
+        positions = [(field, header.index(field) if field in header else None) for field in cls.FIELDS]
+        extras = [(name, pos) for pos, name in enumerate(header) if name and name not in cls.FIELDS]
+        extra_names = tuple(name for name, _ in extras)
+        convert = numericise if cls.NUMERIC else None
+
+        def decode(row: List[str]) -> 'SheetRecord':
+            record = cls.__new__(cls)
+            width = len(row)
+            for field, pos in positions:
+                if pos is None:
+                    value = None
+                else:
+                    value = row[pos] if pos < width else ''
+                    if convert is not None:
+                        value = convert(value)
+                setattr(record, field, value)
+            extra = None
+            if extras:
+                values = [row[pos] if pos < width else '' for _, pos in extras]
+                if convert is not None:
+                    values = [convert(value) for value in values]
+                extra = (extra_names, tuple(values))
+            record.extra = extra
+            return record
+        return decode
+
+    @classmethod
+    def from_row(cls, row: List[str]) -> 'SheetRecord':
+        """Decodifica una fila con las columnas en el orden de FIELDS"""
+        decode = _row_decoders.get(cls)
+        if decode is None:
+            decode = _row_decoders[cls] = cls.decoder(list(cls.FIELDS))
+        return decode(row)
+
+    # Acceso como diccionario (formato get_all_records)
+    def get(self, field: str, default: Any = None) -> Any:
+        if field in self.FIELDS:
+            value = getattr(self, field)
+            return default if value is None else value
+        if self.extra is not None and field in self.extra[0]:
+            return self.extra[1][self.extra[0].index(field)]
+        return default
+
+    def __getitem__(self, field: str) -> Any:
+        value = self.get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field: str) -> bool:
+        return self.get(field) is not None
+
+    def copy(self) -> Dict[str, Any]:
+        """Las columnas presentes en la hoja como dict (modificable)"""
+        data = {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+        if self.extra is not None:
+            data.update(zip(*self.extra))
+        return data
+
+    def is_deleted(self) -> bool:
+        return is_tombstone(self.get(self.STATUS_FIELD, ''))
+
+    def to_json(self) -> Dict[str, Any]:
+        """Formato del frontend (por omisión, las columnas de la hoja)"""
+        return self.copy()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.copy()!r})'
+
+
+def _fields(table: str) -> Tuple[str, ...]:
+    return tuple(SHEETS_CONFIG[table]['columns'])
+
+
+class Consulta(SheetRecord):
+    __slots__ = _fields('consultations')
+    FIELDS = _fields('consultations')
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'id': self.id or '',
+            'patient_id': self.patient_id or '',
+            'doctor': self.doctor or '',
+            'specialty': self.specialty or '',
+            'date': convert_date_format(self.date or ''),
+            'diagnosis': self.diagnosis or '',
+            'treatment': self.treatment or '',
+            'notes': self.notes or '',
+            'status': 'completada' if self.status is None else self.status
+        }
+
+
+class Medicamento(SheetRecord):
+    __slots__ = _fields('medications')
+    FIELDS = _fields('medications')
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'id': self.id or '',
+            'patient_id': self.patient_id or '',
+            'name': self.medication or '',
+            'dosage': self.dosage or '',
+            'frequency': self.frequency or '',
+            'prescribing_doctor': self.prescribed_by or '',
+            'start_date': convert_date_format(self.start_date or ''),
+            'end_date': convert_date_format(self.end_date or ''),
+            'instructions': '',  # No disponible en la estructura actual
+            'status': 'activo' if self.status is None else self.status
+        }
+
+
+class Examen(SheetRecord):
+    __slots__ = _fields('exams')
+    FIELDS = _fields('exams')
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'id': self.id or '',
+            'patient_id': self.patient_id or '',
+            'exam_type': self.exam_type or '',
+            'date': convert_date_format(self.date or ''),
+            'results': self.results or '',
+            'lab': self.lab or '',
+            'doctor': self.doctor or '',
+            'file_url': self.file_url or '',
+            'status': 'completado' if self.status is None else self.status
+        }
+
+
+class Familiar(SheetRecord):
+    """Se entrega con las columnas de la hoja, como get_all_records()"""
+    __slots__ = _fields('family_members')
+    FIELDS = _fields('family_members')
+    NUMERIC = True
+
+
+class Usuario(SheetRecord):
+    """
+    Usuario de la plataforma web. Se usa como el registro de
+    get_all_records() (AuthManager); to_json() omite password_hash.
+    """
+    __slots__ = _fields('users') + ('telegram_id',)
+    FIELDS = _fields('users') + ('telegram_id',)
+    NUMERIC = True
+    STATUS_FIELD = 'estado'
+
+    def to_json(self) -> Dict[str, Any]:
+        data = self.copy()
+        data.pop('password_hash', None)
+        return data
@@ -0,0 +1,99 @@
+"""
+Refresco anticipado de las hojas más consultadas (stale-while-revalidate)
+CacheRefresher corre en un hilo de fondo en cada proceso (workers web y
+bot) y cada Config.SHEETS_REFRESH_SECONDS vuelve a leer las vistas
+cacheadas de las hojas calientes (Config.SHEETS_REFRESH_SHEETS) antes de
+que venza su TTL. Los requests siguen usando la copia anterior mientras se
+descarga la nueva, así que en régimen normal ninguno espera a Google Sheets.
+
+Solo se refrescan las vistas que algún request usó en los últimos
+IDLE_TTLS TTL. Con la caché compartida el primer proceso que refresca una
+hoja publica la copia y los demás la adoptan sin llamar a la API; el
+intervalo lleva jitter para que los procesos no coincidan.
+"""
+import os
+import random
+import threading
+import logging
+from typing import Callable, Dict, Any, List
+from config import Config
+from backend.database.sheets_cache import table_cache, TableCache
+from backend.database.quota import quota_governor
+
+logger = logging.getLogger(__name__)
+
+# Vistas sin uso durante más de estos TTL dejan de refrescarse
+IDLE_TTLS = 5
+
+
+class CacheRefresher:
+    """
+    Refresca las vistas de `sheets` a las que les quedan menos de dos
+    intervalos de TTL. interval=0 lo desactiva.
+    """
+
+    def __init__(self, get_spreadsheet: Callable, sheets: List[str] = None,
+                 interval: float = None, cache: TableCache = None):
+        self.get_spreadsheet = get_spreadsheet
+        self.sheets = sheets or Config.SHEETS_REFRESH_SHEETS
+        self.interval = interval if interval is not None else Config.SHEETS_REFRESH_SECONDS
+        self.cache = cache or table_cache
+        self.runs = 0
+        self.refreshed = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def margin(self) -> float:
+        """Segundos de TTL restantes bajo los que una vista se refresca"""
+        return min(2 * self.interval, self.cache.ttl / 2)
+
+    def run_once(self) -> int:
+        """Refresca las vistas próximas a vencer; retorna cuántas"""
+        if self.cache.ttl <= 0:
+            return 0
+        # Prioridad de fondo: cede la cuota a los requests
+        with quota_governor.background():
+            spreadsheet = self.get_spreadsheet()
+            if spreadsheet is None:
+                return 0
+            refreshed = self.cache.refresh_ahead(spreadsheet, self.sheets, self.margin,
+                                                 idle=IDLE_TTLS * self.cache.ttl)
+        with self._lock:
+            self.runs += 1
+            self.refreshed += refreshed
+        return refreshed
+
+    def start(self):
+        """Inicia el refresco en un hilo de fondo (uno por proceso)"""
+        # Tras un fork (workers de gunicorn) el hilo del padre no existe
+        if self.interval <= 0 or self._stop.is_set() or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='sheets-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval * self._random.uniform(0.8, 1.2)):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error en el refresco anticipado de hojas: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'margin': self.margin,
+                'runs': self.runs,
+                'refreshed': self.refreshed
+            }
@@ -0,0 +1,197 @@
+"""
+Reintentos y circuit breaker para las llamadas a Google Sheets
+SheetsResilience envuelve Client.request del cliente compartido (igual que
+el control de cuota): los errores transitorios (429, 5xx, caídas de red)
+se reintentan con backoff exponencial con jitter y, si las llamadas siguen
+fallando, el circuit breaker se abre y las siguientes fallan de inmediato
+con SheetsUnavailable durante Config.SHEETS_BREAKER_RESET_SECONDS.
+
+Mientras tanto la caché de tablas sigue respondiendo con la última copia
+de cada hoja, marcada como vencida (ver TableCache.take_stale()).
+"""
+import random
+import threading
+import time
+import logging
+from typing import Callable, Dict, Any, Optional
+import requests
+from gspread.exceptions import APIError
+from config import Config
+from backend.database.quota import QuotaExhausted
+
+logger = logging.getLogger(__name__)
+
+# Códigos de la API que indican un error transitorio
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+NETWORK_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class SheetsUnavailable(Exception):
+    """El circuit breaker está abierto: no se llama a Google Sheets"""
+
+
+def error_code(error: Exception) -> Optional[int]:
+    """Código HTTP de un APIError de gspread (None si no es uno)"""
+    if not isinstance(error, APIError):
+        return None
+    try:
+        return int(error.response.json()['error']['code'])
+    except Exception:
+        return getattr(getattr(error, 'response', None), 'status_code', None)
+
+
+def is_transient(error: Exception) -> bool:
+    """Si el error se debe a la disponibilidad del servicio y no a la llamada"""
+    return (error_code(error) in RETRYABLE_CODES or isinstance(error, NETWORK_ERRORS)
+            or isinstance(error, (SheetsUnavailable, QuotaExhausted)))
+
+
+class CircuitBreaker:
+    """
+    Se abre tras `failure_threshold` fallos seguidos y rechaza llamadas
+    durante `reset_timeout` segundos; luego deja pasar una llamada de
+    prueba (medio abierto) que lo cierra si funciona
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Autoriza una llamada o lanza SheetsUnavailable"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            self.rejected += 1
+        raise SheetsUnavailable("Google Sheets no disponible (circuit breaker abierto)")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("✅ Google Sheets disponible de nuevo: circuit breaker cerrado")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"⚠️ Circuit breaker de Google Sheets abierto tras {self.failures} fallos")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """Termina una llamada que no cuenta como éxito ni como fallo"""
+        with self._lock:
+            self._trial_running = False
+
+
+class SheetsResilience:
+    """
+    Reintentos con backoff exponencial (jitter completo) y circuit breaker.
+    Las lecturas (GET) se reintentan ante cualquier error transitorio; las
+    escrituras solo ante 429, porque un 5xx o una caída de red no garantiza
+    que la escritura no se haya aplicado.
+    """
+
+    def __init__(self, retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                 breaker: Optional[CircuitBreaker] = None, sleep: Callable[[float], None] = time.sleep):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.sleep = sleep
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self.retried = 0
+        self.failed = 0
+
+    def _should_retry(self, error: Exception, method: str) -> bool:
+        if error_code(error) == 429:
+            return True
+        return str(method).lower() == 'get' and (
+            error_code(error) in RETRYABLE_CODES or isinstance(error, NETWORK_ERRORS)
+        )
+
+    def delay(self, attempt: int) -> float:
+        """Espera antes del reintento número attempt (0, 1, ...)"""
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, request: Callable, method: str, *args, **kwargs):
+        """Ejecuta request(method, ...) con reintentos y circuit breaker"""
+        self.breaker.allow()
+        attempt = 0
+        while True:
+            try:
+                result = request(method, *args, **kwargs)
+            except QuotaExhausted:
+                # Límite local: no dice nada sobre la disponibilidad de Google
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    # La API respondió (404, 400...): el servicio está disponible
+                    self.breaker.record_success()
+                    raise
+                if attempt < self.retries and self._should_retry(e, method):
+                    with self._lock:
+                        self.retried += 1
+                    self.sleep(self.delay(attempt))
+                    attempt += 1
+                    continue
+                with self._lock:
+                    self.failed += 1
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def protect(self, client):
+        """Hace que cada llamada HTTP del cliente de gspread pase por call()"""
+        if getattr(client, '_sheets_resilience', None) is self:
+            return client
+        request = client.request
+
+        def resilient_request(method, *args, **kwargs):
+            return self.call(request, method, *args, **kwargs)
+
+        client.request = resilient_request
+        client._sheets_resilience = self
+        return client
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'breaker': self.breaker.state,
+                'times_opened': self.breaker.times_opened,
+                'rejected': self.breaker.rejected,
+                'retried': self.retried,
+                'failed': self.failed
+            }
+
+
+# Instancia global para el cliente compartido
+sheets_resilience = SheetsResilience(
+    retries=Config.SHEETS_RETRIES,
+    base_delay=Config.SHEETS_RETRY_BASE_SECONDS,
+    max_delay=Config.SHEETS_RETRY_MAX_SECONDS,
+    breaker=CircuitBreaker(Config.SHEETS_BREAKER_FAILURES, Config.SHEETS_BREAKER_RESET_SECONDS)
+)
@@ -0,0 +1,324 @@
+"""
+Detección de cambios por hoja sin descargarla
+Cada escritura hecha a través de TableCache (app.py, bot.py, SheetsManager,
+AuthManager) marca la hoja con un token nuevo en la worksheet de versiones
+(Config.SHEETS_VERSION_SHEET, columnas hoja | version). El token viaja en
+la misma llamada que los datos (token_ranges en un values_batch_update,
+token_requests en un spreadsheets.batchUpdate), así que ningún proceso ve
+los datos nuevos con la versión anterior y la escritura no cuesta llamadas
+extra. Solo las escrituras que no se pueden combinar (clear, opciones de
+gspread) escriben el token con mark_changed después de los datos; si falla,
+se reintenta en segundo plano cada SHEETS_VERSION_FLUSH_SECONDS.
+
+Cuando una entrada de la caché vence, TableCache compara la versión
+registrada al cargarla con la actual: signatures() lee las versiones de
+todas las hojas en una sola llamada (cacheada unos segundos), y si la hoja
+no cambió la entrada se da por vigente sin descargarla. Las ediciones
+manuales en Google Sheets no cambian la versión: se ven en la siguiente
+recarga completa (SHEETS_FULL_SYNC_SECONDS).
+
+La información de modificación de Drive (modifiedTime) no sirve para esto:
+es de todo el documento y cambia cada pocos segundos con los logs.
+"""
+import atexit
+import os
+import secrets
+import threading
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import absolute_range_name
+from config import Config
+from backend.database.quota import quota_governor
+from backend.database.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def _new_token() -> str:
+    return f'{int(time.time())}-{secrets.token_hex(4)}'
+
+
+class RevisionTracker:
+    """
+    Versiones de las hojas `tracked` en la worksheet `sheet_name`. Una hoja
+    puede tener varias filas (dos procesos la registraron a la vez): su
+    versión es la unión de todos sus tokens.
+    """
+
+    def __init__(self, sheet_name: str, tracked: Iterable[str], flush_interval: float = 1.0,
+                 probe_ttl: float = 2.0):
+        self.sheet_name = sheet_name
+        self.tracked = set(tracked) - {sheet_name}
+        self.flush_interval = flush_interval
+        self.probe_ttl = probe_ttl
+        # Hojas cuyo token no se pudo escribir (se reintentan), por spreadsheet
+        self._pending: Dict[str, Tuple[Any, Set[str]]] = {}
+        # Última lectura por spreadsheet: (momento, versión por hoja)
+        self._probes: Dict[str, Tuple[float, Dict[str, str]]] = {}
+        # Filas de cada hoja en la worksheet de versiones, por spreadsheet
+        self._positions: Dict[str, Dict[str, List[int]]] = {}
+        self._worksheets: Dict[str, Any] = {}
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        # Métricas de este proceso
+        self.probes = 0
+        self.marked = 0
+        self.inline = 0
+        self.flushes = 0
+        self.errors = 0
+        atexit.register(self.close)
+
+    def tracks(self, title: str) -> bool:
+        return title in self.tracked
+
+    # Lectura de versiones
+    def signatures(self, spreadsheet) -> Optional[Dict[str, str]]:
+        """
+        Versión de cada hoja ('' si nunca se registró una escritura), leída
+        hace menos de probe_ttl segundos. None si no se pudo leer.
+        """
+        with self._lock:
+            cached = self._probes.get(spreadsheet.id)
+        if cached is not None and time.monotonic() - cached[0] < self.probe_ttl:
+            return cached[1]
+        try:
+            return self._flights.do(spreadsheet.id, lambda: self._probe(spreadsheet))[0]
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.warning(f"No se pudieron leer las versiones de las hojas: {e}")
+            return None
+
+    def _probe(self, spreadsheet) -> Tuple[Dict[str, str], Dict[str, List[int]]]:
+        """Lee todas las versiones en una sola llamada"""
+        read_at = time.monotonic()
+        worksheet = self._worksheet(spreadsheet, create=False)
+        rows = worksheet.get('A2:B') if worksheet is not None else []
+        tokens: Dict[str, List[str]] = {}
+        positions: Dict[str, List[int]] = {}
+        for number, row in enumerate(rows, 2):
+            if not row or not row[0]:
+                continue
+            title = str(row[0])
+            tokens.setdefault(title, []).append(str(row[1]) if len(row) > 1 else '')
+            positions.setdefault(title, []).append(number)
+        signatures = {title: '|'.join(values) for title, values in tokens.items()}
+        with self._lock:
+            self.probes += 1
+            self._probes[spreadsheet.id] = (read_at, signatures)
+            self._positions[spreadsheet.id] = positions
+        return signatures, positions
+
+    def _worksheet(self, spreadsheet, create: bool):
+        """Handle de la worksheet de versiones (la crea si create y no existe)"""
+        with self._lock:
+            worksheet = self._worksheets.get(spreadsheet.id)
+        if worksheet is not None:
+            return worksheet
+        try:
+            worksheet = spreadsheet.worksheet(self.sheet_name)
+        except WorksheetNotFound:
+            if not create:
+                return None
+            worksheet = spreadsheet.add_worksheet(title=self.sheet_name, rows=100, cols=2)
+            worksheet.append_row(['hoja', 'version'], value_input_option='RAW')
+            logger.info(f"📄 Hoja de versiones '{self.sheet_name}' creada")
+        with self._lock:
+            self._worksheets[spreadsheet.id] = worksheet
+        return worksheet
+
+    # Registro de escrituras
+    def _rows_for(self, worksheet) -> Optional[List[int]]:
+        """
+        Filas de la hoja en la worksheet de versiones ([] si todavía no
+        tiene). Se leen una vez por proceso (las lecturas de la caché ya las
+        dejan conocidas). None si la hoja no se registra, la worksheet de
+        versiones no existe o no se pudo leer.
+        """
+        if not self.tracks(worksheet.title):
+            return None
+        spreadsheet = worksheet.spreadsheet
+        with self._lock:
+            positions = self._positions.get(spreadsheet.id)
+        if positions is None:
+            try:
+                positions = self._flights.do(spreadsheet.id, lambda: self._probe(spreadsheet))[1]
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                logger.warning(f"No se pudieron leer las versiones de las hojas: {e}")
+                return None
+        with self._lock:
+            if self._worksheets.get(spreadsheet.id) is None:
+                return None
+        return positions.get(worksheet.title, [])
+
+    def token_ranges(self, worksheet) -> Optional[List[Dict[str, Any]]]:
+        """
+        Rangos de values_batch_update con un token nuevo para la hoja, para
+        enviarlos junto con los datos. None si no se puede (la hoja no tiene
+        fila de versión: se usa mark_changed después de escribir)
+        """
+        rows = self._rows_for(worksheet)
+        if not rows:
+            return None
+        token = _new_token()
+        return [{'range': absolute_range_name(self.sheet_name, f'B{row}'), 'values': [[token]]}
+                for row in rows]
+
+    def token_requests(self, worksheet) -> Optional[List[Dict[str, Any]]]:
+        """
+        Lo mismo como pedidos de spreadsheets.batchUpdate (updateCells, o
+        appendCells si la hoja todavía no tiene fila de versión)
+        """
+        rows = self._rows_for(worksheet)
+        with self._lock:
+            versions = self._worksheets.get(worksheet.spreadsheet.id)
+        if rows is None or versions is None:
+            return None
+        token = _new_token()
+        if not rows:
+            return [{'appendCells': {
+                'sheetId': versions.id,
+                'rows': [{'values': [{'userEnteredValue': {'stringValue': worksheet.title}},
+                                     {'userEnteredValue': {'stringValue': token}}]}],
+                'fields': 'userEnteredValue'
+            }}]
+        return [{'updateCells': {
+            'range': {'sheetId': versions.id, 'startRowIndex': row - 1, 'endRowIndex': row,
+                      'startColumnIndex': 1, 'endColumnIndex': 2},
+            'rows': [{'values': [{'userEnteredValue': {'stringValue': token}}]}],
+            'fields': 'userEnteredValue'
+        }} for row in rows]
+
+    def registered(self, worksheet):
+        """La escritura que llevaba los tokens de token_ranges/token_requests se confirmó"""
+        spreadsheet_id = worksheet.spreadsheet.id
+        with self._lock:
+            self.marked += 1
+            self.inline += 1
+            # La próxima consulta debe ver el token nuevo (y la fila agregada)
+            self._probes.pop(spreadsheet_id, None)
+            if not self._positions.get(spreadsheet_id, {}).get(worksheet.title):
+                self._positions.pop(spreadsheet_id, None)
+
+    def mark_changed(self, worksheet):
+        """
+        Escribe un token nuevo para la hoja después de una escritura que no
+        lo llevaba. Si falla, la escritura de datos no se interrumpe: el
+        token queda pendiente y se reintenta en segundo plano
+        """
+        if not self.tracks(worksheet.title):
+            return
+        spreadsheet = worksheet.spreadsheet
+        with self._lock:
+            self.marked += 1
+        try:
+            with self._flush_lock:
+                self._write_tokens(spreadsheet, {worksheet.title})
+        except Exception as e:
+            logger.warning(f"Versión de {worksheet.title} pendiente, se reintentará: {e}")
+            with self._lock:
+                self.errors += 1
+                _, titles = self._pending.setdefault(spreadsheet.id, (spreadsheet, set()))
+                titles.add(worksheet.title)
+            self._ensure_thread()
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(titles) for _, titles in self._pending.values())
+
+    def flush(self) -> int:
+        """Reintenta los tokens pendientes. Retorna cuántas hojas se registraron"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            written = 0
+            for spreadsheet_id, (spreadsheet, titles) in pending.items():
+                try:
+                    # Prioridad de fondo: cede la cuota a los requests
+                    with quota_governor.background():
+                        self._write_tokens(spreadsheet, titles)
+                    written += len(titles)
+                except Exception as e:
+                    logger.error(f"Error registrando versiones de {', '.join(sorted(titles))}: {e}")
+                    with self._lock:
+                        self.errors += 1
+                        _, queued = self._pending.setdefault(spreadsheet_id, (spreadsheet, set()))
+                        queued.update(titles)
+            return written
+
+    def _write_tokens(self, spreadsheet, titles: Set[str]):
+        worksheet = self._worksheet(spreadsheet, create=True)
+        with self._lock:
+            positions = self._positions.get(spreadsheet.id)
+        if positions is None:
+            positions = self._probe(spreadsheet)[1]
+
+        data, new_rows = [], []
+        for title in sorted(titles):
+            token = _new_token()
+            if positions.get(title):
+                data += [{'range': absolute_range_name(self.sheet_name, f'B{row}'), 'values': [[token]]}
+                         for row in positions[title]]
+            else:
+                new_rows.append([title, token])
+        if data:
+            spreadsheet.values_batch_update({'valueInputOption': 'RAW', 'data': data})
+        if new_rows:
+            worksheet.append_rows(new_rows, value_input_option='RAW')
+        with self._lock:
+            self.flushes += 1
+            # La próxima consulta debe ver los tokens nuevos (y las filas agregadas)
+            self._probes.pop(spreadsheet.id, None)
+            if new_rows:
+                self._positions.pop(spreadsheet.id, None)
+
+    def close(self):
+        """Detiene el hilo y reintenta lo pendiente (se llama también al salir)"""
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+
+    def _ensure_thread(self):
+        # Tras un fork (workers de gunicorn) el hilo del padre no existe
+        if self._closed or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='sheets-revisions', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'probes': self.probes,
+                'marked': self.marked,
+                'inline': self.inline,
+                'flushes': self.flushes,
+                'pending': sum(len(titles) for _, titles in self._pending.values()),
+                'errors': self.errors
+            }
+
+
+# Instancia global (None si Config.SHEETS_VERSION_SHEET está vacío)
+revision_tracker = RevisionTracker(
+    Config.SHEETS_VERSION_SHEET,
+    Config.SHEETS_VERSIONED_SHEETS,
+    flush_interval=Config.SHEETS_VERSION_FLUSH_SECONDS
+) if Config.SHEETS_VERSION_SHEET else None
@@ -0,0 +1,52 @@
+"""
+Esquema de las tablas de MedConnect
+Headers de cada hoja, compartidos por todos los backends de almacenamiento
+"""
+from typing import Dict, List
+
+SHEET_HEADERS: Dict[str, List[str]] = {
+    'Usuarios': [
+        'user_id', 'telegram_id', 'nombre', 'apellido', 'edad',
+        'rut', 'telefono', 'email', 'direccion', 'fecha_registro',
+        'estado', 'plan'
+    ],
+    'Atenciones_Medicas': [
+        'atencion_id', 'user_id', 'fecha', 'hora', 'tipo_atencion',
+        'especialidad', 'profesional', 'centro_salud', 'diagnostico',
+        'tratamiento', 'observaciones', 'proxima_cita', 'estado'
+    ],
+    'Medicamentos': [
+        'medicamento_id', 'user_id', 'atencion_id', 'nombre_medicamento',
+        'dosis', 'frecuencia', 'duracion', 'indicaciones',
+        'fecha_inicio', 'fecha_fin', 'estado'
+    ],
+    'Examenes': [
+        'examen_id', 'user_id', 'atencion_id', 'tipo_examen',
+        'nombre_examen', 'fecha_solicitud', 'fecha_realizacion',
+        'resultado', 'archivo_url', 'observaciones', 'estado'
+    ],
+    'Familiares_Autorizados': [
+        'familiar_id', 'user_id', 'nombre_familiar', 'parentesco',
+        'telefono', 'email', 'telegram_id', 'permisos',
+        'fecha_autorizacion', 'estado', 'notificaciones'
+    ],
+    'Recordatorios': [
+        'reminder_id', 'user_id', 'tipo', 'titulo', 'mensaje',
+        'fecha_programada', 'hora_programada', 'frecuencia',
+        'notificar_familiares', 'fecha_creacion', 'estado'
+    ],
+    'Logs_Acceso': [
+        'log_id', 'user_id', 'accion', 'detalle', 'ip_address',
+        'timestamp', 'resultado'
+    ]
+}
+
+DEFAULT_HEADERS = ['id', 'data', 'timestamp']
+
+# Columnas por las que se buscan registros (índices en los backends locales)
+INDEXED_COLUMNS = ('user_id', 'patient_id', 'telegram_id', 'email')
+
+
+def get_headers(sheet_name: str) -> List[str]:
+    """Headers de una hoja; las hojas desconocidas usan un esquema genérico"""
+    return SHEET_HEADERS.get(sheet_name, DEFAULT_HEADERS)
@@ -0,0 +1,250 @@
+"""
+Copias de hojas compartidas entre procesos (workers de gunicorn y bot)
+SharedSnapshots guarda en un archivo SQLite local (Config.SHEETS_SHARED_CACHE_DB)
+la última copia descargada de cada hoja o proyección, junto con una
+generación por hoja que cualquier proceso incrementa al escribir en ella.
+
+TableCache la usa como segundo nivel: antes de descargar una hoja busca una
+copia vigente de la generación actual, y después de descargarla la publica
+para los demás procesos. Una entrada local cuya generación ya no es la del
+archivo está desactualizada, así que la escritura de un worker invalida la
+copia de los demás en su siguiente lectura.
+
+Es solo una caché: si el archivo no está disponible los métodos retornan
+None/False y TableCache se comporta como una caché por proceso.
+
+Las copias se leen con marshal, así que el archivo debe ser de confianza:
+se crea con permisos 0600 en un directorio 0700, y si ya existe (o sus
+auxiliares -wal/-shm) y es de otro usuario o lo pueden escribir otros, se
+rechaza en vez de usarse.
+"""
+import marshal
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+import logging
+from typing import Dict, List, Tuple, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# marshal depende de la versión de Python: las copias de otra versión se ignoran
+FORMAT = f'marshal{marshal.version}-py{sys.version_info[0]}.{sys.version_info[1]}'
+
+
+def dump_rows(values: List[List[str]]) -> bytes:
+    """Serializa los valores de una hoja para store() (más barato que copiarlos)"""
+    return marshal.dumps(values)
+
+
+class UnsafeCacheFile(OSError):
+    """El archivo de la caché compartida podría haberlo escrito otro usuario"""
+
+
+def _check_private(path: str, info: os.stat_result):
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        raise UnsafeCacheFile(f"{path} pertenece a otro usuario (uid {info.st_uid})")
+    if info.st_mode & 0o022:
+        raise UnsafeCacheFile(f"{path} lo pueden modificar otros usuarios")
+
+
+def ensure_private_file(path: str):
+    """
+    Crea el archivo (y su directorio) solo para este usuario, o verifica
+    que el existente sea de este usuario y nadie más pueda escribirlo.
+    UnsafeCacheFile si no es así.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    try:
+        info = os.fstat(fd)
+        _check_private(path, info)
+        if info.st_mode & 0o077:
+            # Archivo de una versión anterior: solo este usuario lo lee
+            os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+    # SQLite abre los auxiliares del WAL si ya existen
+    for auxiliary in (path + '-wal', path + '-shm'):
+        try:
+            _check_private(auxiliary, os.lstat(auxiliary))
+        except FileNotFoundError:
+            pass
+
+
+class SharedSnapshots:
+    """
+    Copias versionadas por (spreadsheet_id, hoja, columnas). columns es el
+    rango de la proyección ('A:I') o '' para la hoja completa. Los tiempos
+    son de reloj (time.time()) porque se comparan entre procesos.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid: Optional[int] = None
+        # Métricas de este proceso
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bumps = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Una conexión por proceso: no se hereda a través de fork
+        if self._conn is None or self._pid != os.getpid():
+            ensure_private_file(self.path)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Es una caché: no hace falta sincronizar el disco en cada commit
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS sheet_generations '
+                         '(spreadsheet_id TEXT, title TEXT, generation INTEGER NOT NULL, '
+                         'PRIMARY KEY (spreadsheet_id, title))')
+            conn.execute('CREATE TABLE IF NOT EXISTS sheet_snapshots '
+                         '(spreadsheet_id TEXT, title TEXT, columns TEXT, generation INTEGER NOT NULL, '
+                         'fetched_at REAL NOT NULL, full_fetched_at REAL NOT NULL, format TEXT NOT NULL, '
+                         'data BLOB NOT NULL, revision TEXT, PRIMARY KEY (spreadsheet_id, title, columns))')
+            if 'revision' not in [row[1] for row in conn.execute('PRAGMA table_info(sheet_snapshots)')]:
+                # Archivo creado por una versión anterior
+                conn.execute('ALTER TABLE sheet_snapshots ADD COLUMN revision TEXT')
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _failed(self, action: str, error: Exception):
+        self.errors += 1
+        logger.warning(f"Caché compartida no disponible ({action}): {error}")
+
+    @staticmethod
+    def _generation(conn, key: Tuple[str, str]) -> int:
+        row = conn.execute('SELECT generation FROM sheet_generations WHERE spreadsheet_id = ? AND title = ?',
+                           key).fetchone()
+        return row[0] if row else 0
+
+    def generation(self, key: Tuple[str, str]) -> Optional[int]:
+        """Generación actual de una hoja (0 si nunca se escribió, None si falla)"""
+        with self._lock:
+            try:
+                return self._generation(self._connection(), key)
+            except (sqlite3.Error, OSError) as e:
+                self._failed('lectura', e)
+                return None
+
+    def bump(self, key: Tuple[str, str]) -> Optional[Tuple[int, int]]:
+        """
+        Registra una escritura en la hoja: incrementa su generación y
+        descarta sus copias. Retorna (generación anterior, nueva) o None.
+        """
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    old = self._generation(conn, key)
+                    conn.execute('INSERT OR REPLACE INTO sheet_generations (spreadsheet_id, title, generation) '
+                                 'VALUES (?, ?, ?)', (*key, old + 1))
+                    conn.execute('DELETE FROM sheet_snapshots WHERE spreadsheet_id = ? AND title = ?', key)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            except (sqlite3.Error, OSError) as e:
+                self._failed('invalidación', e)
+                return None
+            self.bumps += 1
+            return old, old + 1
+
+    def load(self, key: Tuple[str, str], columns: str, generation: int,
+             max_age: float) -> Optional[Tuple[List[List[str]], float, float, Optional[str]]]:
+        """
+        Copia (valores, fetched_at, full_fetched_at, revision) de esa
+        generación descargada hace menos de max_age segundos, o None
+        """
+        with self._lock:
+            try:
+                row = self._connection().execute(
+                    'SELECT data, fetched_at, full_fetched_at, revision FROM sheet_snapshots '
+                    'WHERE spreadsheet_id = ? AND title = ? AND columns = ? AND generation = ? AND format = ?',
+                    (*key, columns, generation, FORMAT)
+                ).fetchone()
+            except (sqlite3.Error, OSError) as e:
+                self._failed('lectura', e)
+                return None
+            if row is None or time.time() - row[1] >= max_age:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return marshal.loads(zlib.decompress(row[0])), row[1], row[2], row[3]
+
+    def store(self, key: Tuple[str, str], columns: str, generation: int, payload: bytes,
+              fetched_at: float, full_fetched_at: float, revision: Optional[str] = None) -> bool:
+        """
+        Publica una copia (valores serializados con dump_rows) si la hoja
+        sigue en esa generación. revision es la versión de la hoja
+        (RevisionTracker) leída antes de descargarla.
+        """
+        data = zlib.compress(payload, 1)
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    current = self._generation(conn, key) == generation
+                    if current:
+                        conn.execute('INSERT OR REPLACE INTO sheet_snapshots (spreadsheet_id, title, columns, '
+                                     'generation, fetched_at, full_fetched_at, format, data, revision) '
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (*key, columns, generation, fetched_at, full_fetched_at, FORMAT, data,
+                                      revision))
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            except (sqlite3.Error, OSError) as e:
+                self._failed('publicación', e)
+                return False
+            if current:
+                self.stores += 1
+            return current
+
+    def touch(self, key: Tuple[str, str], columns: str, generation: int, revision: str,
+              fetched_at: float) -> bool:
+        """
+        Da por vigente la copia de esa generación y versión desde fetched_at
+        (la hoja no cambió desde que se descargó), sin volver a publicarla
+        """
+        with self._lock:
+            try:
+                cursor = self._connection().execute(
+                    'UPDATE sheet_snapshots SET fetched_at = MAX(fetched_at, ?) '
+                    'WHERE spreadsheet_id = ? AND title = ? AND columns = ? AND generation = ? AND revision = ?',
+                    (fetched_at, *key, columns, generation, revision)
+                )
+            except (sqlite3.Error, OSError) as e:
+                self._failed('publicación', e)
+                return False
+            return cursor.rowcount > 0
+
+    def clear(self):
+        """Descarta todas las copias (las generaciones se conservan)"""
+        with self._lock:
+            try:
+                self._connection().execute('DELETE FROM sheet_snapshots')
+            except (sqlite3.Error, OSError) as e:
+                self._failed('limpieza', e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de este proceso"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'bumps': self.bumps,
+                'errors': self.errors,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0
+            }
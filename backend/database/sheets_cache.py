@@ -0,0 +1,1503 @@
+"""
+Caché de lectura compartida para Google Sheets
+Guarda en memoria el contenido de cada worksheet, con expiración por TTL
+e invalidación explícita en cada escritura realizada a través de la caché.
+Mantiene además índices secundarios por columna (p. ej. patient_id) que se
+actualizan de forma incremental al agregar, editar o eliminar filas.
+
+Los registros se pueden pedir como diccionarios (get_records, formato
+get_all_records) o como objetos compactos con __slots__ (get_objects, ver
+backend.database.records); ambos se construyen una vez por carga y se
+mantienen con cada escritura.
+
+Las rutas que solo usan algunas columnas pueden leer proyecciones (rangos de
+columnas completas como 'A:I'), que se cachean aparte y reciben las mismas
+escrituras que la hoja completa.
+
+Las hojas de solo inserción (Config.SHEETS_DELTA_SYNC) se refrescan al
+vencer el TTL con una lectura incremental: una sola llamada que trae los
+headers, la última fila conocida y las filas agregadas después. Si los
+headers o la última fila cambiaron (filas eliminadas, columnas nuevas) se
+recarga la hoja completa, igual que cada SHEETS_FULL_SYNC_SECONDS.
+
+Si una recarga falla por un error transitorio (cuota, 5xx, red, circuit
+breaker abierto) y hay una copia anterior, se sigue usando esa copia,
+marcada como vencida, y se reintenta la recarga cada
+SHEETS_STALE_RETRY_SECONDS. take_stale() indica si el hilo actual recibió
+datos vencidos.
+
+refresh_ahead() vuelve a leer las hojas más consultadas antes de que venza
+su TTL (lo llama CacheRefresher en segundo plano); mientras tanto, y
+mientras otro hilo recarga una hoja vencida, se sigue sirviendo la copia
+anterior.
+
+Con una caché compartida (SharedSnapshots, Config.SHEETS_SHARED_CACHE) las
+hojas descargadas por un proceso quedan disponibles para los demás workers
+y para el bot, y cada escritura incrementa la generación compartida de la
+hoja: las entradas locales de otra generación se consideran vencidas.
+
+Con un RevisionTracker (Config.SHEETS_VERSION_SHEET) cada escritura marca
+la hoja con una versión nueva, en la misma llamada a la API que los datos
+(values_batch_update o spreadsheets.batchUpdate en vez de los métodos de la
+worksheet). Al vencer el TTL se compara la versión de
+la hoja con la registrada al descargarla, leyendo las versiones de todas
+las hojas en una sola llamada: si no cambió, la entrada se revalida sin
+descargarla (como mucho hasta SHEETS_FULL_SYNC_SECONDS desde la última
+descarga completa, para recoger ediciones manuales).
+
+Cada entrada lleva la cuenta aproximada de su tamaño en memoria (filas,
+registros, índices y agregados, medidos sobre una muestra de filas). Si el
+total supera max_bytes (Config.SHEETS_CACHE_MAX_MB) se descartan las
+entradas usadas hace más tiempo.
+"""
+import bisect
+import itertools
+import re
+import sys
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Tuple, Any, Optional
+from gspread.exceptions import GSpreadException
+from gspread.utils import (
+    a1_range_to_grid_range, a1_to_rowcol, absolute_range_name, fill_gaps, numericise_all,
+    rowcol_to_a1, DateTimeOption, ValueRenderOption
+)
+from config import Config
+from backend.database.resilience import is_transient
+from backend.database.revisions import RevisionTracker, revision_tracker
+from backend.database.shared_cache import SharedSnapshots, dump_rows
+from backend.database.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Numeración global de las cargas de hojas (identifica cada snapshot)
+_serials = itertools.count(1)
+
+_SINGLE_CELL = re.compile(r'^[A-Za-z]+[0-9]+$')
+
+# Filas (o elementos) medidos para estimar el tamaño de una colección
+SIZE_SAMPLE = 64
+
+
+def values_to_records(values: List[List[str]]) -> List[Dict[str, Any]]:
+    """Convierte el resultado de get_all_values() al formato de get_all_records()"""
+    if len(values) < 2:
+        return []
+
+    keys = list(values[0])
+    while keys and keys[-1] == '':
+        keys.pop()
+
+    rows = fill_gaps(values[1:])
+    values_width = len(rows[0])
+
+    # Igualar el ancho de headers y valores igual que gspread
+    if values_width > len(keys):
+        keys.extend([''] * (values_width - len(keys)))
+    elif values_width < len(keys):
+        rows = fill_gaps(rows, cols=len(keys))
+
+    if len(keys) != len(set(keys)):
+        raise GSpreadException("the header row in the worksheet is not unique")
+
+    return [dict(zip(keys, numericise_all(row))) for row in rows]
+
+
+def _row_to_record(header: List[str], row: List[str]) -> Dict[str, Any]:
+    """Convierte una fila individual al formato de get_all_records()"""
+    keys = list(header)
+    while keys and keys[-1] == '':
+        keys.pop()
+    padded = row + [''] * (len(keys) - len(row))
+    if len(padded) > len(keys):
+        keys.extend([''] * (len(padded) - len(keys)))
+    return dict(zip(keys, numericise_all(padded)))
+
+
+def _single_cell_value(range_name, values):
+    """
+    Si la escritura apunta a una sola celda en notación A1 (p. ej. 'L5'),
+    retorna (fila, columna, valor); en otro caso None
+    """
+    if not isinstance(range_name, str) or not _SINGLE_CELL.match(range_name):
+        return None
+    if isinstance(values, list):
+        if len(values) != 1 or not isinstance(values[0], list) or len(values[0]) != 1:
+            return None
+        values = values[0][0]
+    row, col = a1_to_rowcol(range_name)
+    return row, col, values
+
+
+def cells_to_ranges(cells: List[Tuple[int, int, Any]]) -> List[Dict[str, Any]]:
+    """
+    Agrupa cambios (fila, columna, valor) en rangos A1 para batch_update.
+    Las celdas contiguas de una misma fila se envían como un solo rango;
+    si una celda se repite, prevalece el último valor.
+    """
+    by_cell = {}
+    for row, col, value in cells:
+        by_cell[(row, col)] = value
+
+    ranges = []
+    for row, col in sorted(by_cell):
+        current = ranges[-1] if ranges else None
+        if current and current['row'] == row and current['last_col'] == col - 1:
+            current['values'][0].append(by_cell[(row, col)])
+            current['last_col'] = col
+        else:
+            ranges.append({'row': row, 'first_col': col, 'last_col': col,
+                           'values': [[by_cell[(row, col)]]]})
+
+    return [{
+        'range': rowcol_to_a1(r['row'], r['first_col']) if r['first_col'] == r['last_col']
+        else f"{rowcol_to_a1(r['row'], r['first_col'])}:{rowcol_to_a1(r['row'], r['last_col'])}",
+        'values': r['values']
+    } for r in ranges]
+
+
+def cell_data(value) -> Dict[str, Any]:
+    """Valor como CellData de spreadsheets.batchUpdate (igual que una escritura RAW)"""
+    if value is None or value == '':
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+def column_span(columns: str) -> Tuple[int, int]:
+    """Primera columna (0-based) y cantidad de columnas de un rango como 'A:I'"""
+    grid = a1_range_to_grid_range(columns)
+    if 'startRowIndex' in grid or 'endRowIndex' in grid or 'endColumnIndex' not in grid:
+        raise ValueError(f"'{columns}' no es un rango de columnas completas (p. ej. 'A:I')")
+    first = grid.get('startColumnIndex', 0)
+    return first, grid['endColumnIndex'] - first
+
+
+def column_letter(col: int) -> str:
+    """Letra de una columna (1-based), p. ej. 3 -> 'C'"""
+    return rowcol_to_a1(1, col)[:-1]
+
+
+UNFORMATTED = {
+    'value_render_option': ValueRenderOption.unformatted,
+    'date_time_render_option': DateTimeOption.formatted_string
+}
+# Los mismos parámetros para spreadsheet.values_batch_get()
+UNFORMATTED_PARAMS = {
+    'valueRenderOption': ValueRenderOption.unformatted,
+    'dateTimeRenderOption': DateTimeOption.formatted_string
+}
+
+
+def read_unformatted(worksheet, range_name: str) -> List[List[str]]:
+    """
+    Lee un rango A1 sin formato (una llamada a values.get). Los números y
+    booleanos se devuelven como texto y las fechas como texto formateado.
+    """
+    values = worksheet.get(range_name, **UNFORMATTED)
+    return [[to_cell(value) for value in row] for row in values]
+
+
+def _trimmed(row: List[str]) -> List[str]:
+    """Fila sin las celdas vacías del final (como la devuelve la API)"""
+    row = list(row)
+    while row and row[-1] == '':
+        row.pop()
+    return row
+
+
+def to_cell(value) -> str:
+    """Representación en texto de un valor escrito con ValueInputOption RAW"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    return str(value)
+
+
+def sampled_size(items, measure) -> int:
+    """Tamaño aproximado de los elementos de una lista, midiendo una muestra"""
+    count = len(items)
+    if not count:
+        return 0
+    sample = items[::max(1, count // SIZE_SAMPLE)]
+    return sum(measure(item) for item in sample) * count // len(sample)
+
+
+def _row_size(row: List[str]) -> int:
+    return sys.getsizeof(row) + sum(sys.getsizeof(cell) for cell in row)
+
+
+def _record_size(record: Dict[str, Any]) -> int:
+    # Las claves y los textos son los mismos objetos que en las filas
+    return sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record.values()
+                                       if not isinstance(value, str))
+
+
+def _typed_size(record) -> int:
+    # Los textos son los mismos objetos que en las filas
+    size = sys.getsizeof(record)
+    for field in record.FIELDS:
+        value = getattr(record, field)
+        if value is not None and not isinstance(value, str):
+            size += sys.getsizeof(value)
+    if record.extra is not None:
+        size += sys.getsizeof(record.extra[1])
+    return size
+
+
+def _object_size(obj) -> int:
+    """Tamaño aproximado de un agregado: el objeto y sus colecciones"""
+    size = sys.getsizeof(obj)
+    for value in getattr(obj, '__dict__', {}).values():
+        if isinstance(value, dict):
+            size += sys.getsizeof(value) + sampled_size(list(value.values()), sys.getsizeof)
+        elif isinstance(value, list):
+            size += sys.getsizeof(value) + sampled_size(value, sys.getsizeof)
+    return size
+
+
+class RowIndex:
+    """
+    Índice secundario de una columna: valor -> posiciones (ordenadas) en la
+    lista de valores de la hoja. La posición 0 es la fila de headers, por lo
+    que la posición p corresponde a la fila p + 1 de la hoja.
+    """
+
+    def __init__(self, values: List[List[str]], column: int):
+        self.column = column
+        self.positions: Dict[str, List[int]] = {}
+        # Una sola pasada sobre la hoja
+        for pos in range(1, len(values)):
+            self._add(values[pos], pos)
+
+    def _key(self, row: List[str]) -> str:
+        return row[self.column] if len(row) > self.column else ''
+
+    def _add(self, row: List[str], pos: int):
+        self.positions.setdefault(self._key(row), []).append(pos)
+
+    def get(self, key) -> List[int]:
+        return self.positions.get(str(key), [])
+
+    def append(self, row: List[str], pos: int):
+        """Registra una fila agregada al final de la hoja"""
+        self._add(row, pos)
+
+    def move(self, pos: int, old_key: str, new_key: str):
+        """Actualiza el índice cuando cambia el valor indexado de una fila"""
+        if old_key == new_key:
+            return
+        self._discard(old_key, pos)
+        bisect.insort(self.positions.setdefault(new_key, []), pos)
+
+    def delete(self, start: int, end: int, removed_rows: List[List[str]]):
+        """Quita las filas start..end (inclusive) y desplaza las posteriores"""
+        for offset, row in enumerate(removed_rows):
+            self._discard(self._key(row), start + offset)
+        count = end - start + 1
+        for positions in self.positions.values():
+            first = bisect.bisect_right(positions, end)
+            for i in range(first, len(positions)):
+                positions[i] -= count
+
+    def nbytes(self) -> int:
+        """Tamaño aproximado en memoria (las claves son los textos de las filas)"""
+        lists = list(self.positions.values())
+        return sys.getsizeof(self.positions) + sampled_size(
+            lists, lambda positions: sys.getsizeof(positions) + 28 * len(positions)
+        )
+
+    def _discard(self, key: str, pos: int):
+        positions = self.positions.get(key)
+        if not positions:
+            return
+        i = bisect.bisect_left(positions, pos)
+        if i < len(positions) and positions[i] == pos:
+            positions.pop(i)
+        if not positions:
+            del self.positions[key]
+
+
+class _CacheEntry:
+    """
+    Contenido cacheado de una worksheet, o de una proyección de columnas
+    (first_col 0-based y cantidad columns) con la misma numeración de filas
+    """
+
+    def __init__(self, values: List[List[str]], first_col: int = 0, columns: Optional[int] = None):
+        self.first_col = first_col
+        self.columns = columns
+        self.values = values
+        self.records = None
+        # Registros tipados por clase: (decodificador, registros), como records
+        self.objects: Dict[type, Tuple[Any, List[Any]]] = {}
+        self.indexes: Dict[int, RowIndex] = {}
+        # Agregados (p. ej. contadores por paciente) con add(fila)/remove(fila)
+        self.aggregates: Dict[str, Any] = {}
+        self.loaded_at = time.monotonic()
+        # Último uso por un request (el refresco anticipado no la mueve)
+        self.used_at = self.loaded_at
+        # Última carga completa (las sincronizaciones incrementales no la mueven)
+        self.full_loaded_at = self.loaded_at
+        # serial identifica la carga; version cuenta los cambios aplicados
+        self.serial = next(_serials)
+        self.version = 0
+        # La última recarga falló y se está sirviendo esta copia
+        self.stale = False
+        # Generación compartida de la hoja cuando se cargó (None sin caché compartida)
+        self.shared_generation: Optional[int] = None
+        # Versión de la hoja (RevisionTracker) leída antes de descargarla
+        self.revision: Optional[str] = None
+        # Último tamaño calculado y el estado de la entrada al calcularlo
+        self._size: Tuple[tuple, int] = ((), 0)
+
+    def token(self) -> Tuple[int, int]:
+        return (self.serial, self.version)
+
+    def nbytes(self) -> int:
+        """Tamaño aproximado en memoria: filas, registros, índices y agregados"""
+        state = (self.version, len(self.values), self.records is not None,
+                 len(self.objects), len(self.indexes), len(self.aggregates))
+        if self._size[0] == state:
+            return self._size[1]
+        size = sys.getsizeof(self.values) + sampled_size(self.values, _row_size)
+        if self.records is not None:
+            size += sys.getsizeof(self.records) + sampled_size(self.records, _record_size)
+        for _, objects in self.objects.values():
+            size += sys.getsizeof(objects) + sampled_size(objects, _typed_size)
+        size += sum(index.nbytes() for index in self.indexes.values())
+        size += sum(_object_size(aggregate) for aggregate in self.aggregates.values())
+        self._size = (state, size)
+        return size
+
+    def width(self) -> int:
+        if self.columns is not None:
+            return self.columns
+        return len(self.values[0]) if self.values else 0
+
+    def project(self, row: List[str]) -> List[str]:
+        """Recorta una fila completa a las columnas de la entrada"""
+        if self.columns is None:
+            return row
+        return row[self.first_col:self.first_col + self.columns]
+
+    def objects_of(self, record_type) -> List[Any]:
+        """Registros de esa clase (ver records.SheetRecord), decodificados una vez"""
+        typed = self.objects.get(record_type)
+        if typed is None:
+            decode = record_type.decoder(self.values[0] if self.values else [])
+            typed = self.objects[record_type] = (decode, [decode(row) for row in self.values[1:]])
+        return typed[1]
+
+    def index_for(self, column: int) -> RowIndex:
+        index = self.indexes.get(column)
+        if index is None:
+            index = self.indexes[column] = RowIndex(self.values, column)
+        return index
+
+    def append(self, rows: List[List[Any]]):
+        for raw_row in rows:
+            self._add_row(self.project([to_cell(value) for value in raw_row]))
+
+    def extend(self, rows: List[List[str]]):
+        """Agrega filas leídas de la hoja, ya limitadas a las columnas de la entrada"""
+        for row in rows:
+            self._add_row(list(row[:self.width()]))
+
+    def _add_row(self, row: List[str]):
+        if len(row) < self.width():
+            row.extend([''] * (self.width() - len(row)))
+        self.values.append(row)
+        pos = len(self.values) - 1
+        for index in self.indexes.values():
+            index.append(row, pos)
+        for aggregate in self.aggregates.values():
+            aggregate.add(row)
+        if self.records is not None:
+            self.records.append(_row_to_record(self.values[0], row))
+        for decode, objects in self.objects.values():
+            objects.append(decode(row))
+
+    def delete(self, start: int, end: int):
+        """Elimina las filas start..end de la hoja (numeración 1-based)"""
+        first, last = start - 1, min(end - 1, len(self.values) - 1)
+        if first > last:
+            return
+        removed = self.values[first:last + 1]
+        for index in self.indexes.values():
+            index.delete(first, last, removed)
+        for aggregate in self.aggregates.values():
+            for row in removed:
+                aggregate.remove(row)
+        del self.values[first:last + 1]
+        if self.records is not None:
+            del self.records[first - 1:last]
+        for _, objects in self.objects.values():
+            del objects[first - 1:last]
+
+    def update_cell(self, row_number: int, col: int, value):
+        pos, column = row_number - 1, col - 1 - self.first_col
+        if column < 0 or (self.columns is not None and column >= self.columns):
+            return
+        row = self.values[pos]
+        if len(row) <= column:
+            row.extend([''] * (column + 1 - len(row)))
+        for aggregate in self.aggregates.values():
+            aggregate.remove(row)
+        old_value, row[column] = row[column], to_cell(value)
+        index = self.indexes.get(column)
+        if index is not None:
+            index.move(pos, old_value, row[column])
+        for aggregate in self.aggregates.values():
+            aggregate.add(row)
+        if self.records is not None:
+            self.records[pos - 1] = _row_to_record(self.values[0], row)
+        for decode, objects in self.objects.values():
+            objects[pos - 1] = decode(row)
+
+    def update_cells(self, cells: List[Tuple[int, int, Any]]):
+        for row_number, col, value in cells:
+            self.update_cell(row_number, col, value)
+
+
+class TableCache:
+    """
+    Caché read-through de worksheets compartida por todo el proceso.
+    Las entradas se identifican por (spreadsheet_id, nombre de la hoja).
+    Los valores devueltos son compartidos y no deben modificarse.
+    """
+
+    def __init__(self, ttl: float = 60, delta_sheets=(), full_ttl: float = 600,
+                 stale_retry: float = 5, shared: Optional[SharedSnapshots] = None,
+                 revisions: Optional[RevisionTracker] = None, max_bytes: int = 0):
+        self.ttl = ttl
+        # Tamaño máximo aproximado de todas las entradas (0 = sin límite)
+        self.max_bytes = max_bytes
+        # Segundo nivel compartido con los demás procesos de la máquina
+        self.shared = shared
+        # Versiones por hoja para revalidar entradas vencidas sin descargarlas
+        self.revisions = revisions
+        # Segundos entre reintentos de recarga mientras se sirve una copia vencida
+        self.stale_retry = stale_retry
+        self._local = threading.local()
+        # Hojas de solo inserción que se refrescan leyendo solo las filas
+        # nuevas, con una recarga completa cada full_ttl segundos
+        self.delta_sheets = set(delta_sheets)
+        self.full_ttl = full_ttl
+        self._entries: Dict[Tuple[str, str], _CacheEntry] = {}
+        # Proyecciones por hoja: rango de columnas ('A:I') -> entrada
+        self._projections: Dict[Tuple[str, str], Dict[str, _CacheEntry]] = {}
+        self._generations: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.RLock()
+        # Lecturas en curso por (hoja, columnas), compartidas entre hilos
+        self._flights = SingleFlight()
+        self._listeners = []
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.delta_syncs = 0
+        self.delta_fallbacks = 0
+        self.stale_served = 0
+        self.served_during_refresh = 0
+        self.refreshed_ahead = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(worksheet) -> Tuple[str, str]:
+        """Clave de caché de una worksheet"""
+        return (worksheet.spreadsheet.id, worksheet.title)
+
+    def _lookup(self, key: Tuple[str, str], columns: Optional[str]) -> Optional[_CacheEntry]:
+        if columns is None:
+            return self._entries.get(key)
+        return self._projections.get(key, {}).get(columns)
+
+    def _entries_of(self, key: Tuple[str, str]) -> List[Tuple[Optional[str], _CacheEntry]]:
+        """Entrada completa y proyecciones cacheadas de una hoja"""
+        entries = list(self._projections.get(key, {}).items())
+        if key in self._entries:
+            entries.insert(0, (None, self._entries[key]))
+        return entries
+
+    def _drop(self, key: Tuple[str, str], columns: Optional[str]):
+        if columns is None:
+            self._entries.pop(key, None)
+        else:
+            self._projections.get(key, {}).pop(columns, None)
+
+    def _load(self, worksheet, columns: Optional[str]) -> _CacheEntry:
+        if columns is None:
+            return _CacheEntry(worksheet.get_all_values())
+        first_col, count = column_span(columns)
+        values = read_unformatted(worksheet, columns)
+        return _CacheEntry(fill_gaps(values, cols=count) if values else [], first_col, count)
+
+    def _get_entry(self, worksheet, columns: Optional[str] = None) -> _CacheEntry:
+        """Obtiene la entrada vigente (o la proyección) o la carga desde Google Sheets"""
+        key = self.key_for(worksheet)
+        shared_generation = self._shared_generation(key)
+        with self._lock:
+            entry = self._lookup(key, columns)
+            if self._fresh(entry, time.monotonic(), shared_generation):
+                self.hits += 1
+                entry.used_at = time.monotonic()
+                if entry.stale:
+                    self._local.stale = True
+                return entry
+            self.misses += 1
+        previous = entry
+
+        # Los hilos que piden la misma hoja a la vez comparten una sola lectura
+        flight, leader = self._flights.join((key, columns))
+        if leader:
+            try:
+                entry = self._refresh(worksheet, key, columns, shared_generation)
+            except BaseException as e:
+                self._flights.finish((key, columns), flight, error=e)
+                raise
+            self._flights.finish((key, columns), flight, entry)
+        elif previous is not None and (shared_generation is None
+                                       or previous.shared_generation == shared_generation):
+            # Solo venció el TTL: la copia anterior se sirve mientras otro hilo la recarga
+            with self._lock:
+                self.served_during_refresh += 1
+        else:
+            entry = flight.wait()
+            if entry is None:
+                # El prefetch en curso descartó la proyección: cargarla aquí
+                return self._get_entry(worksheet, columns)
+        entry.used_at = time.monotonic()
+        if entry.stale:
+            self._local.stale = True
+        return entry
+
+    def _refresh(self, worksheet, key: Tuple[str, str], columns: Optional[str],
+                 shared_generation: Optional[int], margin: float = 0) -> _CacheEntry:
+        """
+        Adopta la copia compartida, sincroniza las filas nuevas o recarga la
+        hoja. Con margin > 0 (refresco anticipado) se recargan también las
+        entradas a las que les quedan menos de margin segundos de TTL.
+        """
+        with self._lock:
+            entry = self._lookup(key, columns)
+            now = time.monotonic()
+            # La lectura anterior pudo terminar justo antes de que empezara esta
+            if self._fresh(entry, now, shared_generation, margin):
+                return entry
+
+        adopted = self._adopt(key, columns, shared_generation, self.ttl - margin)
+        if adopted is not None:
+            return adopted
+        # La versión se lee antes de descargar: una escritura posterior la cambia
+        revision = self._revision(worksheet)
+        if entry is not None and self._revalidate(key, columns, entry, revision, shared_generation):
+            return entry
+        with self._lock:
+            generation = self._generations.get(key, 0)
+            delta = self._delta_eligible(key, entry, now, shared_generation, revision)
+
+        try:
+            if delta and self._sync_tail(worksheet, key, columns, entry, generation):
+                with self._lock:
+                    entry.revision = revision
+                self._publish(key, columns, entry)
+                return entry
+            entry = self._load(worksheet, columns)
+        except Exception as e:
+            # En el refresco anticipado la entrada sigue vigente: no se marca vencida
+            if entry is not None and is_transient(e) and not margin:
+                logger.warning(f"Usando copia vencida de {key[1]}: {e}")
+                self._serve_stale([entry])
+                return entry
+            self._notify(key)
+            raise
+
+        entry.shared_generation = shared_generation
+        entry.revision = revision
+        # Si hubo una escritura durante la lectura, no guardar datos viejos
+        if self._install(key, columns, entry, generation):
+            self._publish(key, columns, entry)
+        return entry
+
+    def _fresh(self, entry: Optional[_CacheEntry], now: float, shared_generation: Optional[int],
+               margin: float = 0) -> bool:
+        """
+        Si a la entrada le quedan más de margin segundos de TTL y ningún otro
+        proceso escribió la hoja
+        """
+        return (entry is not None and now - entry.loaded_at < self.ttl - margin
+                and (shared_generation is None or entry.shared_generation == shared_generation))
+
+    def _install(self, key: Tuple[str, str], columns: Optional[str], entry: _CacheEntry,
+                 generation: int) -> bool:
+        """Guarda una entrada cargada si no hubo escrituras locales desde `generation`"""
+        with self._lock:
+            if self._generations.get(key, 0) != generation:
+                return False
+            previous = self._lookup(key, columns)
+            if previous is not None:
+                # Una recarga no cuenta como uso
+                entry.used_at = previous.used_at
+            if columns is None:
+                self._entries[key] = entry
+            else:
+                self._projections.setdefault(key, {})[columns] = entry
+            self._trim(entry)
+            return True
+
+    def _views(self) -> List[Tuple[Tuple[str, str], Optional[str], _CacheEntry]]:
+        """Todas las entradas cacheadas: (clave, columnas, entrada)"""
+        return [(key, columns, entry) for key in set(self._entries) | set(self._projections)
+                for columns, entry in self._entries_of(key)]
+
+    def _trim(self, keep: Optional[_CacheEntry] = None):
+        """
+        Descarta las entradas usadas hace más tiempo hasta que el total quede
+        bajo max_bytes. `keep` (la entrada que se está entregando) no se descarta.
+        """
+        if not self.max_bytes:
+            return
+        with self._lock:
+            views = self._views()
+            total = sum(entry.nbytes() for *_, entry in views)
+            if total <= self.max_bytes:
+                return
+            for key, columns, entry in sorted(views, key=lambda view: view[2].used_at):
+                if total <= self.max_bytes:
+                    break
+                if entry is keep:
+                    continue
+                self._drop(key, columns)
+                total -= entry.nbytes()
+                self.evictions += 1
+                logger.debug(f"Entrada de caché descartada por memoria: {key[1]} {columns or ''}")
+
+    # Versiones de las hojas
+    def _revision(self, worksheet) -> Optional[str]:
+        """Versión actual de la hoja, o None si no se registra o no se pudo leer"""
+        if self.revisions is None or not self.revisions.tracks(worksheet.title):
+            return None
+        signatures = self.revisions.signatures(worksheet.spreadsheet)
+        return signatures.get(worksheet.title, '') if signatures is not None else None
+
+    def _revalidate(self, key: Tuple[str, str], columns: Optional[str], entry: _CacheEntry,
+                    revision: Optional[str], shared_generation: Optional[int]) -> bool:
+        """
+        Renueva el TTL de una entrada vencida si la hoja no cambió desde que
+        se descargó (misma versión y, con caché compartida, misma generación)
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (revision is None or entry.revision != revision or self._lookup(key, columns) is not entry
+                    or now - entry.full_loaded_at >= self.full_ttl
+                    or (shared_generation is not None and entry.shared_generation != shared_generation)):
+                return False
+            entry.loaded_at = now
+            entry.stale = False
+            self.revalidated += 1
+        if self.shared is not None and shared_generation is not None:
+            self.shared.touch(key, columns or '', shared_generation, revision,
+                              now + time.time() - time.monotonic())
+        return True
+
+    def _mark_changed(self, worksheet):
+        if self.revisions is not None:
+            self.revisions.mark_changed(worksheet)
+
+    # Caché compartida entre procesos
+    def _shared_generation(self, key: Tuple[str, str]) -> Optional[int]:
+        return self.shared.generation(key) if self.shared is not None else None
+
+    def _adopt(self, key: Tuple[str, str], columns: Optional[str], shared_generation: Optional[int],
+               max_age: Optional[float] = None) -> Optional[_CacheEntry]:
+        """
+        Toma (y guarda) la copia publicada por otro proceso, si la hay y se
+        descargó hace menos de max_age segundos (por omisión, el TTL)
+        """
+        if shared_generation is None:
+            return None
+        with self._lock:
+            generation = self._generations.get(key, 0)
+        max_age = self.ttl if max_age is None else max_age
+        if max_age <= 0:
+            return None
+        snapshot = self.shared.load(key, columns or '', shared_generation, max_age)
+        if snapshot is None:
+            return None
+        values, fetched_at, full_fetched_at, revision = snapshot
+        if columns is None:
+            entry = _CacheEntry(values)
+        else:
+            entry = _CacheEntry(values, *column_span(columns))
+        # Los tiempos compartidos son de reloj; los locales, monotónicos
+        offset = time.monotonic() - time.time()
+        entry.loaded_at = fetched_at + offset
+        entry.full_loaded_at = full_fetched_at + offset
+        entry.shared_generation = shared_generation
+        entry.revision = revision
+        self._install(key, columns, entry, generation)
+        return entry
+
+    def _publish(self, key: Tuple[str, str], columns: Optional[str], entry: _CacheEntry):
+        """Publica una entrada recién cargada o actualizada para los demás procesos"""
+        if self.shared is None or entry.shared_generation is None:
+            return
+        with self._lock:
+            # Se serializa bajo el lock: otro hilo podría estar modificando las filas
+            payload = dump_rows(entry.values)
+            offset = time.time() - time.monotonic()
+            fetched_at, full_fetched_at = entry.loaded_at + offset, entry.full_loaded_at + offset
+            generation, revision = entry.shared_generation, entry.revision
+        self.shared.store(key, columns or '', generation, payload, fetched_at, full_fetched_at, revision)
+
+    def _serve_stale(self, entries: List[_CacheEntry]):
+        """Sigue usando entradas vencidas hasta el próximo reintento de recarga"""
+        with self._lock:
+            retry_at = time.monotonic() - self.ttl + self.stale_retry
+            for entry in entries:
+                entry.stale = True
+                entry.loaded_at = max(entry.loaded_at, retry_at)
+                self.stale_served += 1
+        self._local.stale = True
+
+    def take_stale(self) -> bool:
+        """Si el hilo actual recibió datos vencidos desde la última llamada (y reinicia la marca)"""
+        stale = getattr(self._local, 'stale', False)
+        self._local.stale = False
+        return stale
+
+    def _delta_eligible(self, key: Tuple[str, str], entry: Optional[_CacheEntry], now: float,
+                        shared_generation: Optional[int] = None, revision: Optional[str] = None) -> bool:
+        """
+        Si una entrada vencida puede refrescarse leyendo solo las filas nuevas.
+        Si otro proceso escribió la hoja (otra generación compartida u otra
+        versión) se recarga: pudo eliminar filas o editarlas en el lugar,
+        como las marcas de eliminación, y la lectura incremental solo ve
+        las filas agregadas al final.
+        """
+        return (entry is not None and len(entry.values) > 1 and entry.width() > 0
+                and key[1] in self.delta_sheets and now - entry.full_loaded_at < self.full_ttl
+                and (shared_generation is None or entry.shared_generation == shared_generation)
+                and (revision is None or entry.revision is None or entry.revision == revision))
+
+    @staticmethod
+    def _tail_ranges(entry: _CacheEntry) -> List[str]:
+        """Rangos de la lectura incremental: headers, última fila conocida y filas nuevas"""
+        rows, width = len(entry.values), entry.width()
+        first = column_letter(entry.first_col + 1)
+        last = column_letter(entry.first_col + width)
+        # En la hoja completa, la fila 1 entera para detectar columnas nuevas
+        header = '1:1' if entry.columns is None else f'{first}1:{last}1'
+        return [header, f'{first}{rows}:{last}{rows}', f'{first}{rows + 1}:{last}']
+
+    def _sync_tail(self, worksheet, key: Tuple[str, str], columns: Optional[str],
+                   entry: _CacheEntry, generation: int) -> bool:
+        """
+        Refresca una entrada leyendo solo las filas agregadas después de la
+        última conocida. Retorna False si hay que recargar la hoja completa.
+        """
+        options = {} if entry.columns is None else UNFORMATTED
+        results = worksheet.batch_get(self._tail_ranges(entry), **options)
+        return self._apply_tail(key, columns, entry, generation, results)
+
+    def _apply_tail(self, key: Tuple[str, str], columns: Optional[str], entry: _CacheEntry,
+                    generation: int, results: List[List[List[Any]]]) -> bool:
+        """Aplica el resultado de los rangos de _tail_ranges() a la entrada"""
+        width = entry.width()
+        header, last_row, tail = (
+            [[to_cell(value) for value in row] for row in values] for values in results
+        )
+
+        with self._lock:
+            if self._generations.get(key, 0) != generation:
+                # Hubo una escritura durante la lectura: si la entrada sigue
+                # en la caché ya la incluye; si se descartó, recargar
+                return self._lookup(key, columns) is entry
+            fetched_last = last_row[0][:width] if last_row else []
+            if (_trimmed(header[0] if header else []) != _trimmed(entry.values[0])
+                    or _trimmed(fetched_last) != _trimmed(entry.values[-1])):
+                self.delta_fallbacks += 1
+                return False
+            if tail:
+                entry.extend(fill_gaps(tail, cols=width))
+                entry.version += 1
+            entry.loaded_at = time.monotonic()
+            entry.stale = False
+            self.delta_syncs += 1
+            return True
+
+    def prefetch(self, spreadsheet, worksheets: List[Any], columns: str, margin: float = 0) -> int:
+        """
+        Deja vigente la proyección `columns` de varias worksheets con una sola
+        llamada a values_batch_get: descarga las que no están en caché y,
+        en las hojas de solo inserción, solo las filas nuevas. Las hojas que
+        otro hilo ya está leyendo no se piden de nuevo: se espera esa lectura.
+        Con margin > 0 se refrescan también las proyecciones a las que les
+        quedan menos de margin segundos de TTL. Retorna cuántas hojas se
+        refrescaron.
+        """
+        shared_generations, revisions = {}, {}
+        for worksheet in worksheets:
+            key = self.key_for(worksheet)
+            shared_generations[key] = generation = self._shared_generation(key)
+            # Primero las copias que ya publicó otro proceso y las que no cambiaron
+            with self._lock:
+                entry = self._lookup(key, columns)
+                fresh = self._fresh(entry, time.monotonic(), generation, margin)
+            if fresh or self._adopt(key, columns, generation, self.ttl - margin) is not None:
+                continue
+            revisions[key] = self._revision(worksheet)
+            if entry is not None:
+                self._revalidate(key, columns, entry, revisions[key], generation)
+
+        plan, ranges, waiting = [], [], []
+        with self._lock:
+            now = time.monotonic()
+            for worksheet in worksheets:
+                key = self.key_for(worksheet)
+                shared_generation = shared_generations[key]
+                entry = self._lookup(key, columns)
+                if self._fresh(entry, now, shared_generation, margin):
+                    continue
+                self.misses += 1
+                flight, leader = self._flights.join((key, columns))
+                if not leader:
+                    waiting.append(flight)
+                    continue
+                if self._delta_eligible(key, entry, now, shared_generation, revisions.get(key)):
+                    sheet_ranges = self._tail_ranges(entry)
+                else:
+                    entry, sheet_ranges = None, [columns]
+                plan.append((key, entry, self._generations.get(key, 0), shared_generation,
+                             revisions.get(key), len(sheet_ranges), flight))
+                ranges += [absolute_range_name(worksheet.title, r) for r in sheet_ranges]
+
+        refreshed = 0
+        if plan:
+            try:
+                entries, refreshed = self._fetch_batch(spreadsheet, plan, ranges, columns, margin)
+            except BaseException as e:
+                for key, *_, flight in plan:
+                    self._flights.finish((key, columns), flight, error=e)
+                raise
+            for (key, *_, flight), entry in zip(plan, entries):
+                self._flights.finish((key, columns), flight, entry)
+        for flight in waiting:
+            flight.wait()
+        return refreshed
+
+    def _fetch_batch(self, spreadsheet, plan: List[tuple], ranges: List[str], columns: str,
+                     margin: float = 0) -> Tuple[List[Optional[_CacheEntry]], int]:
+        """
+        Ejecuta la lectura planificada por prefetch(). Retorna la entrada
+        resultante de cada hoja (None si hay que recargarla) y cuántas se
+        refrescaron.
+        """
+        first_col, count = column_span(columns)
+        try:
+            response = spreadsheet.values_batch_get(ranges, params=UNFORMATTED_PARAMS)
+        except Exception as e:
+            if not is_transient(e) or margin:
+                raise
+            with self._lock:
+                previous = [self._lookup(key, columns) for key, *_ in plan]
+            if any(entry is None for entry in previous):
+                raise
+            logger.warning(f"Usando copias vencidas de {len(previous)} hojas: {e}")
+            self._serve_stale(previous)
+            return previous, 0
+
+        entries = []
+        value_ranges = iter(response.get('valueRanges', []))
+        for key, entry, generation, shared_generation, revision, range_count, _ in plan:
+            results = [next(value_ranges, {}).get('values', []) for _ in range(range_count)]
+            if entry is not None:
+                if self._apply_tail(key, columns, entry, generation, results):
+                    with self._lock:
+                        entry.revision = revision
+                    self._publish(key, columns, entry)
+                else:
+                    # Cambió la estructura: la próxima lectura recarga la proyección
+                    with self._lock:
+                        if self._lookup(key, columns) is entry:
+                            self._drop(key, columns)
+                    entry = None
+                entries.append(entry)
+                continue
+            values = [[to_cell(value) for value in row] for row in results[0]]
+            loaded = _CacheEntry(fill_gaps(values, cols=count) if values else [], first_col, count)
+            loaded.shared_generation = shared_generation
+            loaded.revision = revision
+            if self._install(key, columns, loaded, generation):
+                self._publish(key, columns, loaded)
+            entries.append(loaded)
+        return entries, len(plan)
+
+    def refresh_ahead(self, spreadsheet, titles, margin: float, idle: float) -> int:
+        """
+        Refresca las vistas cacheadas (hoja completa y proyecciones) de las
+        hojas `titles` a las que les quedan menos de margin segundos de TTL y
+        que algún request usó en los últimos idle segundos. Los requests
+        siguen recibiendo la copia anterior mientras tanto. Las proyecciones
+        con las mismas columnas se leen en una sola llamada. Retorna cuántas
+        vistas se refrescaron.
+        """
+        titles = set(titles)
+        due: Dict[Optional[str], List[str]] = {}
+        with self._lock:
+            now = time.monotonic()
+            for key, columns, entry in self._views():
+                if (key[0] == spreadsheet.id and key[1] in titles and now - entry.used_at < idle
+                        and now - entry.loaded_at >= self.ttl - margin):
+                    due.setdefault(columns, []).append(key[1])
+
+        refreshed = 0
+        for columns, sheet_titles in due.items():
+            try:
+                worksheets = [spreadsheet.worksheet(title) for title in sheet_titles]
+                if columns is not None:
+                    refreshed += self.prefetch(spreadsheet, worksheets, columns, margin)
+                    continue
+                for worksheet in worksheets:
+                    key = self.key_for(worksheet)
+                    flight, leader = self._flights.join((key, None))
+                    if not leader:
+                        continue
+                    try:
+                        entry = self._refresh(worksheet, key, None, self._shared_generation(key), margin)
+                    except BaseException as e:
+                        self._flights.finish((key, None), flight, error=e)
+                        raise
+                    self._flights.finish((key, None), flight, entry)
+                    refreshed += 1
+            except Exception as e:
+                logger.warning(f"Error en el refresco anticipado de {', '.join(sheet_titles)}: {e}")
+        with self._lock:
+            self.refreshed_ahead += refreshed
+        return refreshed
+
+    def get_values(self, worksheet) -> List[List[str]]:
+        """Equivalente cacheado de worksheet.get_all_values()"""
+        return self._get_entry(worksheet).values
+
+    def get_columns(self, worksheet, columns: str) -> List[List[str]]:
+        """
+        Como get_values(), pero descargando solo un rango de columnas
+        completas (p. ej. 'A:I'), sin formato. Las filas conservan la
+        numeración de la hoja y se rellenan hasta el ancho del rango.
+        """
+        return self._get_entry(worksheet, columns).values
+
+    def get_field(self, worksheet, field: str) -> List[str]:
+        """
+        Valores (sin la fila de headers) de la columna con ese header,
+        leyendo solo la fila de headers y esa columna
+        """
+        header = self._flights.do((self.key_for(worksheet), 'header'),
+                                  lambda: read_unformatted(worksheet, '1:1'))
+        header = header[0] if header else []
+        if field not in header:
+            return []
+        letter = column_letter(header.index(field) + 1)
+        return [row[0] for row in self.get_columns(worksheet, f'{letter}:{letter}')[1:]]
+
+    def read_range(self, worksheet, range_name: str) -> List[List[str]]:
+        """Lectura sin caché de un rango A1 arbitrario, sin formato"""
+        return read_unformatted(worksheet, range_name)
+
+    def confirm_rows(self, worksheet, rows: List[Tuple[int, Any]],
+                     key_columns: Tuple[int, ...] = (1,)) -> List[Optional[int]]:
+        """
+        Número actual de cada fila (número cacheado, clave) antes de escribir
+        en ella por posición. Otro proceso (la compactación del bot) pudo
+        eliminar filas desde que se cachearon y desplazar las siguientes: se
+        vuelven a leer sin caché las celdas key_columns (1-based, por
+        omisión el id) de cada fila, en una llamada. Si alguna no tiene ya su
+        clave, la entrada de la caché se descarta y esas filas se buscan por
+        clave en una lectura de las columnas completas. La clave es un valor
+        o una tupla con uno por columna. None para las filas que ya no existen.
+        """
+        if not rows:
+            return []
+        first, last = min(key_columns), max(key_columns)
+        first_letter, last_letter = column_letter(first), column_letter(last)
+
+        def key_of(cells: List[Any]) -> Tuple[str, ...]:
+            return tuple(to_cell(cells[col - first]) if col - first < len(cells) else ''
+                         for col in key_columns)
+
+        keys = [tuple(to_cell(value) for value in (key if isinstance(key, tuple) else (key,)))
+                for _, key in rows]
+        found = worksheet.batch_get([f'{first_letter}{row}:{last_letter}{row}' for row, _ in rows],
+                                    **UNFORMATTED)
+        confirmed = [row if row > 1 and key_of(cells[0] if cells else []) == key else None
+                     for (row, _), key, cells in zip(rows, keys, found)]
+        if None not in confirmed:
+            return confirmed
+
+        logger.warning(f"Filas desplazadas en {worksheet.title}: se buscan de nuevo por clave")
+        self._discard(self.key_for(worksheet))
+        values = read_unformatted(worksheet, f'{first_letter}1:{last_letter}')
+        positions: Dict[Tuple[str, ...], List[int]] = {}
+        for number, cells in enumerate(values[1:], 2):
+            positions.setdefault(key_of(cells), []).append(number)
+        taken = set(row for row in confirmed if row is not None)
+        for i, key in enumerate(keys):
+            if confirmed[i] is None:
+                candidates = [row for row in positions.get(key, []) if row not in taken]
+                if candidates:
+                    confirmed[i] = candidates[0]
+                    taken.add(candidates[0])
+        return confirmed
+
+    def get_records(self, worksheet) -> List[Dict[str, Any]]:
+        """Equivalente cacheado de worksheet.get_all_records()"""
+        entry = self._get_entry(worksheet)
+        with self._lock:
+            if entry.records is None:
+                entry.records = values_to_records(entry.values)
+                self._trim(entry)
+            return entry.records
+
+    def get_records_snapshot(self, worksheet) -> Tuple[List[Dict[str, Any]], Tuple[int, int]]:
+        """
+        Registros junto al token (serial, versión) de la entrada que los
+        contiene. Cada escritura aplicada en el lugar incrementa la versión,
+        lo que permite a estructuras derivadas saber si siguen vigentes.
+        """
+        entry = self._get_entry(worksheet)
+        with self._lock:
+            if entry.records is None:
+                entry.records = values_to_records(entry.values)
+                self._trim(entry)
+            return entry.records, entry.token()
+
+    def get_objects(self, worksheet, record_type, columns: Optional[str] = None) -> List[Any]:
+        """
+        Registros de la hoja (o proyección) como objetos record_type (ver
+        backend.database.records), en el orden de las filas
+        """
+        return self.get_objects_snapshot(worksheet, record_type, columns)[0]
+
+    def get_objects_snapshot(self, worksheet, record_type,
+                             columns: Optional[str] = None) -> Tuple[List[Any], Tuple[int, int]]:
+        """Como get_records_snapshot(), con registros record_type"""
+        entry = self._get_entry(worksheet, columns)
+        with self._lock:
+            built = record_type not in entry.objects
+            objects = entry.objects_of(record_type)
+            if built:
+                self._trim(entry)
+            return objects, entry.token()
+
+    def get_objects_by(self, worksheet, record_type, field: str, value,
+                       columns: Optional[str] = None) -> List[Any]:
+        """Registros record_type cuyo campo es igual a value (con el índice de esa columna)"""
+        entry = self._get_entry(worksheet, columns)
+        with self._lock:
+            header = entry.values[0] if entry.values else []
+            if field not in header:
+                return []
+            column = header.index(field)
+            built = record_type not in entry.objects or column not in entry.indexes
+            objects = entry.objects_of(record_type)
+            found = [objects[pos - 1] for pos in entry.index_for(column).get(value)]
+            if built:
+                self._trim(entry)
+            return found
+
+    def snapshot_token(self, worksheet):
+        """Token de la entrada vigente de una worksheet, o None si no hay"""
+        with self._lock:
+            entry = self._entries.get(self.key_for(worksheet))
+            if entry is None or time.monotonic() - entry.loaded_at >= self.ttl:
+                return None
+            return entry.token()
+
+    def get_header(self, worksheet) -> List[str]:
+        """Equivalente cacheado de worksheet.row_values(1)"""
+        values = self.get_values(worksheet)
+        if not values:
+            return []
+        header = list(values[0])
+        while header and header[-1] == '':
+            header.pop()
+        return header
+
+    def get_rows_by(self, worksheet, column: int, value,
+                    columns: Optional[str] = None) -> List[Tuple[int, List[str]]]:
+        """
+        Filas cuya columna (0-based) es igual a value, usando el índice
+        secundario de esa columna. Retorna pares (número de fila, fila).
+        Con columns se busca en esa proyección y column es relativa a ella.
+        """
+        entry = self._get_entry(worksheet, columns)
+        with self._lock:
+            built = column not in entry.indexes
+            positions = list(entry.index_for(column).get(value))
+            if built:
+                self._trim(entry)
+        return [(pos + 1, entry.values[pos]) for pos in positions]
+
+    def get_patient_rows(self, worksheet, patient_id, column: int = 1,
+                         columns: Optional[str] = None) -> List[Tuple[int, List[str]]]:
+        """Filas de un paciente en una hoja clínica (patient_id en la columna B)"""
+        return self.get_rows_by(worksheet, column, patient_id, columns)
+
+    def get_aggregate(self, worksheet, name: str, factory, columns: Optional[str] = None):
+        """
+        Agregado mantenido junto a la entrada (o proyección) de una hoja.
+        factory(values) lo construye en una pasada la primera vez y después
+        la caché le informa cada fila agregada, eliminada o modificada con
+        add(fila) y remove(fila). Al recargarse la hoja se vuelve a construir.
+        """
+        entry = self._get_entry(worksheet, columns)
+        with self._lock:
+            aggregate = entry.aggregates.get(name)
+            if aggregate is None:
+                aggregate = entry.aggregates[name] = factory(entry.values)
+                self._trim(entry)
+            return aggregate
+
+    def get_records_by(self, worksheet, field: str, value,
+                       columns: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Registros (formato get_all_records) cuyo campo es igual a value"""
+        entry = self._get_entry(worksheet, columns)
+        with self._lock:
+            header = entry.values[0] if entry.values else []
+            if field not in header:
+                return []
+            built = entry.records is None or header.index(field) not in entry.indexes
+            if entry.records is None:
+                entry.records = values_to_records(entry.values)
+            positions = entry.index_for(header.index(field)).get(value)
+            records = [entry.records[pos - 1] for pos in positions]
+            if built:
+                self._trim(entry)
+            return records
+
+    def add_invalidation_listener(self, listener):
+        """
+        Registra una función listener(key) que se llama cuando una hoja se
+        invalida o falla su lectura (p. ej. para refrescar handles)
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, key: Tuple[str, str]):
+        for listener in self._listeners:
+            try:
+                listener(key)
+            except Exception as e:
+                logger.warning(f"Error notificando invalidación de {key}: {e}")
+
+    def invalidate(self, worksheet):
+        """Descarta la entrada de una worksheet tras una escritura (también en los demás procesos)"""
+        self._discard(self.key_for(worksheet))
+        self._mark_changed(worksheet)
+
+    def _discard(self, key: Tuple[str, str]):
+        if self.shared is not None:
+            self.shared.bump(key)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._projections.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self.invalidations += 1
+        self._notify(key)
+
+    def clear(self):
+        """Descarta todas las entradas, incluidas las copias compartidas"""
+        with self._lock:
+            for key in set(self._entries) | set(self._projections):
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.clear()
+            self._projections.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def resident_bytes(self) -> int:
+        """Tamaño aproximado en memoria de todas las entradas"""
+        with self._lock:
+            return sum(entry.nbytes() for *_, entry in self._views())
+
+    def sizes(self) -> List[Dict[str, Any]]:
+        """Tamaño aproximado de cada entrada, de la más grande a la más chica"""
+        with self._lock:
+            now = time.monotonic()
+            return sorted(({
+                'sheet': key[1],
+                'columns': columns,
+                'rows': len(entry.values),
+                'bytes': entry.nbytes(),
+                'idle_seconds': round(now - entry.used_at, 1)
+            } for key, columns, entry in self._views()), key=lambda size: -size['bytes'])
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de uso de la caché"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'resident_bytes': self.resident_bytes(),
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'projections': sum(len(p) for p in self._projections.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'delta_syncs': self.delta_syncs,
+                'delta_fallbacks': self.delta_fallbacks,
+                'stale_served': self.stale_served,
+                'served_during_refresh': self.served_during_refresh,
+                'refreshed_ahead': self.refreshed_ahead,
+                'revalidated': self.revalidated,
+                'coalesced': self._flights.coalesced,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'shared': self.shared.stats() if self.shared is not None else None,
+                'revisions': self.revisions.stats() if self.revisions is not None else None
+            }
+
+    # Escrituras: si la entrada está vigente se actualiza en el lugar
+    # (incluyendo sus índices); si no, o ante cualquier error, se invalida
+    def _write(self, worksheet, call, change=None, versioned=False):
+        """
+        Ejecuta una escritura y actualiza o invalida la entrada cacheada.
+        versioned indica que la llamada ya lleva el token de versión de la
+        hoja; si no, se escribe después de los datos (ver revisions.py)
+        """
+        key = self.key_for(worksheet)
+        try:
+            result = call()
+        except Exception:
+            self._discard(key)
+            self._mark_changed(worksheet)
+            raise
+        if change is None:
+            self._discard(key)
+        else:
+            self._apply(worksheet, change)
+        if versioned:
+            self.revisions.registered(worksheet)
+        else:
+            self._mark_changed(worksheet)
+        return result
+
+    def _values_call(self, worksheet, data: List[Dict[str, Any]], value_input: str, fallback):
+        """
+        (llamada, versionada) que escribe los rangos A1 de data: un
+        values_batch_update que lleva también el token de versión de la hoja,
+        o fallback si la hoja no registra versiones
+        """
+        tokens = self.revisions.token_ranges(worksheet) if self.revisions is not None else None
+        if not tokens:
+            return fallback, False
+        body = {'valueInputOption': value_input, 'data': [
+            {'range': absolute_range_name(worksheet.title, item['range']), 'values': item['values']}
+            for item in data
+        ] + tokens}
+        return (lambda: worksheet.spreadsheet.values_batch_update(body)), True
+
+    def _requests_call(self, worksheet, requests: Callable[[], List[Dict[str, Any]]], fallback):
+        """Como _values_call, con los pedidos de spreadsheets.batchUpdate que arma requests()"""
+        tokens = self.revisions.token_requests(worksheet) if self.revisions is not None else None
+        if not tokens:
+            return fallback, False
+        body = {'requests': requests() + tokens}
+        return (lambda: worksheet.spreadsheet.batch_update(body)), True
+
+    def _apply(self, worksheet, change):
+        """
+        Aplica una escritura ya confirmada por Google Sheets a la entrada y
+        publica el resultado como la nueva generación compartida de la hoja
+        """
+        key = self.key_for(worksheet)
+        bumped = self.shared.bump(key) if self.shared is not None else None
+        updated = []
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            for columns, entry in self._entries_of(key):
+                if not entry.values or time.monotonic() - entry.loaded_at >= self.ttl:
+                    self._drop(key, columns)
+                    continue
+                try:
+                    change(entry)
+                    entry.version += 1
+                except Exception as e:
+                    logger.warning(f"Entrada de caché descartada para {key} {columns or ''}: {e}")
+                    self._drop(key, columns)
+                    self.invalidations += 1
+                    continue
+                # Solo una entrada al día con la generación anterior queda al día con la nueva
+                if bumped is not None and entry.shared_generation == bumped[0]:
+                    entry.shared_generation = bumped[1]
+                    updated.append((columns, entry))
+        for columns, entry in updated:
+            self._publish(key, columns, entry)
+
+    def append_row(self, worksheet, values, **kwargs):
+        if kwargs:
+            return self._write(worksheet, lambda: worksheet.append_row(values, **kwargs))
+        return self._append(worksheet, [values], lambda: worksheet.append_row(values))
+
+    def append_rows(self, worksheet, values, **kwargs):
+        if kwargs:
+            return self._write(worksheet, lambda: worksheet.append_rows(values, **kwargs))
+        return self._append(worksheet, values, lambda: worksheet.append_rows(values))
+
+    def _append(self, worksheet, rows, fallback):
+        # gspread agrega en modo RAW: appendCells guarda los mismos valores
+        call, versioned = self._requests_call(worksheet, lambda: [{'appendCells': {
+            'sheetId': worksheet.id,
+            'rows': [{'values': [cell_data(value) for value in row]} for row in rows],
+            'fields': 'userEnteredValue'
+        }}], fallback)
+        return self._write(worksheet, call, lambda entry: entry.append(rows), versioned)
+
+    def update_cell(self, worksheet, row: int, col: int, value):
+        # Cambios en los headers obligan a recargar la hoja completa
+        change = None if row <= 1 else (lambda entry: entry.update_cell(row, col, value))
+        call, versioned = self._values_call(
+            worksheet, [{'range': rowcol_to_a1(row, col), 'values': [[value]]}], 'USER_ENTERED',
+            lambda: worksheet.update_cell(row, col, value)
+        )
+        return self._write(worksheet, call, change, versioned)
+
+    def update(self, worksheet, range_name, values=None, **kwargs):
+        # Solo las escrituras RAW de una celda fuera de los headers se
+        # aplican en el lugar; rangos, fórmulas y headers invalidan
+        change = None
+        cell = None if kwargs else _single_cell_value(range_name, values)
+        if cell is not None and cell[0] > 1:
+            row, col, value = cell
+            change = lambda entry: entry.update_cell(row, col, value)
+        call, versioned = lambda: worksheet.update(range_name, values, **kwargs), False
+        if not kwargs and isinstance(range_name, str):
+            # Mismo valor por omisión que gspread: RAW
+            rows = values if isinstance(values, list) else [[values]]
+            if all(isinstance(item, list) for item in rows):
+                call, versioned = self._values_call(
+                    worksheet, [{'range': range_name, 'values': rows}], 'RAW', call
+                )
+        return self._write(worksheet, call, change, versioned)
+
+    def update_cells(self, worksheet, cells: List[Tuple[int, int, Any]], raw: bool = False):
+        """
+        Escribe varias celdas (fila, columna, valor) en una sola llamada a
+        batch_update. raw=False interpreta los valores como update_cell
+        (USER_ENTERED); raw=True los guarda tal cual, como update().
+        """
+        cells = list(cells)
+        if not cells:
+            return None
+        change = None
+        if all(row > 1 for row, _, _ in cells):
+            change = lambda entry: entry.update_cells(cells)
+        data = cells_to_ranges(cells)
+        call, versioned = self._values_call(worksheet, data, 'RAW' if raw else 'USER_ENTERED',
+                                            lambda: worksheet.batch_update(data, raw=raw))
+        return self._write(worksheet, call, change, versioned)
+
+    def batch(self, worksheet, raw: bool = False) -> 'CellBatch':
+        """Crea un acumulador de escrituras para una worksheet"""
+        return CellBatch(self, worksheet, raw=raw)
+
+    def delete_rows(self, worksheet, start_index: int, end_index: int = None):
+        end = end_index or start_index
+        change = None if start_index <= 1 else (lambda entry: entry.delete(start_index, end))
+        call, versioned = self._requests_call(worksheet, lambda: [{'deleteDimension': {
+            'range': {'sheetId': worksheet.id, 'dimension': 'ROWS', 'startIndex': start_index - 1, 'endIndex': end}
+        }}], lambda: worksheet.delete_rows(start_index, end_index))
+        return self._write(worksheet, call, change, versioned)
+
+    def delete_row_set(self, worksheet, row_numbers: List[int]):
+        """
+        Elimina varias filas, no necesariamente contiguas, en un solo
+        batch_update. Los bloques se borran de abajo hacia arriba para que
+        cada eliminación no desplace a las siguientes.
+        """
+        blocks = []
+        for row in sorted({row for row in row_numbers if row > 1}, reverse=True):
+            if blocks and blocks[-1][0] == row + 1:
+                blocks[-1][0] = row
+            else:
+                blocks.append([row, row])
+        if not blocks:
+            return None
+
+        requests = [{
+            'deleteDimension': {
+                'range': {'sheetId': worksheet.id, 'dimension': 'ROWS',
+                          'startIndex': start - 1, 'endIndex': end}
+            }
+        } for start, end in blocks]
+
+        def change(entry):
+            for start, end in blocks:
+                entry.delete(start, end)
+        call, versioned = self._requests_call(
+            worksheet, lambda: requests, lambda: worksheet.spreadsheet.batch_update({'requests': requests})
+        )
+        return self._write(worksheet, call, change, versioned)
+
+    def clear_worksheet(self, worksheet):
+        return self._write(worksheet, lambda: worksheet.clear())
+
+
+class CellBatch:
+    """
+    Acumula cambios de celdas de una o varias filas y los envía juntos.
+    Se usa como context manager: al salir sin errores hace flush().
+
+        with table_cache.batch(worksheet) as batch:
+            batch.set(fila, columna, valor)
+    """
+
+    def __init__(self, cache: TableCache, worksheet, raw: bool = False):
+        self.cache = cache
+        self.worksheet = worksheet
+        self.raw = raw
+        self.cells: List[Tuple[int, int, Any]] = []
+
+    def set(self, row: int, col: int, value):
+        """Registra el valor de una celda (numeración 1-based)"""
+        self.cells.append((row, col, value))
+
+    def set_fields(self, row: int, header: List[str], fields: Dict[str, Any]):
+        """Registra los campos de una fila según su posición en los headers"""
+        for field, value in fields.items():
+            if field in header:
+                self.set(row, header.index(field) + 1, value)
+
+    def flush(self):
+        """Envía los cambios pendientes en una sola llamada"""
+        cells, self.cells = self.cells, []
+        return self.cache.update_cells(self.worksheet, cells, raw=self.raw)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+# Instancia global de la caché
+table_cache = TableCache(
+    ttl=Config.SHEETS_CACHE_TTL,
+    delta_sheets=Config.SHEETS_DELTA_SYNC,
+    full_ttl=Config.SHEETS_FULL_SYNC_SECONDS,
+    stale_retry=Config.SHEETS_STALE_RETRY_SECONDS,
+    shared=SharedSnapshots(Config.SHEETS_SHARED_CACHE_DB) if Config.SHEETS_SHARED_CACHE else None,
+    revisions=revision_tracker,
+    max_bytes=int(Config.SHEETS_CACHE_MAX_MB * 1024 * 1024)
+)
@@ -0,0 +1,213 @@
+"""
+Cliente y handles de Google Sheets compartidos
+SharedClient entrega a app, AuthManager, el bot y SheetsManager un único
+cliente autorizado por proceso, con un pool de conexiones keep-alive del
+tamaño de Config.SHEETS_POOL_SIZE: una sola obtención de token OAuth y una
+sola sesión HTTP en lugar de una por módulo. Cada llamada del cliente pasa
+por los reintentos y el circuit breaker (sheets_resilience) y, en cada
+intento, por el control de cuota compartido (quota_governor).
+
+SheetHandles guarda los objetos Spreadsheet y Worksheet ya abiertos para no
+repetir en cada request las llamadas de metadata de open_by_key() y
+worksheet(). Un handle se descarta cuando la hoja no existe o cuando la
+caché de tablas invalida la hoja (cambio de headers, escrituras fallidas,
+clear).
+"""
+import base64
+import binascii
+import json
+import os
+import threading
+import logging
+from typing import Dict, Tuple, Any, Optional
+import gspread
+from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+from config import Config
+from backend.database.sheets_cache import table_cache
+from backend.database.quota import quota_governor
+from backend.database.resilience import sheets_resilience
+
+logger = logging.getLogger(__name__)
+
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+
+
+def load_service_account_info() -> Dict[str, Any]:
+    """
+    Credenciales de la cuenta de servicio desde el entorno, en el orden:
+    GOOGLE_SERVICE_ACCOUNT_JSON (JSON), GOOGLE_CREDENTIALS_FILE como ruta a
+    un archivo o como JSON en base64 (Railway) y credentials.json local
+    """
+    service_account_json = os.environ.get('GOOGLE_SERVICE_ACCOUNT_JSON')
+    if service_account_json:
+        return json.loads(service_account_json)
+
+    credentials = os.environ.get('GOOGLE_CREDENTIALS_FILE') or 'credentials.json'
+    if os.path.exists(credentials):
+        with open(credentials, 'r') as f:
+            return json.load(f)
+
+    try:
+        return json.loads(base64.b64decode(credentials, validate=True).decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("No se encontraron credenciales de Google: configura "
+                         "GOOGLE_SERVICE_ACCOUNT_JSON o GOOGLE_CREDENTIALS_FILE")
+
+
+def tune_session(client, pool_size: int):
+    """Monta en la sesión del cliente un pool keep-alive de pool_size conexiones"""
+    session = getattr(client, 'session', None)
+    if session is None or not hasattr(session, 'mount'):
+        return
+    # Sheets, Drive y OAuth usan hosts distintos; pool_block=False deja que
+    # los hilos extra abran conexiones temporales en vez de esperar
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+
+
+class SharedClient:
+    """Cliente de gspread único por proceso, creado la primera vez que se pide"""
+
+    def __init__(self):
+        self._client = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def get(self):
+        """Cliente autorizado compartido; se recrea en un proceso hijo tras fork"""
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                self._client = self._create()
+                self._pid = os.getpid()
+                self.created += 1
+            return self._client
+
+    def _create(self):
+        credentials = Credentials.from_service_account_info(load_service_account_info(), scopes=SCOPES)
+        client = gspread.authorize(credentials)
+        tune_session(client, Config.SHEETS_POOL_SIZE)
+        quota_governor.govern(client)
+        sheets_resilience.protect(client)
+        logger.info(f"Cliente de Google Sheets creado (pool de {Config.SHEETS_POOL_SIZE} conexiones)")
+        return client
+
+    def set(self, client):
+        """Fija el cliente compartido (cliente simulado en pruebas y benchmarks)"""
+        with self._lock:
+            self._client = client
+            self._pid = os.getpid()
+
+    def reset(self):
+        with self._lock:
+            self._client = None
+            self._pid = None
+
+
+
+class CachedSpreadsheet:
+    """
+    Envoltorio de un Spreadsheet de gspread cuyo worksheet(title) reutiliza
+    el handle cacheado. El resto de los atributos se delegan al original.
+    """
+
+    def __init__(self, spreadsheet, handles: 'SheetHandles'):
+        self._spreadsheet = spreadsheet
+        self._handles = handles
+
+    def worksheet(self, title: str):
+        return self._handles.worksheet(self._spreadsheet, title)
+
+    def add_worksheet(self, title: str, rows: int, cols: int, index=None):
+        worksheet = self._spreadsheet.add_worksheet(title=title, rows=rows, cols=cols, index=index)
+        self._handles.remember(self._spreadsheet, worksheet)
+        return worksheet
+
+    def __getattr__(self, name: str):
+        return getattr(self._spreadsheet, name)
+
+
+class SheetHandles:
+    """Caché de handles de Spreadsheet (por clave) y Worksheet (por título)"""
+
+    def __init__(self):
+        self._spreadsheets: Dict[str, CachedSpreadsheet] = {}
+        self._worksheets: Dict[Tuple[str, str], Any] = {}
+        self._lock = threading.Lock()
+        self.metadata_calls = 0
+        self.calls_avoided = 0
+        self.refreshes = 0
+
+    def open(self, client, key: str) -> CachedSpreadsheet:
+        """Equivalente cacheado de client.open_by_key(key)"""
+        with self._lock:
+            spreadsheet = self._spreadsheets.get(key)
+            if spreadsheet is not None:
+                self.calls_avoided += 1
+                return spreadsheet
+            self.metadata_calls += 1
+
+        spreadsheet = self.wrap(client.open_by_key(key))
+        with self._lock:
+            self._spreadsheets[key] = spreadsheet
+        return spreadsheet
+
+    def wrap(self, spreadsheet) -> CachedSpreadsheet:
+        """Envuelve un Spreadsheet ya abierto para cachear sus worksheets"""
+        if isinstance(spreadsheet, CachedSpreadsheet):
+            return spreadsheet
+        return CachedSpreadsheet(spreadsheet, self)
+
+    def worksheet(self, spreadsheet, title: str):
+        """Equivalente cacheado de spreadsheet.worksheet(title)"""
+        key = (spreadsheet.id, title)
+        with self._lock:
+            worksheet = self._worksheets.get(key)
+            if worksheet is not None:
+                self.calls_avoided += 1
+                return worksheet
+            self.metadata_calls += 1
+
+        # WorksheetNotFound se propaga sin cachear: la hoja puede crearse después
+        worksheet = spreadsheet.worksheet(title)
+        self.remember(spreadsheet, worksheet)
+        return worksheet
+
+    def remember(self, spreadsheet, worksheet):
+        with self._lock:
+            self._worksheets[(spreadsheet.id, worksheet.title)] = worksheet
+
+    def forget(self, key: Tuple[str, str]):
+        """Descarta el handle de una worksheet (spreadsheet_id, título)"""
+        with self._lock:
+            if self._worksheets.pop(key, None) is not None:
+                self.refreshes += 1
+
+    def clear(self):
+        with self._lock:
+            self._spreadsheets.clear()
+            self._worksheets.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Llamadas de metadata realizadas y evitadas"""
+        with self._lock:
+            return {
+                'spreadsheets': len(self._spreadsheets),
+                'worksheets': len(self._worksheets),
+                'metadata_calls': self.metadata_calls,
+                'metadata_calls_avoided': self.calls_avoided,
+                'refreshes': self.refreshes
+            }
+
+
+# Instancias globales; los handles se refrescan cuando la caché de tablas
+# invalida una hoja
+shared_client = SharedClient()
+get_sheets_client = shared_client.get
+
+sheet_handles = SheetHandles()
+table_cache.add_invalidation_listener(sheet_handles.forget)
@@ -0,0 +1,79 @@
+"""
+Coalescencia de lecturas concurrentes (single-flight)
+Cuando varios hilos piden al mismo tiempo la misma hoja o rango, solo el
+primero (el líder) llama a Google Sheets; los demás esperan su resultado y
+lo comparten, o reciben la misma excepción si la lectura falló.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class Flight:
+    """Una lectura en curso y su resultado"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        """Espera a que el líder termine y retorna su resultado (o lanza su error)"""
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Lecturas en curso por clave"""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+        # Métricas: lecturas realizadas y llamadas que esperaron a otra
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key: Hashable) -> Tuple[Flight, bool]:
+        """
+        Se une a la lectura en curso de `key` o inicia una. Retorna
+        (flight, True) si el llamador es el líder y debe llamar a finish()
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, key: Hashable, flight: Flight, result: Any = None,
+               error: Optional[BaseException] = None):
+        """Publica el resultado del líder y despierta a los que esperan"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result, flight.error = result, error
+        flight._done.set()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Ejecuta fn() una sola vez para todas las llamadas concurrentes con la misma clave"""
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.wait()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced
+            }
@@ -0,0 +1,275 @@
+"""
+Backend SQLite para MedConnect
+Implementa la misma interfaz que SheetsManager sobre una base de datos local
+(Config.DATABASE_URL), con índices por user_id, patient_id, telegram_id y
+email. Cada hoja se guarda en una tabla con las mismas columnas.
+
+Con STORAGE_BACKEND=sqlite se usa SQLiteReplica: una réplica de lectura de
+Google Sheets, que sigue siendo la fuente de verdad para app.py y el bot.
+Las escrituras van primero a Google Sheets y las tablas se vuelven a copiar
+cuando la hoja cambia.
+"""
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+from gspread.utils import numericise_all
+from backend.database.schema import SHEET_HEADERS, INDEXED_COLUMNS, get_headers
+from backend.database.sheets_cache import table_cache, to_cell
+from backend.database.storage import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+
+def sqlite_path(database_url: str) -> str:
+    """Ruta del archivo a partir de una URL sqlite:///archivo.db"""
+    prefix = 'sqlite:///'
+    if not database_url.startswith(prefix):
+        raise ValueError(f"DATABASE_URL no es una URL de SQLite: {database_url}")
+    return database_url[len(prefix):] or ':memory:'
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteManager(StorageBackend):
+    def __init__(self, database_url: str = 'sqlite:///medconnect.db'):
+        """Inicializa la base de datos local"""
+        self.database_url = database_url
+        self.conn = None
+        self._columns: Dict[str, List[str]] = {}
+        self._lock = threading.RLock()
+        self.connect()
+
+    def connect(self):
+        """Abre la base de datos y crea las tablas que falten"""
+        with self._lock:
+            if self.conn is None:
+                self.conn = sqlite3.connect(sqlite_path(self.database_url), check_same_thread=False)
+                self.conn.execute('PRAGMA journal_mode=WAL')
+            for sheet_name in SHEET_HEADERS:
+                self._ensure_table(sheet_name)
+        logger.info(f"Base de datos SQLite lista: {self.database_url}")
+
+    def _ensure_table(self, sheet_name: str) -> List[str]:
+        """Crea la tabla de una hoja (con sus índices) si no existe"""
+        columns = self._columns.get(sheet_name)
+        if columns is not None:
+            return columns
+
+        with self._lock:
+            table = _quote(sheet_name)
+            existing = [row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')]
+            if not existing:
+                headers = get_headers(sheet_name)
+                column_defs = ', '.join(f'{_quote(c)} TEXT NOT NULL DEFAULT \'\'' for c in headers)
+                # _row conserva el orden de inserción, como las filas de la hoja
+                self.conn.execute(
+                    f'CREATE TABLE {table} (_row INTEGER PRIMARY KEY AUTOINCREMENT, {column_defs})'
+                )
+                existing = ['_row'] + headers
+
+            columns = [c for c in existing if c != '_row']
+            for column in INDEXED_COLUMNS:
+                if column in columns:
+                    self.conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS {_quote(f"idx_{sheet_name}_{column}")} '
+                        f'ON {table} ({_quote(column)})'
+                    )
+            self.conn.commit()
+            self._columns[sheet_name] = columns
+            return columns
+
+    def _select(self, sheet_name: str, where: str = '', params: tuple = ()) -> List[Dict[str, Any]]:
+        columns = self._ensure_table(sheet_name)
+        column_list = ', '.join(_quote(c) for c in columns)
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT {column_list} FROM {_quote(sheet_name)} {where} ORDER BY _row', params
+            ).fetchall()
+        # Mismo formato que get_all_records(): números convertidos
+        return [dict(zip(columns, numericise_all(list(row)))) for row in rows]
+
+    # Primitivas de acceso a datos (ver StorageBackend)
+    def get_records(self, sheet_name: str) -> List[Dict[str, Any]]:
+        """Todos los registros de una tabla"""
+        return self._select(sheet_name)
+
+    def find_records(self, sheet_name: str, field: str, value) -> List[Dict[str, Any]]:
+        """Registros cuyo campo es igual a value (consulta indexada)"""
+        if field not in self._ensure_table(sheet_name):
+            return []
+        return self._select(sheet_name, f'WHERE {_quote(field)} = ?', (to_cell(value),))
+
+    def append_record(self, sheet_name: str, row_data: List[Any]):
+        """Agrega una fila con las columnas en el orden de los headers"""
+        columns = self._ensure_table(sheet_name)[:len(row_data)]
+        placeholders = ', '.join('?' for _ in columns)
+        with self._lock:
+            self.conn.execute(
+                f'INSERT INTO {_quote(sheet_name)} ({", ".join(_quote(c) for c in columns)}) '
+                f'VALUES ({placeholders})',
+                [to_cell(value) for value in row_data[:len(columns)]]
+            )
+            self.conn.commit()
+
+    def update_record(self, sheet_name: str, key_field: str, key, update_data: Dict[str, Any]) -> bool:
+        """Actualiza los campos del primer registro cuyo key_field es key"""
+        columns = self._ensure_table(sheet_name)
+        fields = [field for field in update_data if field in columns]
+        if key_field not in columns:
+            return False
+
+        with self._lock:
+            row = self.conn.execute(
+                f'SELECT _row FROM {_quote(sheet_name)} WHERE {_quote(key_field)} = ? ORDER BY _row LIMIT 1',
+                (to_cell(key),)
+            ).fetchone()
+            if row is None:
+                return False
+            if fields:
+                assignments = ', '.join(f'{_quote(field)} = ?' for field in fields)
+                self.conn.execute(
+                    f'UPDATE {_quote(sheet_name)} SET {assignments} WHERE _row = ?',
+                    [to_cell(update_data[field]) for field in fields] + [row[0]]
+                )
+                self.conn.commit()
+        return True
+
+    # Logging
+    def log_action(self, user_id: str, action: str, detail: str, ip_address: str = "", result: str = "success"):
+        """Registra una acción en el log"""
+        try:
+            log_id = f"LOG_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+            row_data = [
+                log_id,
+                user_id,
+                action,
+                detail,
+                ip_address,
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                result
+            ]
+
+            self.append_record('Logs_Acceso', row_data)
+
+        except Exception as e:
+            logger.error(f"Error registrando log: {e}")
+
+    def update_sheet_headers(self, sheet_name: str, additional_headers: List[str]):
+        """Agrega a la tabla las columnas que falten"""
+        try:
+            self._add_columns(sheet_name, additional_headers)
+        except Exception as e:
+            logger.error(f"Error actualizando headers de {sheet_name}: {e}")
+
+    def _add_columns(self, sheet_name: str, headers: List[str]):
+        columns = self._ensure_table(sheet_name)
+        new_headers = [header for header in headers if header not in columns]
+
+        if new_headers:
+            with self._lock:
+                for header in new_headers:
+                    self.conn.execute(
+                        f'ALTER TABLE {_quote(sheet_name)} ADD COLUMN {_quote(header)} TEXT NOT NULL DEFAULT \'\''
+                    )
+                self.conn.commit()
+                self._columns.pop(sheet_name, None)
+            self._ensure_table(sheet_name)
+            logger.info(f"Headers actualizados en {sheet_name}: {new_headers}")
+
+
+class SQLiteReplica(SQLiteManager):
+    """
+    Réplica de lectura de Google Sheets. Las consultas usan las tablas
+    indexadas; antes de leer una tabla, si pasaron sync_seconds desde la
+    última revisión, se obtiene la hoja desde table_cache (que revalida con
+    las versiones de las hojas) y, si cambió, se vuelve a copiar entera.
+    Las escrituras van primero a primary (un SheetsManager), que es lo que
+    ven app.py y el bot; la tabla solo se actualiza si Google Sheets aceptó
+    el cambio, para que se vea antes de la siguiente copia.
+    """
+
+    def __init__(self, database_url: str, primary: StorageBackend, sync_seconds: float = 5):
+        self.primary = primary
+        self.sync_seconds = sync_seconds
+        # hoja -> (momento de la última revisión, token de la copia)
+        self._synced: Dict[str, Tuple[float, Optional[tuple]]] = {}
+        self.syncs = 0
+        super().__init__(database_url)
+
+    def _sync(self, sheet_name: str):
+        """Vuelve a copiar la tabla desde Google Sheets si la hoja cambió"""
+        with self._lock:
+            now = time.monotonic()
+            last_check, last_token = self._synced.get(sheet_name, (None, None))
+            if last_check is not None and now - last_check < self.sync_seconds:
+                return
+            try:
+                worksheet = self.primary.get_worksheet(sheet_name)
+                values = table_cache.get_values(worksheet)
+                token = table_cache.snapshot_token(worksheet)
+                if last_check is None or token is None or token != last_token:
+                    self._replace_table(sheet_name, values)
+                    self.syncs += 1
+            except Exception as e:
+                # Sin Google Sheets se sirve la última copia
+                logger.warning(f"No se pudo sincronizar {sheet_name} desde Google Sheets: {e}")
+                token = last_token
+            self._synced[sheet_name] = (now, token)
+
+    def _replace_table(self, sheet_name: str, values: List[List[str]]):
+        """Reemplaza el contenido de la tabla por las filas de la hoja, en una transacción"""
+        if values:
+            self._add_columns(sheet_name, [header for header in values[0] if header])
+        columns = self._ensure_table(sheet_name)
+        positions = [(pos, header) for pos, header in enumerate(values[0] if values else [])
+                     if header and header in columns]
+        rows = [[row[pos] if pos < len(row) else '' for pos, _ in positions]
+                for row in values[1:] if any(row)]
+        with self._lock:
+            try:
+                self.conn.execute(f'DELETE FROM {_quote(sheet_name)}')
+                if positions:
+                    # Sin conversión a número: se conserva el texto de la celda
+                    self.conn.executemany(
+                        f'INSERT INTO {_quote(sheet_name)} ({", ".join(_quote(h) for _, h in positions)}) '
+                        f'VALUES ({", ".join("?" for _ in positions)})', rows
+                    )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def get_records(self, sheet_name: str) -> List[Dict[str, Any]]:
+        self._sync(sheet_name)
+        return super().get_records(sheet_name)
+
+    def find_records(self, sheet_name: str, field: str, value) -> List[Dict[str, Any]]:
+        self._sync(sheet_name)
+        return super().find_records(sheet_name, field, value)
+
+    def append_record(self, sheet_name: str, row_data: List[Any]):
+        """Agrega la fila en Google Sheets y después en la tabla"""
+        self.primary.append_record(sheet_name, row_data)
+        super().append_record(sheet_name, row_data)
+
+    def update_record(self, sheet_name: str, key_field: str, key, update_data: Dict[str, Any]) -> bool:
+        """Actualiza la fila en Google Sheets y, si existía, también en la tabla"""
+        if not self.primary.update_record(sheet_name, key_field, key, update_data):
+            return False
+        self._sync(sheet_name)
+        super().update_record(sheet_name, key_field, key, update_data)
+        return True
+
+    def log_action(self, user_id: str, action: str, detail: str, ip_address: str = "", result: str = "success"):
+        """El log de accesos se escribe solo en Google Sheets"""
+        self.primary.log_action(user_id, action, detail, ip_address, result)
+
+    def update_sheet_headers(self, sheet_name: str, additional_headers: List[str]):
+        self.primary.update_sheet_headers(sheet_name, additional_headers)
+        super().update_sheet_headers(sheet_name, additional_headers)
@@ -0,0 +1,484 @@
+"""
+Interfaz común de almacenamiento para MedConnect
+Las operaciones de negocio (usuarios, atenciones, medicamentos, exámenes,
+familiares y recordatorios) se implementan aquí sobre unas pocas primitivas
+de acceso a datos, que cada backend (Google Sheets, SQLite) implementa.
+"""
+from datetime import datetime
+import logging
+from typing import Dict, List, Optional, Any
+from backend.database.schema import get_headers
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBackend:
+    """Operaciones CRUD de MedConnect independientes del almacenamiento"""
+
+    # Primitivas que implementa cada backend
+    def connect(self):
+        raise NotImplementedError
+
+    def get_records(self, sheet_name: str) -> List[Dict[str, Any]]:
+        """Todos los registros de una hoja, en formato get_all_records()"""
+        raise NotImplementedError
+
+    def find_records(self, sheet_name: str, field: str, value) -> List[Dict[str, Any]]:
+        """Registros cuyo campo es igual a value (comparado como texto)"""
+        raise NotImplementedError
+
+    def append_record(self, sheet_name: str, row_data: List[Any]):
+        """Agrega una fila con las columnas en el orden de los headers"""
+        raise NotImplementedError
+
+    def update_record(self, sheet_name: str, key_field: str, key, update_data: Dict[str, Any]) -> bool:
+        """Actualiza los campos del primer registro cuyo key_field es key"""
+        raise NotImplementedError
+
+    def log_action(self, user_id: str, action: str, detail: str, ip_address: str = "", result: str = "success"):
+        raise NotImplementedError
+
+    def update_sheet_headers(self, sheet_name: str, additional_headers: List[str]):
+        raise NotImplementedError
+
+    def get_sheet_headers(self, sheet_name: str) -> List[str]:
+        """Define los headers para cada tipo de hoja"""
+        return get_headers(sheet_name)
+
+    def _find_one(self, sheet_name: str, field: str, value) -> Optional[Dict[str, Any]]:
+        records = self.find_records(sheet_name, field, value)
+        return records[0] if records else None
+
+    # CRUD Operations para Usuarios
+    def create_user(self, user_data: Dict[str, Any]) -> str:
+        """Crea un nuevo usuario en la base de datos"""
+        try:
+            # Generar ID único
+            user_id = f"USR_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+            row_data = [
+                user_id,
+                user_data.get('telegram_id', ''),
+                user_data.get('nombre', ''),
+                user_data.get('apellido', ''),
+                user_data.get('edad', ''),
+                user_data.get('rut', ''),
+                user_data.get('telefono', ''),
+                user_data.get('email', ''),
+                user_data.get('direccion', ''),
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'activo',
+                'freemium'
+            ]
+
+            self.append_record('Usuarios', row_data)
+
+            logger.info(f"Usuario {user_id} creado exitosamente")
+            return user_id
+
+        except Exception as e:
+            logger.error(f"Error creando usuario: {e}")
+            raise
+
+    def get_user_by_telegram_id(self, telegram_id: str) -> Optional[Dict[str, Any]]:
+        """Busca un usuario por su Telegram ID"""
+        try:
+            return self._find_one('Usuarios', 'telegram_id', telegram_id)
+        except Exception as e:
+            logger.error(f"Error buscando usuario: {e}")
+            return None
+
+    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Busca un usuario por su email"""
+        try:
+            return self._find_one('Usuarios', 'email', email)
+        except Exception as e:
+            logger.error(f"Error buscando usuario por email: {e}")
+            return None
+
+    def get_user_by_phone(self, telefono: str) -> Optional[Dict[str, Any]]:
+        """Busca un usuario por su teléfono"""
+        try:
+            return self._find_one('Usuarios', 'telefono', telefono)
+        except Exception as e:
+            logger.error(f"Error buscando usuario por teléfono: {e}")
+            return None
+
+    def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Busca un usuario por su ID interno"""
+        try:
+            return (self._find_one('Usuarios', 'id', user_id) or
+                    self._find_one('Usuarios', 'user_id', user_id))
+        except Exception as e:
+            logger.error(f"Error buscando usuario por ID: {e}")
+            return None
+
+    def update_user(self, user_id: str, update_data: Dict[str, Any]) -> bool:
+        """Actualiza los datos de un usuario"""
+        try:
+            if self.update_record('Usuarios', 'user_id', user_id, update_data):
+                logger.info(f"Usuario {user_id} actualizado exitosamente")
+                return True
+            return False
+
+        except Exception as e:
+            logger.error(f"Error actualizando usuario: {e}")
+            return False
+
+    # CRUD Operations para Atenciones Médicas
+    def create_atencion(self, atencion_data: Dict[str, Any]) -> str:
+        """Registra una nueva atención médica"""
+        try:
+            # Generar ID único
+            atencion_id = f"ATN_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+            row_data = [
+                atencion_id,
+                atencion_data.get('user_id', ''),
+                atencion_data.get('fecha', ''),
+                atencion_data.get('hora', ''),
+                atencion_data.get('tipo_atencion', ''),
+                atencion_data.get('especialidad', ''),
+                atencion_data.get('profesional', ''),
+                atencion_data.get('centro_salud', ''),
+                atencion_data.get('diagnostico', ''),
+                atencion_data.get('tratamiento', ''),
+                atencion_data.get('observaciones', ''),
+                atencion_data.get('proxima_cita', ''),
+                'registrada'
+            ]
+
+            self.append_record('Atenciones_Medicas', row_data)
+
+            logger.info(f"Atención {atencion_id} registrada exitosamente")
+            return atencion_id
+
+        except Exception as e:
+            logger.error(f"Error registrando atención: {e}")
+            raise
+
+    def get_user_atenciones(self, user_id: str) -> List[Dict[str, Any]]:
+        """Obtiene todas las atenciones de un usuario"""
+        try:
+            user_atenciones = self.find_records('Atenciones_Medicas', 'user_id', user_id)
+
+            # Ordenar por fecha más reciente
+            return sorted(
+                user_atenciones,
+                key=lambda x: datetime.strptime(x.get('fecha', '1900-01-01'), '%Y-%m-%d'),
+                reverse=True
+            )
+
+        except Exception as e:
+            logger.error(f"Error obteniendo atenciones: {e}")
+            return []
+
+    # CRUD Operations para Medicamentos
+    def create_medicamento(self, medicamento_data: Dict[str, Any]) -> str:
+        """Registra un nuevo medicamento"""
+        try:
+            # Generar ID único
+            medicamento_id = f"MED_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+            row_data = [
+                medicamento_id,
+                medicamento_data.get('user_id', ''),
+                medicamento_data.get('atencion_id', ''),
+                medicamento_data.get('nombre_medicamento', ''),
+                medicamento_data.get('dosis', ''),
+                medicamento_data.get('frecuencia', ''),
+                medicamento_data.get('duracion', ''),
+                medicamento_data.get('indicaciones', ''),
+                medicamento_data.get('fecha_inicio', ''),
+                medicamento_data.get('fecha_fin', ''),
+                'activo'
+            ]
+
+            self.append_record('Medicamentos', row_data)
+
+            logger.info(f"Medicamento {medicamento_id} registrado exitosamente")
+            return medicamento_id
+
+        except Exception as e:
+            logger.error(f"Error registrando medicamento: {e}")
+            raise
+
+    def get_user_medicamentos_activos(self, user_id: str) -> List[Dict[str, Any]]:
+        """Obtiene los medicamentos activos de un usuario"""
+        try:
+            medicamentos_activos = []
+            today = datetime.now().date()
+
+            for record in self.find_records('Medicamentos', 'user_id', user_id):
+                if record.get('estado') == 'activo':
+                    # Verificar si aún está vigente
+                    try:
+                        fecha_fin = datetime.strptime(record.get('fecha_fin', ''), '%Y-%m-%d').date()
+                        if fecha_fin >= today:
+                            medicamentos_activos.append(record)
+                    except:
+                        # Si no hay fecha fin válida, asumir que está activo
+                        medicamentos_activos.append(record)
+
+            return medicamentos_activos
+
+        except Exception as e:
+            logger.error(f"Error obteniendo medicamentos: {e}")
+            return []
+
+    # CRUD Operations para Exámenes
+    def create_examen(self, examen_data: Dict[str, Any]) -> str:
+        """Registra un nuevo examen"""
+        try:
+            # Generar ID único
+            examen_id = f"EXM_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+            row_data = [
+                examen_id,
+                examen_data.get('user_id', ''),
+                examen_data.get('atencion_id', ''),
+                examen_data.get('tipo_examen', ''),
+                examen_data.get('nombre_examen', ''),
+                examen_data.get('fecha_solicitud', ''),
+                examen_data.get('fecha_realizacion', ''),
+                examen_data.get('resultado', ''),
+                examen_data.get('archivo_url', ''),
+                examen_data.get('observaciones', ''),
+                'pendiente'
+            ]
+
+            self.append_record('Examenes', row_data)
+
+            logger.info(f"Examen {examen_id} registrado exitosamente")
+            return examen_id
+
+        except Exception as e:
+            logger.error(f"Error registrando examen: {e}")
+            raise
+
+    def get_user_examenes(self, user_id: str) -> List[Dict[str, Any]]:
+        """Obtiene exámenes de un usuario"""
+        try:
+            user_examenes = self.find_records('Examenes', 'user_id', user_id)
+
+            # Ordenar por fecha más reciente
+            return sorted(
+                user_examenes,
+                key=lambda x: datetime.strptime(x.get('fecha_realizacion', '1900-01-01'), '%Y-%m-%d') if x.get('fecha_realizacion') else datetime.min,
+                reverse=True
+            )
+
+        except Exception as e:
+            logger.error(f"Error obteniendo exámenes: {e}")
+            return []
+
+    # Operaciones para Familiares
+    def add_familiar_autorizado(self, familiar_data: Dict[str, Any]) -> str:
+        """Agrega un familiar autorizado"""
+        return self.authorize_family_member(familiar_data.get('user_id', ''), familiar_data)
+
+    def get_familiares_autorizados(self, user_id: str) -> List[Dict[str, Any]]:
+        """Obtiene los familiares autorizados de un usuario"""
+        try:
+            return [
+                record for record in self.find_records('Familiares_Autorizados', 'user_id', user_id)
+                if record.get('estado') == 'activo'
+            ]
+
+        except Exception as e:
+            logger.error(f"Error obteniendo familiares: {e}")
+            return []
+
+    # Métodos de utilidad
+    def get_user_summary(self, user_id: str) -> Dict[str, Any]:
+        """Obtiene un resumen completo del usuario"""
+        try:
+            user = self.get_user_by_telegram_id(user_id)
+            if not user:
+                return {}
+
+            atenciones = self.get_user_atenciones(user.get('user_id', ''))
+            medicamentos = self.get_user_medicamentos_activos(user.get('user_id', ''))
+            familiares = self.get_familiares_autorizados(user.get('user_id', ''))
+
+            return {
+                'usuario': user,
+                'total_atenciones': len(atenciones),
+                'atenciones_recientes': atenciones[:5],
+                'medicamentos_activos': len(medicamentos),
+                'medicamentos': medicamentos,
+                'familiares_autorizados': len(familiares)
+            }
+
+        except Exception as e:
+            logger.error(f"Error obteniendo resumen del usuario: {e}")
+            return {}
+
+    def get_medical_summary(self, user_id: str) -> Dict[str, Any]:
+        """Obtiene resumen médico completo de un usuario"""
+        try:
+            atenciones = self.get_user_atenciones(user_id)
+            medicamentos = self.get_user_medicamentos_activos(user_id)
+            examenes = self.get_user_examenes(user_id)
+
+            return {
+                'total_consultas': len(atenciones),
+                'consultas_recientes': atenciones[:3],
+                'medicamentos_activos': len(medicamentos),
+                'medicamentos': medicamentos,
+                'total_examenes': len(examenes),
+                'examenes_recientes': examenes[:3]
+            }
+
+        except Exception as e:
+            logger.error(f"Error obteniendo resumen médico: {e}")
+            return {}
+
+    # Métodos para gestión familiar avanzada
+    def authorize_family_member(self, user_id: str, family_data: Dict[str, Any]) -> str:
+        """Autoriza a un familiar con permisos específicos"""
+        try:
+            # Generar ID único
+            familiar_id = f"FAM_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+            row_data = [
+                familiar_id,
+                user_id,
+                family_data.get('nombre_familiar', ''),
+                family_data.get('parentesco', ''),
+                family_data.get('telefono', ''),
+                family_data.get('email', ''),
+                family_data.get('telegram_id', ''),  # telegram_id del familiar
+                family_data.get('permisos', 'lectura'),  # lectura, escritura, admin
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'activo',
+                family_data.get('notificaciones', 'true')  # Recibir notificaciones
+            ]
+
+            self.append_record('Familiares_Autorizados', row_data)
+
+            logger.info(f"Familiar {familiar_id} autorizado exitosamente")
+            return familiar_id
+
+        except Exception as e:
+            logger.error(f"Error autorizando familiar: {e}")
+            raise
+
+    def get_managed_users(self, user_id: str) -> List[Dict[str, Any]]:
+        """Obtiene usuarios que puede gestionar el usuario actual"""
+        try:
+            managed_users = []
+
+            for record in self.find_records('Familiares_Autorizados', 'telegram_id', user_id):
+                if (record.get('estado') == 'activo' and
+                    record.get('permisos') in ['escritura', 'admin']):
+
+                    # Obtener datos del usuario principal
+                    main_user = self.get_user_by_id(record.get('user_id'))
+                    if main_user:
+                        managed_users.append({
+                            'id': record.get('user_id'),
+                            'nombre': main_user.get('nombre', ''),
+                            'apellido': main_user.get('apellido', ''),
+                            'parentesco': record.get('parentesco', ''),
+                            'permisos': record.get('permisos', '')
+                        })
+
+            return managed_users
+
+        except Exception as e:
+            logger.error(f"Error obteniendo usuarios gestionados: {e}")
+            return []
+
+    def check_family_permission(self, user_id: str, target_user_id: str) -> bool:
+        """Verifica si un usuario tiene permisos para gestionar otro usuario"""
+        try:
+            # Un usuario siempre puede gestionar su propia información
+            if user_id == target_user_id:
+                return True
+
+            for record in self.find_records('Familiares_Autorizados', 'user_id', target_user_id):
+                if (str(record.get('telegram_id')) == str(user_id) and
+                    record.get('estado') == 'activo'):
+                    return True
+
+            return False
+
+        except Exception as e:
+            logger.error(f"Error verificando permisos familiares: {e}")
+            return False
+
+    def get_family_for_notifications(self, user_id: str) -> List[Dict[str, Any]]:
+        """Obtiene familiares que deben recibir notificaciones"""
+        try:
+            family_for_notifications = []
+
+            for record in self.find_records('Familiares_Autorizados', 'user_id', user_id):
+                if (record.get('estado') == 'activo' and
+                    record.get('notificaciones') == 'true' and
+                    record.get('telegram_id')):
+
+                    family_for_notifications.append({
+                        'telegram_id': record.get('telegram_id'),
+                        'nombre_familiar': record.get('nombre_familiar'),
+                        'parentesco': record.get('parentesco')
+                    })
+
+            return family_for_notifications
+
+        except Exception as e:
+            logger.error(f"Error obteniendo familia para notificaciones: {e}")
+            return []
+
+    # Gestión de recordatorios y notificaciones
+    def create_reminder(self, reminder_data: Dict[str, Any]) -> str:
+        """Crea un recordatorio/notificación"""
+        try:
+            # Generar ID único
+            reminder_id = f"REM_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+            row_data = [
+                reminder_id,
+                reminder_data.get('user_id', ''),
+                reminder_data.get('tipo', ''),  # medicamento, cita, general
+                reminder_data.get('titulo', ''),
+                reminder_data.get('mensaje', ''),
+                reminder_data.get('fecha_programada', ''),
+                reminder_data.get('hora_programada', ''),
+                reminder_data.get('frecuencia', 'unica'),  # unica, diaria, semanal
+                reminder_data.get('notificar_familiares', 'false'),
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'activo'
+            ]
+
+            self.append_record('Recordatorios', row_data)
+
+            logger.info(f"Recordatorio {reminder_id} creado exitosamente")
+            return reminder_id
+
+        except Exception as e:
+            logger.error(f"Error creando recordatorio: {e}")
+            raise
+
+    def get_user_active_reminders(self, user_id: str) -> List[Dict[str, Any]]:
+        """Obtiene recordatorios activos de un usuario"""
+        try:
+            active_reminders = []
+            today = datetime.now().date()
+
+            for record in self.find_records('Recordatorios', 'user_id', user_id):
+                if record.get('estado') == 'activo':
+                    # Verificar si el recordatorio aún está vigente
+                    try:
+                        fecha_programada = datetime.strptime(record.get('fecha_programada', ''), '%Y-%m-%d').date()
+                        if fecha_programada >= today:
+                            active_reminders.append(record)
+                    except:
+                        # Si no hay fecha válida, incluir el recordatorio
+                        active_reminders.append(record)
+
+            return active_reminders
+
+        except Exception as e:
+            logger.error(f"Error obteniendo recordatorios activos: {e}")
+            return []
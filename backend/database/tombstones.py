@@ -0,0 +1,132 @@
+"""
+Borrado lógico (tombstones) y compactación de hojas
+Eliminar una fila solo marca su columna de estado con TOMBSTONE, en una
+escritura de una celda: no se desplazan las filas siguientes ni se rompen
+las posiciones cacheadas. Las lecturas ignoran las filas marcadas y el
+Compactor las elimina físicamente cada cierto tiempo en un único
+batch_update por hoja.
+
+La compactación sí desplaza filas, y la hace el bot, que no comparte la
+caché con la plataforma web (otro servicio). Por eso toda escritura por
+posición en una hoja compactada (marcas de eliminación, URLs de exámenes,
+perfiles de usuario) confirma antes el número de fila con
+TableCache.confirm_rows.
+"""
+import threading
+import logging
+from typing import Callable, Dict, List, Any, Optional, Tuple
+from config import Config
+from backend.database.sheets_cache import table_cache, column_letter
+from backend.database.quota import quota_governor
+
+logger = logging.getLogger(__name__)
+
+TOMBSTONE = 'eliminado'
+
+# Hoja -> columna de estado donde se marca el borrado
+TOMBSTONE_FIELDS = {
+    'Consultas': 'status',
+    'Medicamentos': 'status',
+    'Examenes': 'status',
+    'Familiares': 'status',
+    'Usuarios': 'estado',
+}
+
+
+def is_tombstone(value) -> bool:
+    return str(value).strip().lower() == TOMBSTONE
+
+
+def is_deleted(row: List[Any], column: Optional[int]) -> bool:
+    """Si la fila está marcada como eliminada en la columna (0-based)"""
+    return column is not None and len(row) > column and is_tombstone(row[column])
+
+
+def tombstone_column(sheet_name: str, header: List[str]) -> Optional[int]:
+    """Posición (0-based) de la columna de estado de la hoja, o None"""
+    field = TOMBSTONE_FIELDS.get(sheet_name)
+    return header.index(field) if field in header else None
+
+
+def live_rows(rows, column: Optional[int]):
+    """Filtra pares (número de fila, fila) eliminados"""
+    return [(number, row) for number, row in rows if not is_deleted(row, column)]
+
+
+def live_records(records: List[Dict[str, Any]], field: str) -> List[Dict[str, Any]]:
+    """Filtra registros (formato get_all_records) eliminados"""
+    return [record for record in records if not is_tombstone(record.get(field, ''))]
+
+
+def mark_deleted(worksheet, rows: List[Tuple[int, Any]], column: int,
+                 key_columns: Tuple[int, ...] = (1,)) -> List[int]:
+    """
+    Marca como eliminadas las filas (número de fila, clave) en una sola
+    escritura (column 0-based). Las posiciones se confirman antes contra la
+    hoja por su clave (TableCache.confirm_rows), porque la compactación de
+    otro proceso pudo desplazarlas. Retorna los números de fila marcados.
+    """
+    row_numbers = [row for row in table_cache.confirm_rows(worksheet, rows, key_columns) if row is not None]
+    if row_numbers:
+        table_cache.update_cells(
+            worksheet, [(row, column + 1, TOMBSTONE) for row in row_numbers], raw=True
+        )
+    return row_numbers
+
+
+class Compactor:
+    """
+    Elimina físicamente las filas marcadas de las hojas con tombstones.
+    Debe correr en un solo proceso (el bot): antes de borrar vuelve a leer
+    la columna de estado para no depender de una caché desactualizada.
+    """
+
+    def __init__(self, get_spreadsheet: Callable, interval: float = None,
+                 sheets: Dict[str, str] = None):
+        self.get_spreadsheet = get_spreadsheet
+        self.interval = interval if interval is not None else Config.COMPACTION_SECONDS
+        self.sheets = sheets or TOMBSTONE_FIELDS
+        self.rows_removed = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def compact(self, worksheet) -> int:
+        """Elimina las filas marcadas de una worksheet; retorna cuántas"""
+        header = table_cache.read_range(worksheet, '1:1')
+        column = tombstone_column(worksheet.title, header[0] if header else [])
+        if column is None:
+            return 0
+        letter = column_letter(column + 1)
+        values = table_cache.read_range(worksheet, f'{letter}2:{letter}')
+        rows = [number for number, row in enumerate(values, 2) if row and is_tombstone(row[0])]
+        if rows:
+            table_cache.delete_row_set(worksheet, rows)
+            self.rows_removed += len(rows)
+            logger.info(f"🧹 {len(rows)} filas eliminadas de {worksheet.title}")
+        return len(rows)
+
+    def run_once(self) -> Dict[str, int]:
+        """Compacta todas las hojas configuradas"""
+        removed = {}
+        with quota_governor.background():
+            spreadsheet = self.get_spreadsheet()
+            for sheet_name in self.sheets:
+                try:
+                    removed[sheet_name] = self.compact(spreadsheet.worksheet(sheet_name))
+                except Exception as e:
+                    logger.error(f"Error compactando {sheet_name}: {e}")
+        return removed
+
+    def start(self):
+        """Inicia la compactación periódica en un hilo de fondo"""
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name='tombstone-compactor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
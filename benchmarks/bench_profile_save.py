@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark: llamadas a Google Sheets por cada guardado de perfil
+Compara la escritura campo por campo (update_cell) con el envío en lote
+(batch_update) usando el Google Sheets simulado con latencia. El registro
+de versiones está activo como en producción (Config.SHEETS_VERSION_SHEET),
+así que sus llamadas también se cuentan.
+
+Uso:
+    python benchmarks/bench_profile_save.py [--saves 20] [--latency-ms 150]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.revisions import RevisionTracker
+from backend.database.sheets_cache import TableCache
+from config import Config
+
+HEADERS = ['id', 'email', 'password_hash', 'nombre', 'apellido', 'telefono',
+           'fecha_nacimiento', 'genero', 'direccion', 'ciudad']
+
+PROFILE = {
+    'nombre': 'Ana', 'apellido': 'Pérez', 'email': 'ana@medconnect.cl',
+    'telefono': '912345678', 'fecha_nacimiento': '1990-05-04', 'genero': 'F',
+    'direccion': 'Av. Siempre Viva 742', 'ciudad': 'Santiago'
+}
+
+
+def save_per_field(cache, worksheet, row):
+    header = cache.get_header(worksheet)
+    for field, value in PROFILE.items():
+        if field in header:
+            cache.update_cell(worksheet, row, header.index(field) + 1, value)
+
+
+def save_batched(cache, worksheet, row):
+    header = cache.get_header(worksheet)
+    with cache.batch(worksheet) as batch:
+        batch.set_fields(row, header, PROFILE)
+
+
+def run(save, saves, latency):
+    rows = [[str(i), f'user{i}@medconnect.cl', 'x'] + [''] * (len(HEADERS) - 3)
+            for i in range(1, 101)]
+    client = FakeClient(latency=latency)
+    spreadsheet = client.create_spreadsheet('bench-profile', {'Usuarios': [HEADERS] + rows})
+    worksheet = spreadsheet.worksheet('Usuarios')
+    revisions = RevisionTracker(Config.SHEETS_VERSION_SHEET, ['Usuarios']) if Config.SHEETS_VERSION_SHEET else None
+    cache = TableCache(ttl=3600, revisions=revisions)
+    cache.get_values(worksheet)
+    # La primera escritura crea la hoja de versiones y registra la fila de Usuarios
+    save(cache, worksheet, 2)
+    client.reset_stats()
+
+    started = time.perf_counter()
+    for n in range(saves):
+        save(cache, worksheet, 2 + n % len(rows))
+    elapsed = time.perf_counter() - started
+    return client.total_calls / saves, elapsed / saves * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--saves', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=150)
+    args = parser.parse_args()
+
+    print(f"{'modo':<14}{'llamadas/guardado':>20}{'ms/guardado':>14}")
+    for name, save in (('campo a campo', save_per_field), ('en lote', save_batched)):
+        calls, ms = run(save, args.saves, args.latency_ms / 1000)
+        print(f"{name:<14}{calls:>20.1f}{ms:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark por ruta de la API de pacientes
+Ejecuta app.py con el cliente de pruebas de Flask contra un Google Sheets
+simulado (sin red) con hojas sintéticas de distintos tamaños, y reporta por
+ruta: latencia en frío (caché vacía) y en caliente (p50/p95), llamadas a
+Google Sheets por request y memoria máxima de un request en frío.
+
+Uso:
+    python benchmarks/bench_routes.py [--sizes 1000,10000,100000] [--requests 20]
+                                      [--latency-ms 0] [--json resultados.json]
+                                      [--compare base.json] [--tolerance 0.25]
+
+Con --compare se termina con código 1 si alguna ruta hace más llamadas por
+request o su p50 empeora más que la tolerancia respecto de la base.
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Antes de importar config: las hojas sintéticas usan un spreadsheet ficticio
+# y la caché compartida y la cuota de los procesos reales de la máquina no
+# se tocan (los archivos de estado van a un directorio temporal propio)
+os.environ['GOOGLE_SHEETS_ID'] = 'bench-spreadsheet'
+os.environ['SHEETS_SHARED_CACHE'] = 'false'
+os.environ['SHEETS_QUOTA_DB'] = os.path.join(tempfile.mkdtemp(prefix='medconnect-bench-'), 'quota.db')
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.revisions import RevisionTracker
+from backend.database.sheets_client import shared_client
+from config import Config, SHEETS_CONFIG
+
+PATIENT_ID = '1'
+ROWS_PER_PATIENT = 50
+
+CLINICAL_SHEETS = {
+    'Consultas': ('CON', lambda i: ['Dr. Pinto', 'Cardiología', '2024-01-15', 'Control',
+                                    'Reposo', '', 'completada']),
+    'Medicamentos': ('MED', lambda i: ['Losartán', '50mg', 'Cada 12 horas', '2024-01-15',
+                                       '2024-06-15', 'Dr. Pinto', 'activo' if i % 3 else 'suspendido']),
+    'Examenes': ('EXA', lambda i: ['Hemograma', '2024-01-20', 'Normal', 'Lab Central',
+                                   'Dr. Pinto', '', 'completado']),
+    SHEETS_CONFIG['family_members']['name']: ('FAM', lambda i: ['Luis Pérez', 'Hijo', '912345678',
+                                                                'luis@medconnect.cl', 'lectura', 'true', 'activo']),
+}
+
+CLINICAL_HEADERS = {
+    'Consultas': SHEETS_CONFIG['consultations']['columns'],
+    'Medicamentos': SHEETS_CONFIG['medications']['columns'],
+    'Examenes': SHEETS_CONFIG['exams']['columns'],
+    SHEETS_CONFIG['family_members']['name']: SHEETS_CONFIG['family_members']['columns'],
+}
+
+PROFILE = {
+    'nombre': 'Ana', 'apellido': 'Pérez', 'email': 'ana@medconnect.cl',
+    'telefono': '912345678', 'fecha_nacimiento': '1990-05-04', 'genero': 'F',
+    'direccion': 'Av. Siempre Viva 742', 'ciudad': 'Santiago'
+}
+
+
+def build_sheets(size):
+    """Hojas sintéticas de `size` filas, con ROWS_PER_PATIENT filas por paciente"""
+    patients = max(size // ROWS_PER_PATIENT, 1)
+    sheets = {}
+    for title, (prefix, make_row) in CLINICAL_SHEETS.items():
+        rows = [list(CLINICAL_HEADERS[title])]
+        for i in range(size):
+            rows.append([f'{prefix}_{i}', str(1 + i % patients)] + make_row(i))
+        sheets[title] = rows
+
+    users = [list(SHEETS_CONFIG['users']['columns'])]
+    for user_id in range(1, patients + 1):
+        users.append([str(user_id), f'user{user_id}@medconnect.cl', 'x', 'Nombre', 'Apellido',
+                      '', '', '', '', '', '2024-01-01T00:00:00', '', 'activo', 'paciente', 'false'])
+    sheets[SHEETS_CONFIG['users']['name']] = users
+    return sheets, patients
+
+
+def patient_ids(prefix, size, patients):
+    """IDs de las filas del paciente de prueba, en orden"""
+    return [f'{prefix}_{i}' for i in range(0, size, patients)]
+
+
+def load_app(client):
+    """Importa app.py conectado al cliente simulado"""
+    os.chdir(ROOT)
+    shared_client.set(client)
+    import app as medconnect
+    medconnect.app.config['TESTING'] = True
+    # Sin refresco en segundo plano: las llamadas medidas son las de cada request
+    medconnect.cache_refresher.stop()
+    return medconnect
+
+
+def fresh_revisions(medconnect):
+    """
+    Registro de versiones como en producción (Config.SHEETS_VERSION_SHEET),
+    sin el estado de la planilla sintética anterior
+    """
+    if Config.SHEETS_VERSION_SHEET:
+        medconnect.table_cache.revisions = RevisionTracker(
+            Config.SHEETS_VERSION_SHEET, Config.SHEETS_VERSIONED_SHEETS,
+            flush_interval=Config.SHEETS_VERSION_FLUSH_SECONDS
+        )
+
+
+def routes(size, patients):
+    """(nombre, método, generador de URL, cuerpo JSON)"""
+    def fixed(path):
+        return lambda n: path
+
+    def deleting(path, prefix):
+        ids = patient_ids(prefix, size, patients)
+        return lambda n: f'{path}/{ids[n]}'
+
+    base = f'/api/patient/{PATIENT_ID}'
+    return [
+        ('GET consultations', 'get', fixed(f'{base}/consultations'), None),
+        ('GET consultations p1', 'get', fixed(f'{base}/consultations?limit=20'), None),
+        ('GET medications', 'get', fixed(f'{base}/medications'), None),
+        ('GET exams', 'get', fixed(f'{base}/exams'), None),
+        ('GET family', 'get', fixed(f'{base}/family'), None),
+        ('GET stats', 'get', fixed(f'{base}/stats'), None),
+        ('GET dashboard', 'get', fixed(f'{base}/dashboard'), None),
+        ('GET dashboard p1', 'get', fixed(f'{base}/dashboard?limit=20'), None),
+        ('DELETE consultation', 'delete', deleting(f'{base}/consultations', 'CON'), None),
+        ('DELETE medication', 'delete', deleting(f'{base}/medications', 'MED'), None),
+        ('DELETE exam', 'delete', deleting(f'{base}/exams', 'EXA'), None),
+        ('DELETE family', 'delete', deleting(f'{base}/family', 'FAM'), None),
+        ('PUT profile/personal', 'put', fixed('/api/profile/personal'), PROFILE),
+    ]
+
+
+def run_route(medconnect, client, method, url_for, body, requests):
+    """Mide un request en frío, su memoria máxima y `requests` en caliente"""
+    test_client = medconnect.app.test_client()
+    with test_client.session_transaction() as session:
+        session['user_id'] = int(PATIENT_ID)
+
+    def call(n):
+        kwargs = {'json': body} if body is not None else {}
+        response = getattr(test_client, method)(url_for(n), **kwargs)
+        return response.status_code
+
+    # Frío: sin caché de datos ni de handles
+    medconnect.table_cache.clear()
+    medconnect.sheet_handles.clear()
+    client.reset_stats()
+    started = time.perf_counter()
+    status = call(0)
+    cold_ms = (time.perf_counter() - started) * 1000
+    cold_calls = client.total_calls
+
+    medconnect.table_cache.clear()
+    medconnect.sheet_handles.clear()
+    tracemalloc.start()
+    call(1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Caliente
+    client.reset_stats()
+    timings = []
+    for n in range(2, requests + 2):
+        started = time.perf_counter()
+        call(n)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    return {
+        'status': status,
+        'cold_ms': round(cold_ms, 2),
+        'cold_calls': cold_calls,
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        'calls_per_request': round(client.total_calls / requests, 2),
+        'peak_kb': round(peak / 1024, 1),
+        # Tamaño estimado de la caché de hojas tras los requests
+        'cache_kb': round(medconnect.table_cache.resident_bytes() / 1024, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Compara contra una ejecución anterior; retorna la lista de regresiones"""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        if current['calls_per_request'] > previous['calls_per_request']:
+            regressions.append(f"{key}: llamadas/request {previous['calls_per_request']} -> {current['calls_per_request']}")
+        if current['p50_ms'] > previous['p50_ms'] * (1 + tolerance) and current['p50_ms'] - previous['p50_ms'] > 1:
+            regressions.append(f"{key}: p50 {previous['p50_ms']} ms -> {current['p50_ms']} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--json', help='guardar los resultados en este archivo')
+    parser.add_argument('--compare', help='resultados base para detectar regresiones')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    client = FakeClient(latency=args.latency_ms / 1000)
+    # Cada DELETE consume una fila del paciente
+    requests = min(args.requests, ROWS_PER_PATIENT - 2)
+
+    medconnect = None
+    results = {}
+    header = (f"{'ruta':<22}{'filas':>8}{'estado':>7}{'frío ms':>10}{'llamadas':>9}"
+              f"{'p50 ms':>9}{'p95 ms':>9}{'llam/req':>9}{'pico KB':>10}{'caché KB':>10}")
+    print(header)
+    print('-' * len(header))
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        sheets, patients = build_sheets(size)
+        client.create_spreadsheet(Config.GOOGLE_SHEETS_ID, sheets)
+        if medconnect is None:
+            medconnect = load_app(client)
+        fresh_revisions(medconnect)
+
+        for name, method, url_for, body in routes(size, patients):
+            result = run_route(medconnect, client, method, url_for, body, requests)
+            results[f'{name} [{size}]'] = result
+            print(f"{name:<22}{size:>8}{result['status']:>7}{result['cold_ms']:>10.1f}"
+                  f"{result['cold_calls']:>9}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+                  f"{result['calls_per_request']:>9.2f}{result['peak_kb']:>10.1f}{result['cache_kb']:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESIÓN {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,8 +8,6 @@ import os
 import json
 import logging
 from datetime import datetime
-import gspread
-from google.oauth2.service_account import Credentials
 import requests
 import time
 import random
@@ -19,6 +17,12 @@ from werkzeug.utils import secure_filename
 import socket
 from auth_manager import AuthManager
 from backend.database.sheets_manager import SheetsManager
+from backend.database.sheets_cache import table_cache
+from backend.database.log_buffer import BufferedLogSink
+from backend.database.sheets_client import sheet_handles, get_sheets_client
+from backend.database.tombstones import Compactor, is_deleted, mark_deleted, tombstone_column
+from backend.database.refresher import CacheRefresher
+from backend.database.patient_stats import STATUS_COLUMN, patient_counters
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,30 +40,6 @@ MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
 # Crear directorio de uploads si no existe
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Las credenciales se cargan desde variables de entorno por seguridad
-def get_google_credentials():
-    """Obtiene las credenciales de Google desde variables de entorno"""
-    import json
-    import base64
-    
-    credentials_b64 = os.environ.get('GOOGLE_CREDENTIALS_FILE')
-    if not credentials_b64:
-        raise ValueError("GOOGLE_CREDENTIALS_FILE no está configurado")
-    
-    try:
-        # Decodificar las credenciales desde base64
-        credentials_json = base64.b64decode(credentials_b64).decode('utf-8')
-        return json.loads(credentials_json)
-    except Exception as e:
-        raise ValueError(f"Error decodificando credenciales: {e}")
-
-# Obtener credenciales al inicializar
-try:
-    GOOGLE_CREDS = get_google_credentials()
-except Exception as e:
-    logger.error(f"❌ Error cargando credenciales de Google: {e}")
-    GOOGLE_CREDS = None
-
 class MedConnectBot:
     def __init__(self):
         self.bot_token = TELEGRAM_BOT_TOKEN
@@ -72,14 +52,24 @@ class MedConnectBot:
         self.max_file_size = MAX_FILE_SIZE
         self.setup_sheets()
         self.setup_natural_language()
+        self.interactions_log = BufferedLogSink(
+            'bot_interactions',
+            lambda: self.spreadsheet.worksheet('Interacciones_Bot'),
+            id_prefix='INT'
+        )
+        # Elimina físicamente las filas marcadas como borradas (solo en el bot)
+        self.compactor = Compactor(lambda: self.spreadsheet)
+        # Mantiene vigentes en la caché las hojas más consultadas
+        self.refresher = CacheRefresher(lambda: self.spreadsheet)
+        if self.gc:
+            self.compactor.start()
+            self.refresher.start()
         
     def setup_sheets(self):
         try:
-            credentials = Credentials.from_service_account_info(
-                GOOGLE_CREDS, scopes=['https://www.googleapis.com/auth/spreadsheets']
-            )
-            self.gc = gspread.authorize(credentials)
-            self.spreadsheet = self.gc.open_by_key(self.sheets_id)
+            # Las credenciales (GOOGLE_CREDENTIALS_FILE en base64) las carga el cliente compartido
+            self.gc = get_sheets_client()
+            self.spreadsheet = sheet_handles.open(self.gc, self.sheets_id)
             logger.info("✅ Google Sheets conectado")
         except Exception as e:
             logger.error(f"❌ Error Google Sheets: {e}")
@@ -186,16 +176,19 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
         """Limpia usuarios duplicados con el mismo telegram_id"""
         try:
             worksheet = self.spreadsheet.worksheet('Usuarios')
-            all_values = worksheet.get_all_values()
+            all_values = table_cache.get_values(worksheet)
             
             if not all_values:
                 return
             
             headers = all_values[0]
+            estado_column = tombstone_column('Usuarios', headers)
             users_to_delete = []
             
             # Encontrar usuarios duplicados con mismo telegram_id
             for i, row in enumerate(all_values[1:], 2):
+                if is_deleted(row, estado_column):
+                    continue
                 if len(row) > 16:  # Asegurar que tiene columna telegram_id
                     row_telegram_id = str(row[16]).strip()
                     user_id_col = row[0] if len(row) > 0 else ''
@@ -205,13 +198,23 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
                     if (row_telegram_id == str(telegram_id) and 
                         user_id_col.startswith('USR_') and 
                         not email_col.strip()):
-                        users_to_delete.append(i)
+                        users_to_delete.append((i, user_id_col))
                         logger.info(f"🗑️ Marcando para eliminar usuario duplicado: {user_id_col} (fila {i})")
             
-            # Eliminar filas duplicadas (de abajo hacia arriba para no afectar índices)
-            for row_index in reversed(users_to_delete):
-                worksheet.delete_rows(row_index)
-                logger.info(f"✅ Usuario duplicado eliminado (fila {row_index})")
+            if not users_to_delete:
+                return
+            
+            # Marcar todos los duplicados en una sola escritura; la
+            # compactación los elimina después. Sin columna estado, se
+            # eliminan juntos en un solo batch_update. Las posiciones se
+            # confirman antes contra la hoja por el id de cada usuario
+            if estado_column is not None:
+                deleted_rows = mark_deleted(worksheet, users_to_delete, estado_column)
+            else:
+                deleted_rows = [row for row in table_cache.confirm_rows(worksheet, users_to_delete) if row]
+                if deleted_rows:
+                    table_cache.delete_row_set(worksheet, deleted_rows)
+            logger.info(f"✅ Usuarios duplicados eliminados (filas {deleted_rows})")
                 
         except Exception as e:
             logger.error(f"❌ Error limpiando duplicados: {e}")
@@ -225,7 +228,7 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
             
             # Buscar en la hoja de Usuarios
             worksheet = self.spreadsheet.worksheet('Usuarios')
-            all_values = worksheet.get_all_values()
+            all_values = table_cache.get_values(worksheet)
             
             logger.info(f"🔍 Buscando usuario con telegram_id: {user_id}")
             logger.info(f"📊 Total de filas en la hoja: {len(all_values)}")
@@ -236,10 +239,11 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
             
             headers = all_values[0]
             logger.info(f"📋 Headers disponibles: {headers}")
+            estado_column = tombstone_column('Usuarios', headers)
             
             # Buscar usuario existente por telegram_id en TODAS las filas
             for i, row in enumerate(all_values[1:], 2):  # Empezar desde la fila 2
-                if len(row) > 1:
+                if len(row) > 1 and not is_deleted(row, estado_column):
                     # Verificar si el telegram_id coincide (puede estar en diferentes columnas)
                     telegram_id_found = False
                     user_data = {}
@@ -310,7 +314,7 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
             
             # Buscar usuarios reales (con email) que no tengan telegram_id configurado
             for i, row in enumerate(all_values[1:], 2):
-                if len(row) > 1:
+                if len(row) > 1 and not is_deleted(row, estado_column):
                     user_data = {}
                     for j, header in enumerate(headers):
                         if j < len(row):
@@ -340,7 +344,11 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
                             # Encontrar la posición de telegram_id en headers
                             if 'telegram_id' in headers:
                                 telegram_col = headers.index('telegram_id') + 1  # +1 porque gspread usa 1-indexado
-                                worksheet.update_cell(i, telegram_col, str(user_id))
+                                # Posición actual de la fila, confirmada por su id
+                                user_row = table_cache.confirm_rows(worksheet, [(i, row[0])])[0]
+                                if user_row is None:
+                                    continue
+                                table_cache.update_cell(worksheet, user_row, telegram_col, str(user_id))
                                 logger.info(f"✅ Usuario {actual_user_id} vinculado con telegram_id {user_id}")
                                 
                                 # Limpiar usuarios duplicados después de vinculación exitosa
@@ -369,8 +377,8 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
             if missing_headers:
                 new_headers = headers + missing_headers
                 # Actualizar la fila de headers
-                worksheet.clear()
-                worksheet.append_row(new_headers)
+                table_cache.clear_worksheet(worksheet)
+                table_cache.append_row(worksheet, new_headers)
                 headers = new_headers
                 logger.info(f"📝 Headers actualizados: {missing_headers}")
             
@@ -398,7 +406,7 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
                     index = headers.index(header)
                     new_user_data[index] = value
             
-            worksheet.append_row(new_user_data)
+            table_cache.append_row(worksheet, new_user_data)
             logger.info(f"✅ Nuevo usuario del bot creado: {user_id_new}")
             
             return {
@@ -550,7 +558,7 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
                 'Registrado'
             ]
             
-            worksheet.append_row(new_row)
+            table_cache.append_row(worksheet, new_row)
             
             # Limpiar archivos del estado del usuario después de guardar
             if user_id in self.user_files:
@@ -772,7 +780,7 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
                     'programada'  # status
                 ]
             
-            worksheet.append_row(row_data)
+            table_cache.append_row(worksheet, row_data)
             logger.info(f"✅ Consulta guardada: {consulta_id} ({tipo})")
             
             # Si es consulta futura, programar recordatorio
@@ -861,7 +869,7 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
                 'activo'  # status
             ]
             
-            worksheet.append_row(row_data)
+            table_cache.append_row(worksheet, row_data)
             logger.info(f"✅ Medicamento guardado: {medicamento_id}")
             return True
             
@@ -873,15 +881,12 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
         try:
             if not self.gc:
                 return
-            worksheet = self.spreadsheet.worksheet('Interacciones_Bot')
-            all_values = worksheet.get_all_values()
-            next_id = len(all_values)
             
             row_data = [
-                next_id, user_id, username or 'Sin username', message, response,
+                self.interactions_log.next_id(), user_id, username or 'Sin username', message, response,
                 datetime.now().isoformat(), 'message', 'processed'
             ]
-            worksheet.append_row(row_data)
+            self.interactions_log.append(row_data)
             logger.info(f"✅ Registrado: {user_id}")
         except Exception as e:
             logger.error(f"❌ Error log: {e}")
@@ -1176,12 +1181,11 @@ Hacemos que gestionar tu salud sea fácil, rápido y seguro."""
         try:
             # Obtener información del examen
             worksheet = self.spreadsheet.worksheet('Examenes')
-            all_values = worksheet.get_all_values()
             
+            # Buscar solo entre los exámenes del usuario (índice por patient_id)
             exam_row = None
-            for row in all_values[1:]:
-                if (len(row) > 0 and str(row[0]) == str(exam_id) and 
-                    len(row) > 1 and str(row[1]) == str(user_id)):
+            for _, row in table_cache.get_patient_rows(worksheet, user_id):
+                if str(row[0]) == str(exam_id) and not is_deleted(row, STATUS_COLUMN):
                     exam_row = row
                     break
             
@@ -1466,6 +1470,20 @@ Puedo ayudarte con muchas cosas relacionadas con tu salud:
             logger.error(f"❌ Error mostrando menú de notificaciones: {e}")
             self.send_message(chat_id, "❌ Error mostrando menú de notificaciones.")
 
+    def get_medical_summary(self, user_id):
+        """Resumen médico del usuario desde los contadores materializados"""
+        try:
+            counters = patient_counters(self.spreadsheet, user_id)
+            return {
+                'total_consultas': counters['consultations'],
+                'medicamentos_activos': counters['medications'],
+                'total_examenes': counters['exams'],
+                'ultima_actividad': counters['last_activity']
+            }
+        except Exception as e:
+            logger.error(f"❌ Error obteniendo resumen médico: {e}")
+            return {}
+
     def show_medical_info_menu(self, chat_id, user_id):
         """Muestra el menú de información médica (propia o de familiar)"""
         try:
@@ -1484,7 +1502,10 @@ Puedo ayudarte con muchas cosas relacionadas con tu salud:
             menu_text += f"📊 <b>Resumen:</b>\n"
             menu_text += f"• Consultas: {medical_summary.get('total_consultas', 0)}\n"
             menu_text += f"• Medicamentos activos: {medical_summary.get('medicamentos_activos', 0)}\n"
-            menu_text += f"• Exámenes: {medical_summary.get('total_examenes', 0)}\n\n"
+            menu_text += f"• Exámenes: {medical_summary.get('total_examenes', 0)}\n"
+            if medical_summary.get('ultima_actividad'):
+                menu_text += f"• Última actividad: {medical_summary['ultima_actividad']}\n"
+            menu_text += "\n"
             
             buttons = [
                 [{"text": "🏥 Ver Consultas", "callback_data": f"view_consultations:{target_user_id}"}],
@@ -1739,12 +1760,11 @@ Puedo ayudarte con muchas cosas relacionadas con tu salud:
         try:
             # Obtener información del examen
             worksheet = self.spreadsheet.worksheet('Examenes')
-            all_values = worksheet.get_all_values()
             
+            # Buscar solo entre los exámenes del usuario (índice por patient_id)
             exam_row = None
-            for row in all_values[1:]:
-                if (len(row) > 0 and str(row[0]) == str(exam_id) and 
-                    len(row) > 1 and str(row[1]) == str(user_id)):
+            for _, row in table_cache.get_patient_rows(worksheet, user_id):
+                if str(row[0]) == str(exam_id) and not is_deleted(row, STATUS_COLUMN):
                     exam_row = row
                     break
             
@@ -24,12 +24,91 @@ class Config:
     TELEGRAM_BOT_ID = os.environ.get('TELEGRAM_BOT_ID') or '1071410995'
     TELEGRAM_WEBHOOK_URL = f"{BASE_URL}/webhook"
     
+    # Directorio de los archivos de estado que comparten los procesos de la
+    # máquina (cuota, caché de hojas): del usuario, no el /tmp común
+    STATE_DIR = (os.environ.get('MEDCONNECT_STATE_DIR')
+                 or os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'medconnect'))
+
     # Configuración de Google Sheets
     GOOGLE_SHEETS_ID = os.environ.get('GOOGLE_SHEETS_ID') or '1UvnO2lpZSyv13Hf2eG--kQcTff5BBh7jrZ6taFLJypU'
     GOOGLE_CREDENTIALS_FILE = os.environ.get('GOOGLE_CREDENTIALS_FILE')
-    
+    # Conexiones keep-alive del cliente compartido: hilos de request por
+    # worker más los hilos de fondo (logs diferidos)
+    SHEETS_POOL_SIZE = int(os.environ.get('SHEETS_POOL_SIZE') or 4)
+    # Cuota compartida por los procesos de la máquina (workers y bot):
+    # llamadas por minuto (0 desactiva el control), ráfaga máxima y archivo
+    # SQLite con el estado del token bucket
+    SHEETS_QUOTA_PER_MINUTE = float(os.environ.get('SHEETS_QUOTA_PER_MINUTE') or 60)
+    SHEETS_QUOTA_BURST = int(os.environ.get('SHEETS_QUOTA_BURST') or 20)
+    SHEETS_QUOTA_DB = (os.environ.get('SHEETS_QUOTA_DB')
+                       or os.path.join(STATE_DIR, 'sheets_quota.db'))
+    # Reintentos ante errores transitorios (backoff exponencial con jitter
+    # entre SHEETS_RETRY_BASE_SECONDS y SHEETS_RETRY_MAX_SECONDS) y circuit
+    # breaker: fallos seguidos para abrirlo y segundos que permanece abierto
+    SHEETS_RETRIES = int(os.environ.get('SHEETS_RETRIES') or 3)
+    SHEETS_RETRY_BASE_SECONDS = float(os.environ.get('SHEETS_RETRY_BASE_SECONDS') or 0.5)
+    SHEETS_RETRY_MAX_SECONDS = float(os.environ.get('SHEETS_RETRY_MAX_SECONDS') or 8)
+    SHEETS_BREAKER_FAILURES = int(os.environ.get('SHEETS_BREAKER_FAILURES') or 5)
+    SHEETS_BREAKER_RESET_SECONDS = float(os.environ.get('SHEETS_BREAKER_RESET_SECONDS') or 30)
+
+    # Segundos que se reutiliza una hoja leída antes de volver a descargarla
+    SHEETS_CACHE_TTL = int(os.environ.get('SHEETS_CACHE_TTL') or 60)
+    # Memoria máxima aproximada de la caché de hojas por proceso, en MB (0
+    # sin límite): al superarla se descartan las hojas usadas hace más tiempo
+    SHEETS_CACHE_MAX_MB = float(os.environ.get('SHEETS_CACHE_MAX_MB') or 128)
+    # Hojas de solo inserción que al vencer el TTL leen solo las filas nuevas,
+    # y segundos entre recargas completas de esas hojas
+    SHEETS_DELTA_SYNC = [
+        name.strip() for name in
+        (os.environ.get('SHEETS_DELTA_SYNC') or 'Consultas,Medicamentos,Examenes').split(',')
+        if name.strip()
+    ]
+    SHEETS_FULL_SYNC_SECONDS = int(os.environ.get('SHEETS_FULL_SYNC_SECONDS') or 600)
+    # Si una recarga falla se sirve la copia anterior (marcada como vencida)
+    # y se reintenta cada SHEETS_STALE_RETRY_SECONDS
+    SHEETS_STALE_RETRY_SECONDS = float(os.environ.get('SHEETS_STALE_RETRY_SECONDS') or 5)
+    # Copias de las hojas compartidas por los procesos de la máquina (workers
+    # y bot) en un archivo SQLite, con invalidación entre procesos
+    SHEETS_SHARED_CACHE = (os.environ.get('SHEETS_SHARED_CACHE') or 'true').lower() == 'true'
+    SHEETS_SHARED_CACHE_DB = (os.environ.get('SHEETS_SHARED_CACHE_DB')
+                              or os.path.join(STATE_DIR, 'sheets_cache.db'))
+    # Refresco en segundo plano de las hojas más consultadas antes de que
+    # venza su TTL: segundos entre revisiones (0 lo desactiva) y hojas
+    SHEETS_REFRESH_SECONDS = float(os.environ.get('SHEETS_REFRESH_SECONDS') or 10)
+    SHEETS_REFRESH_SHEETS = [
+        name.strip() for name in
+        (os.environ.get('SHEETS_REFRESH_SHEETS')
+         or 'Usuarios,Consultas,Medicamentos,Examenes,Familiares,Familiares_Autorizados').split(',')
+        if name.strip()
+    ]
+    # Hoja con la versión de cada hoja de SHEETS_VERSIONED_SHEETS, que cambia
+    # en cada escritura: las entradas vencidas de hojas sin cambios se
+    # revalidan sin descargarlas ('' lo desactiva). La versión viaja en la
+    # misma llamada que los datos; las que se escriben aparte y fallan se
+    # reintentan cada SHEETS_VERSION_FLUSH_SECONDS
+    SHEETS_VERSION_SHEET = os.environ.get('SHEETS_VERSION_SHEET', '_Versiones').strip()
+    SHEETS_VERSIONED_SHEETS = [
+        name.strip() for name in
+        (os.environ.get('SHEETS_VERSIONED_SHEETS')
+         or 'Usuarios,Consultas,Medicamentos,Examenes,Familiares,Familiares_Autorizados').split(',')
+        if name.strip()
+    ]
+    SHEETS_VERSION_FLUSH_SECONDS = float(os.environ.get('SHEETS_VERSION_FLUSH_SECONDS') or 1)
+    # Segundos entre compactaciones de filas eliminadas (0 la desactiva)
+    COMPACTION_SECONDS = int(os.environ.get('COMPACTION_SECONDS') or 3600)
+
+    # Logs diferidos: filas acumuladas y segundos máximos antes de enviarlas
+    LOG_BUFFER_MAX_ROWS = int(os.environ.get('LOG_BUFFER_MAX_ROWS') or 20)
+    LOG_BUFFER_FLUSH_SECONDS = float(os.environ.get('LOG_BUFFER_FLUSH_SECONDS') or 5)
+
     # Configuración de la base de datos (Google Sheets como respaldo)
     DATABASE_URL = os.environ.get('DATABASE_URL') or 'sqlite:///medconnect.db'
+    # Backend de SheetsManager: 'sheets' (Google Sheets) o 'sqlite' (DATABASE_URL).
+    # Con 'sqlite', la base es una réplica de lectura de GOOGLE_SHEETS_ID: las
+    # escrituras van a Google Sheets y cada tabla se vuelve a copiar cuando su
+    # hoja cambia (revisando como mucho cada STORAGE_SYNC_SECONDS)
+    STORAGE_BACKEND = (os.environ.get('STORAGE_BACKEND') or 'sheets').lower()
+    STORAGE_SYNC_SECONDS = float(os.environ.get('STORAGE_SYNC_SECONDS') or 5)
     
     # Configuración de sesiones
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
@@ -87,6 +166,14 @@ class TestingConfig(Config):
 
 # Configuración de hojas de Google Sheets
 SHEETS_CONFIG = {
+    'users': {
+        'name': 'Usuarios',
+        'columns': [
+            'id', 'email', 'password_hash', 'nombre', 'apellido', 'telefono',
+            'fecha_nacimiento', 'genero', 'direccion', 'ciudad', 'fecha_registro',
+            'ultimo_acceso', 'estado', 'tipo_usuario', 'verificado'
+        ]
+    },
     'patients': {
         'name': 'Pacientes',
         'columns': [
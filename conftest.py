@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Configuración común de las pruebas
+Las instancias globales (table_cache, quota_governor) se crean al importar
+config y los módulos de backend.database, así que el entorno se ajusta
+aquí, antes de que pytest importe las pruebas: sin caché compartida (las
+hojas simuladas no se publican en el archivo que usan los procesos reales
+de la máquina), con el estado de la cuota en un directorio temporal y sin
+hoja de versiones (las pruebas que la usan crean su RevisionTracker).
+"""
+
+import os
+import tempfile
+
+_STATE_DIR = tempfile.mkdtemp(prefix='medconnect-tests-')
+
+os.environ['SHEETS_SHARED_CACHE'] = 'false'
+os.environ['SHEETS_QUOTA_DB'] = os.path.join(_STATE_DIR, 'quota.db')
+os.environ['SHEETS_VERSION_SHEET'] = ''
@@ -3,6 +3,13 @@
 
 // Variables globales
 let currentUserId = null;
+// Última respuesta de /dashboard (todas las secciones en una sola llamada)
+let dashboardData = null;
+// Historial paginado (más recientes primero): registros mostrados y cursor
+// de la página siguiente por sección
+const PAGE_SIZE = 20;
+const historyItems = {};
+const historyCursors = {};
 
 // Funciones principales
 function scheduleAppointment() {
@@ -46,8 +53,110 @@ function getCurrentUserId() {
     return null;
 }
 
-// Función para cargar consultas del usuario
-async function loadConsultations() {
+// Muestra una sección del dashboard (lista o mensaje vacío)
+function renderSection(section, items, display) {
+    document.getElementById(`${section}-loading`).style.display = 'none';
+
+    if (items && items.length > 0) {
+        document.getElementById(`${section}-empty`).style.display = 'none';
+        display(items);
+    } else {
+        document.getElementById(`${section}-empty`).style.display = 'block';
+    }
+}
+
+function renderConsultations(consultations) {
+    renderSection('consultations', consultations, displayConsultations);
+}
+
+function renderMedications(medications) {
+    renderSection('medications', medications, displayMedications);
+}
+
+function renderExams(exams) {
+    renderSection('exams', exams, displayExams);
+}
+
+function renderFamilyMembers(family) {
+    renderSection('family', family, displayFamilyMembers);
+}
+
+const historyRenderers = {
+    consultations: renderConsultations,
+    medications: renderMedications,
+    exams: renderExams
+};
+
+// Muestra la primera página de una sección del historial
+function setHistoryPage(section, items, nextCursor) {
+    historyItems[section] = items || [];
+    historyCursors[section] = nextCursor || null;
+    historyRenderers[section](historyItems[section]);
+    updateLoadMore(section);
+}
+
+// Botón "Ver más" bajo la sección, solo si queda otra página
+function updateLoadMore(section) {
+    const container = document.getElementById(`${section}-container`);
+    if (!container) {
+        return;
+    }
+
+    let button = document.getElementById(`${section}-load-more`);
+    if (!historyCursors[section]) {
+        if (button) {
+            button.remove();
+        }
+        return;
+    }
+
+    if (!button) {
+        button = document.createElement('button');
+        button.id = `${section}-load-more`;
+        button.className = 'btn btn-sm btn-outline-primary w-100 mt-2';
+        button.innerHTML = '<i class="fas fa-chevron-down me-1"></i>Ver más';
+        button.onclick = () => loadMoreHistory(section);
+        container.after(button);
+    }
+    button.disabled = false;
+}
+
+// Agrega la página siguiente de una sección
+async function loadMoreHistory(section) {
+    const userId = getCurrentUserId();
+    const cursor = historyCursors[section];
+    if (!userId || !cursor) {
+        return;
+    }
+
+    const button = document.getElementById(`${section}-load-more`);
+    if (button) {
+        button.disabled = true;
+    }
+
+    try {
+        const response = await fetch(`/api/patient/${userId}/${section}?limit=${PAGE_SIZE}&cursor=${encodeURIComponent(cursor)}`);
+        const data = await response.json();
+
+        if (!response.ok) {
+            throw new Error(data.error || 'Error cargando más registros');
+        }
+
+        historyItems[section] = historyItems[section].concat(data[section] || []);
+        historyCursors[section] = data.next_cursor || null;
+        historyRenderers[section](historyItems[section]);
+        if (dashboardData) {
+            dashboardData[section] = historyItems[section];
+        }
+    } catch (error) {
+        console.error(`Error cargando más registros de ${section}:`, error);
+        showNotification('Error cargando más registros', 'error');
+    }
+    updateLoadMore(section);
+}
+
+// Carga todas las secciones y las estadísticas con una sola llamada
+async function loadDashboard() {
     const userId = getCurrentUserId();
     if (!userId) {
         console.error('No se pudo obtener el ID del usuario');
@@ -56,16 +165,45 @@ async function loadConsultations() {
     }
 
     try {
-        const response = await fetch(`/api/patient/${userId}/consultations`);
+        const response = await fetch(`/api/patient/${userId}/dashboard?limit=${PAGE_SIZE}`);
         const data = await response.json();
 
-        document.getElementById('consultations-loading').style.display = 'none';
+        if (!response.ok) {
+            throw new Error(data.error || 'Error cargando el dashboard');
+        }
 
-        if (data.consultations && data.consultations.length > 0) {
-            displayConsultations(data.consultations);
-        } else {
-            document.getElementById('consultations-empty').style.display = 'block';
+        dashboardData = data;
+        if (response.headers.get('X-Data-Stale')) {
+            showNotification('⚠️ Google Sheets no responde: mostrando los últimos datos guardados', 'warning');
         }
+        const cursors = data.cursors || {};
+        setHistoryPage('consultations', data.consultations, cursors.consultations);
+        setHistoryPage('medications', data.medications, cursors.medications);
+        setHistoryPage('exams', data.exams, cursors.exams);
+        renderFamilyMembers(data.family);
+        renderDashboardStats(data.stats);
+    } catch (error) {
+        console.error('Error cargando dashboard:', error);
+        dashboardData = null;
+        showConsultationsError();
+        renderDefaultStats();
+    }
+}
+
+// Función para cargar consultas del usuario
+async function loadConsultations() {
+    const userId = getCurrentUserId();
+    if (!userId) {
+        console.error('No se pudo obtener el ID del usuario');
+        showConsultationsError();
+        return;
+    }
+
+    try {
+        const response = await fetch(`/api/patient/${userId}/consultations?limit=${PAGE_SIZE}`);
+        const data = await response.json();
+
+        setHistoryPage('consultations', data.consultations, data.next_cursor);
     } catch (error) {
         console.error('Error cargando consultas:', error);
         showConsultationsError();
@@ -119,16 +257,10 @@ async function loadMedications() {
     try {
         document.getElementById('medications-loading').style.display = 'block';
 
-        const response = await fetch(`/api/patient/${userId}/medications`);
+        const response = await fetch(`/api/patient/${userId}/medications?limit=${PAGE_SIZE}`);
         const data = await response.json();
 
-        document.getElementById('medications-loading').style.display = 'none';
-
-        if (data.medications && data.medications.length > 0) {
-            displayMedications(data.medications);
-        } else {
-            document.getElementById('medications-empty').style.display = 'block';
-        }
+        setHistoryPage('medications', data.medications, data.next_cursor);
     } catch (error) {
         console.error('Error cargando medicamentos:', error);
         showMedicationsError();
@@ -181,16 +313,10 @@ async function loadExams() {
     try {
         document.getElementById('exams-loading').style.display = 'block';
 
-        const response = await fetch(`/api/patient/${userId}/exams`);
+        const response = await fetch(`/api/patient/${userId}/exams?limit=${PAGE_SIZE}`);
         const data = await response.json();
 
-        document.getElementById('exams-loading').style.display = 'none';
-
-        if (data.exams && data.exams.length > 0) {
-            displayExams(data.exams);
-        } else {
-            document.getElementById('exams-empty').style.display = 'block';
-        }
+        setHistoryPage('exams', data.exams, data.next_cursor);
     } catch (error) {
         console.error('Error cargando exámenes:', error);
         showExamsError();
@@ -366,13 +492,7 @@ async function loadFamilyMembers() {
         const response = await fetch(`/api/patient/${userId}/family`);
         const data = await response.json();
 
-        document.getElementById('family-loading').style.display = 'none';
-
-        if (data.family && data.family.length > 0) {
-            displayFamilyMembers(data.family);
-        } else {
-            document.getElementById('family-empty').style.display = 'block';
-        }
+        renderFamilyMembers(data.family);
     } catch (error) {
         console.error('Error cargando familiares:', error);
         showFamilyError();
@@ -441,6 +561,10 @@ function showFamilyError() {
 
 // Función para cargar datos cuando se cambia de tab  
 function loadTabData(tabName) {
+    // Las secciones ya llegaron con /dashboard
+    if (dashboardData) {
+        return;
+    }
     switch (tabName) {
         case 'medications':
             loadMedications();
@@ -505,9 +629,6 @@ function viewExamDetails(examName, examId) {
 
 // Navegación por tabs mejorada con carga dinámica
 document.addEventListener('DOMContentLoaded', function () {
-    // Cargar datos iniciales
-    loadConsultations();
-
     // Manejar cambios de tab
     const tabLinks = document.querySelectorAll('.nav-tabs .nav-link');
     tabLinks.forEach(link => {
@@ -599,8 +720,7 @@ async function deleteConsultation(consultationId, event) {
             showNotification('✅ Consulta eliminada exitosamente', 'success');
             // Esperar un poco para que se vea la animación antes de recargar
             setTimeout(() => {
-                loadConsultations();
-                loadDashboardStats(); // Actualizar estadísticas
+                loadDashboard(); // Secciones y estadísticas actualizadas
             }, 300);
         } else {
             // Remover la animación si hay error
@@ -661,8 +781,7 @@ async function deleteMedication(medicationId, event) {
         if (response.ok && data.success) {
             showNotification('✅ Medicamento eliminado exitosamente', 'success');
             setTimeout(() => {
-                loadMedications();
-                loadDashboardStats(); // Actualizar estadísticas
+                loadDashboard(); // Secciones y estadísticas actualizadas
             }, 300);
         } else {
             if (medicationElement) {
@@ -721,8 +840,7 @@ async function deleteExam(examId, event) {
         if (response.ok && data.success) {
             showNotification('✅ Examen eliminado exitosamente', 'success');
             setTimeout(() => {
-                loadExams();
-                loadDashboardStats(); // Actualizar estadísticas
+                loadDashboard(); // Secciones y estadísticas actualizadas
             }, 300);
         } else {
             if (examElement) {
@@ -773,7 +891,7 @@ async function deleteFamilyMember(familyId, event) {
         if (response.ok && data.success) {
             showNotification('✅ Contacto familiar eliminado exitosamente', 'success');
             setTimeout(() => {
-                loadFamilyMembers();
+                loadDashboard();
             }, 300);
         } else {
             if (familyElement) {
@@ -998,55 +1116,53 @@ async function loadDashboardStats() {
         const data = await response.json();
 
         if (response.ok) {
-            // Actualizar estadísticas en el dashboard
-            const consultationsCount = document.getElementById('consultations-count');
-            const medicationsCount = document.getElementById('medications-count');
-            const healthScore = document.getElementById('health-score');
-
-            if (consultationsCount) {
-                consultationsCount.innerHTML = data.consultations || 0;
-            }
-
-            if (medicationsCount) {
-                medicationsCount.innerHTML = data.medications || 0;
-            }
-
-            if (healthScore) {
-                healthScore.innerHTML = `${data.health_score || 95}%`;
-            }
-
-            console.log('📊 Estadísticas cargadas:', data);
+            renderDashboardStats(data);
         } else {
             console.error('Error cargando estadísticas:', data.error);
-            // Mostrar valores por defecto en caso de error
-            const consultationsCount = document.getElementById('consultations-count');
-            const medicationsCount = document.getElementById('medications-count');
-            const healthScore = document.getElementById('health-score');
-
-            if (consultationsCount) consultationsCount.innerHTML = '0';
-            if (medicationsCount) medicationsCount.innerHTML = '0';
-            if (healthScore) healthScore.innerHTML = '95%';
+            renderDefaultStats();
         }
     } catch (error) {
         console.error('Error cargando estadísticas:', error);
-        // Mostrar valores por defecto en caso de error
-        const consultationsCount = document.getElementById('consultations-count');
-        const medicationsCount = document.getElementById('medications-count');
-        const healthScore = document.getElementById('health-score');
+        renderDefaultStats();
+    }
+}
+
+// Actualizar estadísticas en el dashboard
+function renderDashboardStats(data) {
+    const consultationsCount = document.getElementById('consultations-count');
+    const medicationsCount = document.getElementById('medications-count');
+    const healthScore = document.getElementById('health-score');
+
+    if (consultationsCount) {
+        consultationsCount.innerHTML = data.consultations || 0;
+    }
+
+    if (medicationsCount) {
+        medicationsCount.innerHTML = data.medications || 0;
+    }
 
-        if (consultationsCount) consultationsCount.innerHTML = '0';
-        if (medicationsCount) medicationsCount.innerHTML = '0';
-        if (healthScore) healthScore.innerHTML = '95%';
+    if (healthScore) {
+        healthScore.innerHTML = `${data.health_score || 95}%`;
     }
+
+    console.log('📊 Estadísticas cargadas:', data);
+}
+
+// Mostrar valores por defecto en caso de error
+function renderDefaultStats() {
+    const consultationsCount = document.getElementById('consultations-count');
+    const medicationsCount = document.getElementById('medications-count');
+    const healthScore = document.getElementById('health-score');
+
+    if (consultationsCount) consultationsCount.innerHTML = '0';
+    if (medicationsCount) medicationsCount.innerHTML = '0';
+    if (healthScore) healthScore.innerHTML = '95%';
 }
 
 // Cargar estadísticas cuando se carga la página
 document.addEventListener('DOMContentLoaded', function () {
-    // Cargar estadísticas del dashboard
-    loadDashboardStats();
-
-    // Cargar datos iniciales de las pestañas
-    loadConsultations();
+    // Cargar todas las pestañas y las estadísticas en una sola llamada
+    loadDashboard();
 
     // Verificar estado de Telegram
     checkTelegramStatus();
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas de los índices de usuarios de AuthManager (sin conexión a Google Sheets)
+"""
+
+import itertools
+
+import pytest
+from gspread.utils import a1_to_rowcol
+
+import auth_manager
+
+HEADERS = [
+    'id', 'email', 'password_hash', 'nombre', 'apellido', 'telefono',
+    'fecha_nacimiento', 'genero', 'direccion', 'ciudad', 'fecha_registro',
+    'ultimo_acceso', 'estado', 'tipo_usuario', 'verificado',
+    'telegram_id', 'telegram_username'
+]
+
+
+_spreadsheet_ids = itertools.count()
+
+
+class StubSpreadsheet:
+    def __init__(self, worksheet):
+        # Id único: la caché global se indexa por él
+        self.id = f'auth-test-{next(_spreadsheet_ids)}'
+        self._worksheet = worksheet
+
+    def worksheet(self, title):
+        return self._worksheet
+
+
+class StubUsersSheet:
+    """Hoja Usuarios en memoria que cuenta las lecturas completas"""
+
+    def __init__(self, rows):
+        self.title = 'Usuarios'
+        self.values = [list(HEADERS)] + [list(row) for row in rows]
+        self.spreadsheet = StubSpreadsheet(self)
+        self.reads = 0
+        self.key_reads = 0
+        self.batch_calls = 0
+
+    def get_all_values(self):
+        self.reads += 1
+        return [list(row) for row in self.values]
+
+    def batch_get(self, ranges, **kwargs):
+        """Rangos de columnas ('A2:A2', 'A1:A'): la confirmación de filas"""
+        self.key_reads += 1
+        result = []
+        for range_name in ranges:
+            start, end = range_name.split(':')
+            first_row, first_col = a1_to_rowcol(start if start[-1].isdigit() else start + '1')
+            last_col = a1_to_rowcol(end.rstrip('0123456789') + '1')[1]
+            last_row = int(end[len(end.rstrip('0123456789')):] or len(self.values))
+            result.append([row[first_col - 1:last_col] for row in self.values[first_row - 1:last_row]])
+        return result
+
+    def get(self, range_name, **kwargs):
+        self.key_reads -= 1
+        return self.batch_get([range_name])[0]
+
+    def append_row(self, values, **kwargs):
+        self.values.append([str(v) for v in values])
+
+    def update(self, range_name, values=None, **kwargs):
+        row, col = a1_to_rowcol(range_name)
+        cells = self.values[row - 1]
+        cells.extend([''] * (col - len(cells)))
+        cells[col - 1] = str(values)
+
+    def batch_update(self, data, **kwargs):
+        self.batch_calls += 1
+        for item in data:
+            row, col = a1_to_rowcol(item['range'].split(':')[0])
+            for offset, value in enumerate(item['values'][0]):
+                self.update(auth_manager.gspread.utils.rowcol_to_a1(row, col + offset), value)
+
+
+def user_row(user_id, email, password_hash, telegram_id=''):
+    row = [''] * len(HEADERS)
+    row[0], row[1], row[2] = str(user_id), email, password_hash
+    row[3], row[4], row[12], row[13] = 'Ana', 'Pérez', 'activo', 'paciente'
+    row[15] = telegram_id
+    return row
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    sheet = StubUsersSheet([
+        user_row(1, 'ana@medconnect.cl', auth_manager.AuthManager.hash_password(None, 'clave123')),
+        user_row(5, 'luis@medconnect.cl', 'x', telegram_id='777'),
+    ])
+
+    class StubClient:
+        def open_by_key(self, key):
+            return sheet.spreadsheet
+
+    monkeypatch.setattr(auth_manager, 'get_sheets_client', lambda: StubClient())
+    return auth_manager.AuthManager()
+
+
+def test_lookups_use_one_snapshot(manager):
+    assert manager.email_exists('ANA@medconnect.cl')
+    assert manager.get_next_user_id() == 6
+    assert manager.get_user_by_id(5)['email'] == 'luis@medconnect.cl'
+    assert manager.get_user_by_telegram_id('777')['id'] == 5
+    assert manager.get_user_by_email('nadie@medconnect.cl') is None
+    assert 'password_hash' not in manager.get_user_by_id(1)
+    assert manager.users_sheet.reads == 1
+
+
+def test_indexes_follow_own_writes(manager):
+    success, _ = manager.register_user({
+        'email': 'Sofia@MedConnect.cl', 'password': 'clave123',
+        'nombre': 'Sofía', 'apellido': 'Rojas', 'tipo_usuario': 'paciente'
+    })
+    assert success
+    assert manager.get_user_by_email('sofia@medconnect.cl')['id'] == 6
+    assert manager.get_next_user_id() == 7
+
+    success, _, user = manager.link_telegram_account('sofia@medconnect.cl', 999, 'sofi')
+    assert success and user['telegram_id'] == '999'
+    assert manager.get_user_by_telegram_id(999)['email'] == 'sofia@medconnect.cl'
+
+    success, _, user = manager.login_user('ana@medconnect.cl', 'clave123')
+    assert success
+    assert manager.get_user_by_id(1)['ultimo_acceso'] == user['ultimo_acceso']
+    assert manager.users_sheet.reads == 1
+
+
+def test_profile_update_is_one_batch(manager):
+    success, _ = manager.update_user_profile(5, {'nombre': 'Luis', 'apellido': 'Soto', 'ciudad': 'Talca'})
+
+    assert success
+    assert manager.users_sheet.batch_calls == 1
+    assert manager.users_sheet.values[2][3:5] == ['Luis', 'Soto']
+    assert manager.get_user_by_id(5)['ciudad'] == 'Talca'
+    assert manager.users_sheet.reads == 1
+
+
+def test_writes_follow_rows_moved_by_another_process(manager):
+    assert manager.get_user_by_id(5)['email'] == 'luis@medconnect.cl'
+    # La compactación del bot elimina la fila 2: Luis pasa a la fila 2
+    del manager.users_sheet.values[1]
+
+    success, _ = manager.update_user_profile(5, {'nombre': 'Luis', 'apellido': 'Soto'})
+
+    assert success
+    assert manager.users_sheet.values[1][:5] == ['5', 'luis@medconnect.cl', 'x', 'Luis', 'Soto']
+    assert len(manager.users_sheet.values) == 2
+    assert manager.get_user_by_id(1) is None
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas del Google Sheets simulado en memoria
+"""
+
+import gspread
+import pytest
+from gspread.exceptions import APIError, WorksheetNotFound
+
+from backend.database.fake_gspread import FakeClient, install
+from backend.database.sheets_cache import TableCache
+
+
+def make_client(**kwargs):
+    client = FakeClient(**kwargs)
+    client.create_spreadsheet('sheet-test', {
+        'Consultas': [
+            ['id', 'patient_id', 'doctor'],
+            ['CON_1', 7, 'Dr. Pinto'],
+            ['CON_2', 8, 'Dra. Soto'],
+        ]
+    })
+    return client
+
+
+def test_reads_and_writes_follow_gspread():
+    client = make_client()
+    worksheet = client.open_by_key('sheet-test').worksheet('Consultas')
+
+    worksheet.append_row(['CON_3', 7, 'Dr. Rojas'])
+    worksheet.update_cell(2, 3, 'Dr. Muñoz')
+    worksheet.batch_update([{'range': 'B3:C3', 'values': [['9', 'Dra. Díaz']]}])
+    worksheet.delete_rows(4)
+
+    assert worksheet.row_values(1) == ['id', 'patient_id', 'doctor']
+    assert worksheet.get_all_values()[1:] == [['CON_1', '7', 'Dr. Muñoz'], ['CON_2', '9', 'Dra. Díaz']]
+    assert worksheet.get_all_records()[0] == {'id': 'CON_1', 'patient_id': 7, 'doctor': 'Dr. Muñoz'}
+    assert worksheet.batch_get(['A2:A3', 'C1']) == [[['CON_1'], ['CON_2']], [['doctor']]]
+    assert client.calls['open_by_key'] == 1
+    assert client.total_calls == 10
+
+    with pytest.raises(WorksheetNotFound):
+        client.open_by_key('sheet-test').worksheet('Otra')
+
+
+def test_quota_errors_are_injected():
+    client = make_client(quota_per_minute=3)
+    worksheet = client.open_by_key('sheet-test').worksheet('Consultas')
+    worksheet.get_all_values()
+
+    with pytest.raises(APIError) as error:
+        worksheet.get_all_values()
+    assert error.value.response.status_code == 429
+    assert client.errors == 1
+
+    client.quota_per_minute = None
+    client.fail_next(2)
+    for _ in range(2):
+        with pytest.raises(APIError):
+            worksheet.get_all_values()
+    assert worksheet.get_all_values()
+
+
+def test_install_patches_authorize_for_the_cache():
+    client = make_client()
+    authorize = gspread.authorize
+    with install(client):
+        worksheet = gspread.authorize(None).open_by_key('sheet-test').worksheet('Consultas')
+
+    cache = TableCache(ttl=60)
+    cache.get_records(worksheet)
+    cache.append_row(worksheet, ['CON_3', 7, 'Dr. Rojas'])
+
+    assert [n for n, _ in cache.get_patient_rows(worksheet, 7)] == [2, 4]
+    assert client.calls['get_all_values'] == 1
+    assert gspread.authorize is authorize
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas del registro diferido de logs (sin conexión a Google Sheets)
+"""
+
+import time
+
+from backend.database.log_buffer import BufferedLogSink
+
+
+class StubSpreadsheet:
+    id = 'log-test'
+
+
+class StubLogSheet:
+    def __init__(self, fail=False):
+        self.spreadsheet = StubSpreadsheet()
+        self.title = 'Interacciones_Bot'
+        self.batches = []
+        self.fail = fail
+
+    def append_rows(self, values, **kwargs):
+        if self.fail:
+            raise ConnectionError('sin conexión')
+        self.batches.append([list(row) for row in values])
+
+
+def test_rows_are_flushed_in_batches():
+    worksheet = StubLogSheet()
+    sink = BufferedLogSink('test', lambda: worksheet, id_prefix='INT', max_rows=3, flush_interval=60)
+
+    for n in range(3):
+        sink.append([sink.next_id(), n])
+
+    deadline = time.time() + 2
+    while not worksheet.batches and time.time() < deadline:
+        time.sleep(0.01)
+    sink.close()
+
+    assert len(worksheet.batches) == 1
+    assert [row[1] for row in worksheet.batches[0]] == [0, 1, 2]
+    assert len({row[0] for row in worksheet.batches[0]}) == 3
+
+
+def test_failed_flush_keeps_rows_for_retry():
+    worksheet = StubLogSheet(fail=True)
+    sink = BufferedLogSink('test', lambda: worksheet, id_prefix='LOG', max_rows=100, flush_interval=60)
+    sink.append(['LOG_1', 'login'])
+
+    assert sink.flush() == 0
+    assert sink.pending() == 1
+
+    worksheet.fail = False
+    sink.close()
+    assert worksheet.batches == [[['LOG_1', 'login']]]
+    assert sink.pending() == 0
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas del historial paginado por paciente (Google Sheets simulado)
+"""
+
+import pytest
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.patient_history import decode_cursor, encode_cursor, history_page
+from backend.database.sheets_cache import table_cache
+from backend.database.tombstones import mark_deleted
+from config import SHEETS_CONFIG
+
+DATES = ['2024-03-01', '15/01/2024', '2024-05-20', '2024-02-10', '01/04/2024', '2024-01-05']
+
+
+@pytest.fixture
+def spreadsheet():
+    client = FakeClient()
+    rows = [SHEETS_CONFIG['consultations']['columns']]
+    for i, date in enumerate(DATES, 1):
+        rows.append([f'CON_{i}', 7, 'Dr. Pinto', 'Cardiología', date, '', '', '', 'completada'])
+        rows.append([f'OTRA_{i}', 8, 'Dr. Soto', 'General', date, '', '', '', 'completada'])
+    spreadsheet = client.create_spreadsheet('history-test', {'Consultas': rows})
+    table_cache.clear()
+    yield spreadsheet
+    table_cache.clear()
+
+
+def ids(rows):
+    return [row[0] for row in rows]
+
+
+def test_newest_first_without_limit(spreadsheet):
+    rows, cursor = history_page(spreadsheet.worksheet('Consultas'), 7)
+    assert ids(rows) == ['CON_3', 'CON_5', 'CON_1', 'CON_4', 'CON_2', 'CON_6']
+    assert cursor is None
+
+
+def test_pages_follow_the_cursor(spreadsheet):
+    worksheet = spreadsheet.worksheet('Consultas')
+    first, cursor = history_page(worksheet, 7, limit=4)
+    assert ids(first) == ['CON_3', 'CON_5', 'CON_1', 'CON_4']
+
+    # Una inserción entre páginas no repite ni salta registros
+    table_cache.append_row(worksheet, ['CON_7', 7, 'Dr. Soto', '', '2024-06-01', '', '', '', 'completada'])
+    second, cursor = history_page(worksheet, 7, limit=4, cursor=cursor)
+    assert ids(second) == ['CON_2', 'CON_6']
+    assert cursor is None
+    assert ids(history_page(worksheet, 7, limit=1)[0]) == ['CON_7']
+
+
+def test_deleted_and_filtered_rows_are_skipped(spreadsheet):
+    worksheet = spreadsheet.worksheet('Consultas')
+    history_page(worksheet, 7)
+    spreadsheet.client.reset_stats()
+
+    mark_deleted(worksheet, [(6, 'CON_3')], 8)  # CON_3, la más reciente
+    rows, cursor = history_page(worksheet, 7, keep=lambda row: row[0] != 'CON_1', limit=2)
+    assert ids(rows) == ['CON_5', 'CON_4']
+    assert decode_cursor(cursor) == ('2024-02-10', 'CON_4', 8)
+    assert 'values_batch_get' not in spreadsheet.client.calls
+
+
+def test_invalid_cursor():
+    assert decode_cursor(encode_cursor(('2024-01-01', 'CON_1', 4))) == ('2024-01-01', 'CON_1', 4)
+    # Cursor sin secuencia (formato anterior)
+    assert decode_cursor(encode_cursor(('2024-01-01', 'CON_1'))) == ('2024-01-01', 'CON_1', 0)
+    with pytest.raises(ValueError):
+        decode_cursor('no-es-un-cursor')
+
+
+def test_duplicate_ids_are_not_lost_between_pages(spreadsheet):
+    worksheet = spreadsheet.worksheet('Consultas')
+    # Dos consultas creadas en el mismo segundo: mismo id y misma fecha
+    for doctor in ('Dr. Pinto', 'Dr. Soto', 'Dr. Rojas'):
+        table_cache.append_row(worksheet, ['CON_20240601_101500', 7, doctor, '', '2024-06-01', '', '', '', 'completada'])
+
+    seen = []
+    rows, cursor = history_page(worksheet, 7, limit=2)
+    seen += rows
+    while cursor:
+        rows, cursor = history_page(worksheet, 7, limit=2, cursor=cursor)
+        seen += rows
+    assert [row[2] for row in seen[:3]] == ['Dr. Rojas', 'Dr. Soto', 'Dr. Pinto']
+    assert len(seen) == 9
+
+    # Tras recargar la hoja, las secuencias son los números de fila y el orden se mantiene
+    table_cache.clear()
+    assert [row[2] for row in history_page(worksheet, 7, limit=3)[0]] == ['Dr. Rojas', 'Dr. Soto', 'Dr. Pinto']
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas de los contadores materializados por paciente (Google Sheets simulado)
+"""
+
+import pytest
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.patient_stats import patient_counters, patient_version, sortable_date
+from backend.database.sheets_cache import table_cache
+from backend.database.tombstones import mark_deleted
+from config import SHEETS_CONFIG
+
+
+def sheet(name, rows):
+    return [SHEETS_CONFIG[name]['columns']] + rows
+
+
+@pytest.fixture
+def spreadsheet():
+    client = FakeClient()
+    spreadsheet = client.create_spreadsheet('patient-stats-test', {
+        'Consultas': sheet('consultations', [
+            ['CON_1', 7, 'Dr. Pinto', 'Cardiología', '2024-01-15', '', '', '', 'completada'],
+            ['CON_2', 8, 'Dr. Soto', 'General', '2024-02-01', '', '', '', 'completada'],
+            ['CON_3', 7, 'Dr. Pinto', 'Cardiología', '20/03/2024', '', '', '', 'programada'],
+        ]),
+        'Medicamentos': sheet('medications', [
+            ['MED_1', 7, 'Losartán', '50mg', 'Cada 12 horas', '2024-01-15', '', '', 'activo'],
+            ['MED_2', 7, 'Aspirina', '100mg', 'Diario', '2024-01-10', '', '', 'suspendido'],
+        ]),
+        'Examenes': sheet('exams', [
+            ['EXA_1', 7, 'Hemograma', '05/04/2024', '', '', '', '', 'Registrado'],
+        ]),
+    })
+    table_cache.clear()
+    yield spreadsheet
+    table_cache.clear()
+
+
+def test_sortable_date():
+    assert sortable_date('2024-01-15') == '2024-01-15'
+    assert sortable_date('20/03/2024') == '2024-03-20'
+    assert sortable_date('2024-01-15 10:30:00') == '2024-01-15'
+    assert sortable_date('mañana') == ''
+
+
+def test_counters_from_one_batched_read(spreadsheet):
+    assert patient_counters(spreadsheet, 7) == {
+        'consultations': 2, 'medications': 1, 'exams': 1, 'last_activity': '2024-04-05'
+    }
+    assert spreadsheet.client.calls['values_batch_get'] == 1
+    spreadsheet.client.reset_stats()
+
+    assert patient_counters(spreadsheet, '8')['consultations'] == 1
+    assert patient_counters(spreadsheet, 99)['last_activity'] == ''
+    # Los handles de worksheet no se cachean aquí; los datos sí
+    assert set(spreadsheet.client.calls) == {'worksheet'}
+
+
+def test_counters_follow_inserts_deletes_and_status_changes(spreadsheet):
+    patient_counters(spreadsheet, 7)
+    consultations = spreadsheet.worksheet('Consultas')
+    medications = spreadsheet.worksheet('Medicamentos')
+
+    table_cache.append_row(consultations, ['CON_4', 7, 'Dr. Soto', '', '2024-06-01', '', '', '', 'completada'])
+    mark_deleted(consultations, [(2, 'CON_1')], 8)
+    table_cache.update_cells(medications, [(3, 9, 'activo')], raw=True)
+    spreadsheet.client.reset_stats()
+
+    counters = patient_counters(spreadsheet, 7)
+    assert counters == {'consultations': 2, 'medications': 2, 'exams': 1, 'last_activity': '2024-06-01'}
+    assert 'values_batch_get' not in spreadsheet.client.calls
+
+
+def test_version_changes_only_with_the_patients_rows(spreadsheet):
+    sheets = ['Consultas', 'Examenes']
+    version = patient_version(spreadsheet, 7, sheets)
+    other = patient_version(spreadsheet, 8, sheets)
+    spreadsheet.client.reset_stats()
+
+    assert patient_version(spreadsheet, 7, sheets) == version
+    assert 'values_batch_get' not in spreadsheet.client.calls
+
+    consultations = spreadsheet.worksheet('Consultas')
+    table_cache.append_row(consultations, ['CON_4', 7, 'Dr. Soto', '', '2024-06-01', '', '', '', 'completada'])
+    assert patient_version(spreadsheet, 7, sheets) != version
+    assert patient_version(spreadsheet, 8, sheets) == other
+
+    changed = patient_version(spreadsheet, 7, sheets)
+    mark_deleted(consultations, [(5, 'CON_4')], 8)
+    assert patient_version(spreadsheet, 7, sheets) not in (version, changed)
+
+
+def test_version_is_the_same_after_a_reload(spreadsheet):
+    version = patient_version(spreadsheet, 7, ['Consultas', 'Medicamentos'])
+    table_cache.clear()
+    assert patient_version(spreadsheet, 7, ['Consultas', 'Medicamentos']) == version
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas del control de cuota compartido de Google Sheets
+"""
+
+import pytest
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.quota import QuotaExhausted, QuotaGovernor
+
+
+def governor(tmp_path, per_minute=600, burst=2, **kwargs):
+    return QuotaGovernor(str(tmp_path / 'quota.db'), per_minute=per_minute, burst=burst, **kwargs)
+
+
+def test_burst_is_free_then_calls_wait(tmp_path):
+    quota = governor(tmp_path)
+    quota.acquire()
+    quota.acquire()
+    assert quota.stats()['waits'] == 0
+
+    quota.acquire()  # 10 tokens por segundo: ~0.1 s
+    stats = quota.stats()
+    assert stats['acquired'] == 3
+    assert stats['waits'] == 1
+    assert 0.05 < stats['waited_seconds'] < 0.5
+
+
+def test_bucket_is_shared_between_processes(tmp_path):
+    web, bot = governor(tmp_path), governor(tmp_path)
+    web.acquire()
+    web.acquire()
+
+    bot.acquire()
+    assert bot.stats()['waits'] == 1
+
+
+def test_background_calls_leave_the_reserve(tmp_path):
+    quota = governor(tmp_path, per_minute=6, burst=4, reserve=0.5,
+                     max_wait={'interactive': 0, 'background': 0})
+    with quota.background():
+        quota.acquire()
+        quota.acquire()
+        with pytest.raises(QuotaExhausted):
+            quota.acquire()
+
+    # La reserva queda para las llamadas interactivas
+    quota.acquire()
+    quota.acquire()
+    with pytest.raises(QuotaExhausted):
+        quota.acquire()
+    assert quota.stats()['rejected'] == 2
+
+
+def test_govern_wraps_every_client_call(tmp_path):
+    quota = governor(tmp_path, per_minute=6, burst=1, max_wait={'interactive': 0})
+    client = FakeClient()
+    client.create_spreadsheet('quota-test', {'Hoja': [['id']]})
+    quota.govern(client)
+    quota.govern(client)  # idempotente
+
+    client.open_by_key('quota-test')
+    with pytest.raises(QuotaExhausted):
+        client.open_by_key('quota-test')
+    assert client.total_calls == 1
+
+
+def test_disabled_governor_does_nothing(tmp_path):
+    quota = governor(tmp_path, per_minute=0)
+    client = FakeClient()
+    assert quota.govern(client).request == client.request
+    quota.acquire()
+    assert quota.stats()['acquired'] == 0
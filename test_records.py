@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas de los registros compactos (__slots__) de las hojas web
+"""
+
+import pytest
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.records import Consulta, Familiar, Medicamento, Usuario
+from backend.database.sheets_cache import TableCache, values_to_records
+
+USERS = [
+    ['id', 'email', 'password_hash', 'nombre', 'apellido', 'telefono', 'fecha_nacimiento', 'genero',
+     'direccion', 'estado', 'tipo_usuario', 'verificado', 'telegram_id', 'plan'],
+    ['1', 'ana@medconnect.cl', 'hash', 'Ana', 'Rojas', '56911112222', '1990-02-01', 'F',
+     'Los Aromos 12', 'activo', 'paciente', 'true', '', 'basico'],
+    ['2', 'luis@medconnect.cl', 'hash', 'Luis', 'Soto', '', '', 'M', '', 'eliminado', 'paciente', '', '', ''],
+]
+
+
+@pytest.fixture
+def spreadsheet():
+    return FakeClient().create_spreadsheet('records-test', {
+        'Usuarios': [list(row) for row in USERS],
+        'Familiares': [
+            ['id', 'patient_id', 'name', 'relationship', 'phone', 'email', 'access_level',
+             'emergency_contact', 'status'],
+            ['FAM_1', '1', 'Rosa', 'madre', '56933334444', '', 'full', 'TRUE', 'activo'],
+            ['FAM_2', '1', 'Juan', 'padre', '', '', 'basic', 'FALSE', 'eliminado'],
+            ['FAM_3', '2', 'Eva', 'hija', '', '', 'basic', 'FALSE', 'activo'],
+        ]
+    })
+
+
+def test_user_reads_like_a_get_all_records_dict():
+    records = values_to_records(USERS)
+    users = [Usuario.decoder(USERS[0])(row) for row in USERS[1:]]
+
+    for record, user in zip(records, users):
+        assert user.copy() == record
+        assert user['telefono'] == record['telefono']
+    # Columnas que la hoja no tiene: ausentes, como en el dict
+    assert users[0].get('ultimo_acceso', '') == ''
+    assert users[0]['plan'] == 'basico'
+    with pytest.raises(KeyError):
+        users[0]['ciudad']
+    assert 'password_hash' not in users[0].to_json()
+    assert users[1].is_deleted()
+
+
+def test_clinical_rows_serialize_to_web_shape():
+    consulta = Consulta.from_row(['CON_1', '7', 'Dr. Pinto', 'Cardiología', '05/03/2024',
+                                  'HTA', 'Losartán', '', ''])
+    assert consulta.to_json() == {
+        'id': 'CON_1', 'patient_id': '7', 'doctor': 'Dr. Pinto', 'specialty': 'Cardiología',
+        'date': '2024-03-05', 'diagnosis': 'HTA', 'treatment': 'Losartán', 'notes': '', 'status': ''
+    }
+    medicamento = Medicamento.decoder(['id', 'patient_id', 'medication'])(['MED_1', '7', 'Losartán'])
+    assert medicamento.to_json()['name'] == 'Losartán'
+    # Sin columna de estado se usa el valor por omisión
+    assert medicamento.to_json()['status'] == 'activo'
+
+
+def test_cached_objects_follow_writes(spreadsheet):
+    cache = TableCache(ttl=60)
+    worksheet = spreadsheet.worksheet('Usuarios')
+    users = cache.get_objects(worksheet, Usuario)
+    assert [user['email'] for user in users] == ['ana@medconnect.cl', 'luis@medconnect.cl']
+
+    cache.append_row(worksheet, ['3', 'eva@medconnect.cl', 'hash', 'Eva', 'Díaz'])
+    cache.update_cell(worksheet, 2, 4, 'Ana María')
+    cache.delete_rows(worksheet, 3)
+
+    spreadsheet.client.reset_stats()
+    users = cache.get_objects(worksheet, Usuario)
+    assert [(user['id'], user['nombre']) for user in users] == [(1, 'Ana María'), (3, 'Eva')]
+    assert spreadsheet.client.total_calls == 0
+
+
+def test_objects_by_field_use_the_index(spreadsheet):
+    cache = TableCache(ttl=60)
+    worksheet = spreadsheet.worksheet('Familiares')
+
+    family = cache.get_objects_by(worksheet, Familiar, 'patient_id', 1, columns='A:I')
+    assert [member.to_json()['name'] for member in family if not member.is_deleted()] == ['Rosa']
+    # Mismo formato que get_all_records: los números se convierten
+    assert family[0].to_json()['phone'] == 56933334444
+    assert cache.get_objects_by(worksheet, Familiar, 'nombre', 'Eva', columns='A:I') == []
+
+
+def test_objects_take_less_memory_than_records(spreadsheet):
+    worksheet = spreadsheet.worksheet('Usuarios')
+    sizes = []
+    for build in (lambda cache: cache.get_objects(worksheet, Usuario), lambda cache: cache.get_records(worksheet)):
+        cache = TableCache(ttl=60)
+        cache.get_values(worksheet)
+        rows_only = cache.resident_bytes()
+        build(cache)
+        sizes.append(cache.resident_bytes() - rows_only)
+    assert 0 < sizes[0] < sizes[1]
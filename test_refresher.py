@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas del refresco anticipado de hojas (stale-while-revalidate)
+"""
+
+import threading
+import time
+
+import pytest
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.refresher import CacheRefresher
+from backend.database.sheets_cache import TableCache
+from backend.database.sheets_client import SheetHandles
+
+
+@pytest.fixture
+def spreadsheet():
+    client = FakeClient()
+    # Como en app.py y bot.py: los handles de las worksheets se reutilizan
+    return SheetHandles().wrap(client.create_spreadsheet('refresh-test', {
+        'Usuarios': [['id', 'email'], ['1', 'ana@medconnect.cl']],
+        'Consultas': [['id', 'patient_id'], ['CON_1', '1']],
+        'Examenes': [['id', 'patient_id'], ['EXA_1', '1']],
+        'Logs_Acceso': [['id', 'user_id'], ['LOG_1', '1']]
+    }))
+
+
+def refresher(spreadsheet, cache, interval=0.05):
+    return CacheRefresher(lambda: spreadsheet, sheets=['Usuarios', 'Consultas', 'Examenes'],
+                          interval=interval, cache=cache)
+
+
+def test_views_are_refreshed_before_they_expire(spreadsheet):
+    cache = TableCache(ttl=0.3)
+    cache.get_values(spreadsheet.worksheet('Usuarios'))
+    cache.get_values(spreadsheet.worksheet('Logs_Acceso'))
+    for title in ('Consultas', 'Examenes'):
+        cache.get_columns(spreadsheet.worksheet(title), 'A:B')
+    worker = refresher(spreadsheet, cache)
+
+    spreadsheet.client.reset_stats()
+    assert worker.run_once() == 0  # aún lejos de vencer
+
+    time.sleep(0.22)
+    spreadsheet.worksheet('Examenes').append_row(['EXA_2', '1'])
+    spreadsheet.client.reset_stats()
+    # Usuarios completa y las dos proyecciones en una sola lectura; Logs_Acceso no es caliente
+    assert worker.run_once() == 3
+    assert spreadsheet.client.total_calls == 2
+
+    time.sleep(0.1)
+    spreadsheet.client.reset_stats()
+    assert cache.get_columns(spreadsheet.worksheet('Examenes'), 'A:B')[-1] == ['EXA_2', '1']
+    assert spreadsheet.client.total_calls == 0
+    assert cache.stats()['refreshed_ahead'] == 3
+
+
+def test_unused_views_are_left_to_expire(spreadsheet):
+    cache = TableCache(ttl=0.2)
+    worksheet = spreadsheet.worksheet('Usuarios')
+    cache.get_values(worksheet)
+    time.sleep(0.15)
+    assert cache.refresh_ahead(spreadsheet, ['Usuarios'], margin=0.1, idle=0.1) == 0
+    assert cache.refresh_ahead(spreadsheet, ['Usuarios'], margin=0.1, idle=1) == 1
+
+
+def test_expired_copy_is_served_while_another_thread_reloads(spreadsheet):
+    cache = TableCache(ttl=0.05)
+    worksheet = spreadsheet.worksheet('Consultas')
+    old = cache.get_columns(worksheet, 'A:B')
+    time.sleep(0.06)
+
+    spreadsheet.client.latency = 0.2
+    reload = threading.Thread(target=cache.get_columns, args=(worksheet, 'A:B'))
+    reload.start()
+    time.sleep(0.02)
+    started = time.perf_counter()
+    assert cache.get_columns(worksheet, 'A:B') is old
+    assert time.perf_counter() - started < 0.1
+    reload.join()
+    assert cache.stats()['served_during_refresh'] == 1
+
+
+def test_failed_refresh_keeps_the_copy_fresh(spreadsheet):
+    cache = TableCache(ttl=0.3)
+    worksheet = spreadsheet.worksheet('Usuarios')
+    cache.get_values(worksheet)
+    time.sleep(0.2)
+
+    spreadsheet.client.fail_next(1, code=503)
+    assert refresher(spreadsheet, cache).run_once() == 0
+    cache.get_values(worksheet)
+    assert not cache.take_stale()
+    assert cache.stats()['stale_served'] == 0
+
+
+def test_start_is_idempotent_and_respects_stop(spreadsheet):
+    worker = refresher(spreadsheet, TableCache(ttl=60), interval=0.01)
+    worker.start()
+    thread = worker._thread
+    worker.start()
+    assert worker._thread is thread
+    time.sleep(0.05)
+    worker.stop()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert worker.stats()['runs'] >= 1
+
+    disabled = refresher(spreadsheet, TableCache(ttl=60), interval=0)
+    disabled.start()
+    assert disabled._thread is None
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas de reintentos, circuit breaker y copias vencidas (Google Sheets simulado)
+"""
+
+import time
+
+import pytest
+from gspread.exceptions import APIError
+
+from backend.database.fake_gspread import FakeClient, FakeResponse, quota_error, unavailable_error
+from backend.database.resilience import CircuitBreaker, SheetsResilience, SheetsUnavailable
+from backend.database.sheets_cache import TableCache
+
+
+def flaky(*errors):
+    """request() que falla con los errores dados y luego responde 'ok'"""
+    pending = list(errors)
+    calls = []
+
+    def request(method, *args, **kwargs):
+        calls.append(method)
+        if pending:
+            raise pending.pop(0)
+        return 'ok'
+    request.calls = calls
+    return request
+
+
+def resilience(**kwargs):
+    return SheetsResilience(sleep=lambda seconds: None, **kwargs)
+
+
+def test_retries_quota_errors_with_backoff():
+    sheets = resilience(retries=3)
+    request = flaky(quota_error(), quota_error())
+    assert sheets.call(request, 'post') == 'ok'
+    assert len(request.calls) == 3
+    assert sheets.stats()['retried'] == 2
+    assert all(0 <= sheets.delay(attempt) <= min(8, 0.5 * 2 ** attempt) for attempt in range(6))
+
+
+def test_server_errors_are_retried_only_for_reads():
+    sheets = resilience(retries=3)
+    assert sheets.call(flaky(unavailable_error()), 'get') == 'ok'
+
+    request = flaky(unavailable_error())
+    with pytest.raises(APIError):
+        sheets.call(request, 'post')
+    assert len(request.calls) == 1
+
+
+def test_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    sheets = resilience(retries=0, breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(APIError):
+            sheets.call(flaky(unavailable_error()), 'get')
+    assert breaker.state == CircuitBreaker.OPEN
+
+    request = flaky()
+    with pytest.raises(SheetsUnavailable):
+        sheets.call(request, 'get')
+    assert request.calls == []
+
+    time.sleep(0.06)
+    assert sheets.call(request, 'get') == 'ok'
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert sheets.stats()['times_opened'] == 1
+
+
+def test_client_errors_do_not_open_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=1)
+    sheets = resilience(breaker=breaker)
+    not_found = APIError(FakeResponse(404, 'Requested entity was not found.', 'NOT_FOUND'))
+    with pytest.raises(APIError):
+        sheets.call(flaky(not_found), 'get')
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.fixture
+def worksheet():
+    client = FakeClient()
+    spreadsheet = client.create_spreadsheet('resilience-test', {
+        'Consultas': [['id', 'patient_id'], ['CON_1', '7']]
+    })
+    return spreadsheet.worksheet('Consultas')
+
+
+def test_stale_copy_is_served_when_reload_fails(worksheet):
+    cache = TableCache(ttl=0, stale_retry=5)
+    assert cache.get_columns(worksheet, 'A:B') == [['id', 'patient_id'], ['CON_1', '7']]
+    assert not cache.take_stale()
+
+    worksheet.client.fail_next(1, code=503)
+    assert cache.get_columns(worksheet, 'A:B')[1] == ['CON_1', '7']
+    assert cache.take_stale()
+    assert not cache.take_stale()
+
+    # Hasta el próximo reintento la copia se sirve sin llamar a la API
+    worksheet.client.reset_stats()
+    cache.get_columns(worksheet, 'A:B')
+    assert cache.take_stale()
+    assert worksheet.client.total_calls == 0
+    assert cache.stats()['stale_served'] == 1
+
+
+def test_prefetch_falls_back_to_stale_copies(worksheet):
+    cache = TableCache(ttl=0, stale_retry=5)
+    spreadsheet = worksheet.spreadsheet
+    cache.prefetch(spreadsheet, [worksheet], 'A:B')
+
+    spreadsheet.client.fail_next(1, code=503)
+    assert cache.prefetch(spreadsheet, [worksheet], 'A:B') == 0
+    assert cache.take_stale()
+
+
+def test_without_a_copy_the_error_propagates(worksheet):
+    cache = TableCache(ttl=0)
+    worksheet.client.fail_next(1, code=503)
+    with pytest.raises(APIError):
+        cache.get_columns(worksheet, 'A:B')
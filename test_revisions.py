@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la revalidación de la caché con la hoja de versiones
+"""
+
+import time
+
+import pytest
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.revisions import RevisionTracker
+from backend.database.sheets_cache import TableCache
+
+
+@pytest.fixture
+def spreadsheet():
+    client = FakeClient()
+    return client.create_spreadsheet('revisions-test', {
+        'Consultas': [['id', 'patient_id'], ['CON_1', '7']],
+        'Examenes': [['id', 'patient_id'], ['EXA_1', '7']],
+        'Logs_Acceso': [['id', 'user_id'], ['LOG_1', '7']],
+        '_Versiones': [['hoja', 'version']]
+    })
+
+
+def tracker(probe_ttl=0):
+    # Sin hilo de fondo en la práctica: las pruebas llaman a flush()
+    return RevisionTracker('_Versiones', ['Consultas', 'Examenes'], flush_interval=60, probe_ttl=probe_ttl)
+
+
+def test_unchanged_sheet_is_revalidated_without_download(spreadsheet):
+    cache = TableCache(ttl=0.05, revisions=tracker())
+    worksheet = spreadsheet.worksheet('Consultas')
+    values = cache.get_values(worksheet)
+    time.sleep(0.06)
+
+    spreadsheet.client.reset_stats()
+    assert cache.get_values(worksheet) is values
+    # Solo la lectura de las versiones
+    assert dict(spreadsheet.client.calls) == {'get': 1}
+    assert cache.stats()['revalidated'] == 1
+
+
+def test_write_from_another_process_forces_download(spreadsheet):
+    web, bot = TableCache(ttl=0.05, revisions=tracker()), TableCache(ttl=0.05, revisions=tracker())
+    worksheet = spreadsheet.worksheet('Consultas')
+    web.get_values(worksheet)
+
+    # La versión se registra en la misma escritura, sin esperar un envío diferido
+    bot.append_row(worksheet, ['CON_2', '7'])
+    time.sleep(0.06)
+    assert web.get_values(worksheet)[-1] == ['CON_2', '7']
+    assert web.stats()['revalidated'] == 0
+
+
+def test_writes_carry_their_version_in_the_same_call(spreadsheet):
+    revisions = tracker()
+    cache = TableCache(ttl=60, revisions=revisions)
+    worksheet = spreadsheet.worksheet('Consultas')
+    cache.get_values(worksheet)
+    versions = [revisions.signatures(spreadsheet).get('Consultas', '')]
+
+    writes = [
+        (lambda: cache.append_row(worksheet, ['CON_2', '7']), 'spreadsheet_batch_update'),
+        (lambda: cache.update_cells(worksheet, [(2, 2, '8'), (3, 2, '9')], raw=True), 'values_batch_update'),
+        (lambda: cache.update_cell(worksheet, 2, 2, '7'), 'values_batch_update'),
+        (lambda: cache.delete_row_set(worksheet, [3]), 'spreadsheet_batch_update'),
+    ]
+    for write, method in writes:
+        spreadsheet.client.reset_stats()
+        write()
+        # Datos y versión en una sola llamada, sin lecturas
+        assert dict(spreadsheet.client.calls) == {method: 1}
+        versions.append(revisions.signatures(spreadsheet)['Consultas'])
+    assert len(set(versions)) == len(versions)
+    assert worksheet.get_all_values() == [['id', 'patient_id'], ['CON_1', '7']]
+    assert revisions.stats()['inline'] == 4
+
+
+def test_changed_version_reloads_delta_sheets(spreadsheet):
+    web = TableCache(ttl=0.05, delta_sheets=['Consultas'], revisions=tracker())
+    bot = TableCache(ttl=60, revisions=tracker())
+    worksheet = spreadsheet.worksheet('Consultas')
+    worksheet.append_row(['CON_2', '8'])
+    web.get_values(worksheet)
+
+    # Edición en el lugar (como una marca de eliminación): la lectura incremental no la vería
+    bot.update_cell(worksheet, 2, 2, 'eliminado')
+    time.sleep(0.06)
+
+    spreadsheet.client.reset_stats()
+    assert web.get_values(worksheet)[1] == ['CON_1', 'eliminado']
+    assert spreadsheet.client.calls['get_all_values'] == 1
+    assert web.stats()['delta_syncs'] == 0
+
+
+def test_full_reload_is_not_postponed(spreadsheet):
+    cache = TableCache(ttl=0.05, full_ttl=0.15, revisions=tracker())
+    worksheet = spreadsheet.worksheet('Consultas')
+    cache.get_values(worksheet)
+    time.sleep(0.06)
+    cache.get_values(worksheet)
+    # Una edición manual no cambia la versión: se ve en la recarga completa
+    worksheet.update_cell(2, 2, '8')
+    time.sleep(0.1)
+
+    spreadsheet.client.reset_stats()
+    assert cache.get_values(worksheet)[1] == ['CON_1', '8']
+    assert spreadsheet.client.calls['get_all_values'] == 1
+    assert cache.stats()['revalidated'] == 1
+
+
+def test_prefetch_revalidates_projections_in_one_call(spreadsheet):
+    cache = TableCache(ttl=0.05, revisions=tracker(probe_ttl=0.03))
+    worksheets = [spreadsheet.worksheet('Consultas'), spreadsheet.worksheet('Examenes')]
+    cache.prefetch(spreadsheet, worksheets, 'A:B')
+    time.sleep(0.06)
+
+    spreadsheet.client.reset_stats()
+    assert cache.prefetch(spreadsheet, worksheets, 'A:B') == 0
+    assert spreadsheet.client.total_calls == 1
+    assert cache.stats()['revalidated'] == 2
+
+
+def test_each_write_registers_its_version():
+    spreadsheet = FakeClient().create_spreadsheet('revisions-new', {
+        'Consultas': [['id', 'patient_id']],
+        'Examenes': [['id', 'patient_id']],
+        'Logs_Acceso': [['id', 'user_id']]
+    })
+    revisions = tracker()
+    cache = TableCache(ttl=60, revisions=revisions)
+    # La primera vez crea la hoja de versiones
+    cache.append_row(spreadsheet.worksheet('Consultas'), ['CON_1', '7'])
+    cache.append_row(spreadsheet.worksheet('Logs_Acceso'), ['LOG_1', '7'])
+    first = revisions.signatures(spreadsheet)
+    assert set(first) == {'Consultas'}
+
+    consultations, exams = spreadsheet.worksheet('Consultas'), spreadsheet.worksheet('Examenes')
+    spreadsheet.client.reset_stats()
+    cache.append_row(consultations, ['CON_2', '7'])
+    # El token va en la misma llamada que los datos, sobre la fila ya registrada
+    assert dict(spreadsheet.client.calls) == {'spreadsheet_batch_update': 1}
+    # Una hoja sin fila de versión la agrega en la misma llamada
+    cache.append_row(exams, ['EXA_1', '7'])
+    assert dict(spreadsheet.client.calls) == {'spreadsheet_batch_update': 2}
+    second = revisions.signatures(spreadsheet)
+    assert second['Consultas'] != first['Consultas']
+    assert set(second) == {'Consultas', 'Examenes'}
+    assert len(spreadsheet.worksheet('_Versiones').get_all_values()) == 3
+    assert revisions.pending() == 0
+    revisions.close()
+
+
+def test_failed_version_write_is_retried(spreadsheet, monkeypatch):
+    revisions = tracker()
+    cache = TableCache(ttl=60, revisions=revisions)
+    worksheet = spreadsheet.worksheet('Consultas')
+    before = revisions.signatures(spreadsheet).get('Consultas')
+
+    def unavailable(*args, **kwargs):
+        raise ConnectionError('sin conexión')
+
+    monkeypatch.setattr(spreadsheet, 'values_batch_update', unavailable)
+    monkeypatch.setattr(spreadsheet.worksheet('_Versiones'), 'append_rows', unavailable)
+    # Con opciones de gspread el token se escribe después de los datos; la
+    # escritura de datos no falla por la versión
+    cache.append_row(worksheet, ['CON_2', '7'], value_input_option='RAW')
+    assert worksheet.get_all_values()[-1] == ['CON_2', '7']
+    assert revisions.pending() == 1
+
+    monkeypatch.undo()
+    assert revisions.flush() == 1
+    assert revisions.signatures(spreadsheet)['Consultas'] != before
+    revisions.close()
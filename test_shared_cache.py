@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la caché de hojas compartida entre procesos (dos TableCache
+sobre el mismo archivo simulan dos workers de gunicorn)
+"""
+
+import os
+import stat
+
+import pytest
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.shared_cache import SharedSnapshots
+from backend.database.sheets_cache import TableCache
+
+
+@pytest.fixture
+def worksheet():
+    client = FakeClient()
+    spreadsheet = client.create_spreadsheet('shared-test', {
+        'Consultas': [['id', 'patient_id'], ['CON_1', '7'], ['CON_2', '8']],
+        'Examenes': [['id', 'patient_id'], ['EXA_1', '7']]
+    })
+    return spreadsheet.worksheet('Consultas')
+
+
+def workers(tmp_path, ttl=60, **kwargs):
+    return [TableCache(ttl=ttl, shared=SharedSnapshots(str(tmp_path / 'cache.db')), **kwargs)
+            for _ in range(2)]
+
+
+def test_second_worker_reuses_the_download(tmp_path, worksheet):
+    web_1, web_2 = workers(tmp_path)
+    assert web_1.get_columns(worksheet, 'A:B')[1] == ['CON_1', '7']
+
+    worksheet.client.reset_stats()
+    assert web_2.get_columns(worksheet, 'A:B') == web_1.get_columns(worksheet, 'A:B')
+    assert worksheet.client.total_calls == 0
+    assert web_2.stats()['shared']['hits'] == 1
+    assert web_2.get_rows_by(worksheet, 1, '8', 'A:B') == [(3, ['CON_2', '8'])]
+
+
+def test_a_write_reaches_the_other_worker(tmp_path, worksheet):
+    web_1, web_2 = workers(tmp_path)
+    web_1.get_values(worksheet)
+    web_2.get_values(worksheet)
+
+    web_1.append_row(worksheet, ['CON_3', '7'])
+    # web_2 toma la copia ya actualizada que publicó web_1
+    worksheet.client.reset_stats()
+    assert web_2.get_values(worksheet)[-1] == ['CON_3', '7']
+    assert worksheet.client.total_calls == 0
+
+    web_2.update_cell(worksheet, 2, 2, '9')
+    assert web_1.get_rows_by(worksheet, 1, '9') == [(2, ['CON_1', '9'])]
+
+
+def test_invalidation_makes_every_worker_reload(tmp_path, worksheet):
+    web_1, web_2 = workers(tmp_path)
+    web_2.get_values(worksheet)
+
+    web_1.update(worksheet, 'A2', [['=1+1']], value_input_option='USER_ENTERED')
+    worksheet.client.reset_stats()
+    web_2.get_values(worksheet)
+    assert worksheet.client.total_calls == 1
+
+
+def test_delta_sheets_reload_after_writes_elsewhere(tmp_path, worksheet):
+    web, bot = workers(tmp_path, ttl=0, delta_sheets=['Consultas'])
+    web.get_columns(worksheet, 'A:B')
+    bot.delete_rows(worksheet, 2)
+    # Sin la caché compartida web leería solo las filas nuevas y no notaría
+    # la fila eliminada
+    assert web.get_columns(worksheet, 'A:B') == [['id', 'patient_id'], ['CON_2', '8']]
+    assert web.stats()['delta_syncs'] == 0
+
+
+def test_prefetch_adopts_and_publishes(tmp_path, worksheet):
+    web_1, web_2 = workers(tmp_path)
+    spreadsheet = worksheet.spreadsheet
+    sheets = [worksheet, spreadsheet.worksheet('Examenes')]
+    assert web_1.prefetch(spreadsheet, sheets, 'A:B') == 2
+
+    spreadsheet.client.reset_stats()
+    assert web_2.prefetch(spreadsheet, sheets, 'A:B') == 0
+    assert spreadsheet.client.total_calls == 0
+    assert web_2.get_columns(sheets[1], 'A:B')[1] == ['EXA_1', '7']
+
+
+def test_unavailable_file_falls_back_to_local_cache(tmp_path, worksheet):
+    # El directorio no se puede crear: en su lugar hay un archivo
+    (tmp_path / 'not-a-dir').write_text('')
+    cache = TableCache(ttl=60, shared=SharedSnapshots(str(tmp_path / 'not-a-dir' / 'cache.db')))
+    cache.get_values(worksheet)
+    cache.append_row(worksheet, ['CON_3', '7'])
+    assert cache.get_values(worksheet)[-1] == ['CON_3', '7']
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['shared']['errors'] > 0
+
+
+def test_new_file_is_private(tmp_path, worksheet):
+    path = tmp_path / 'state' / 'cache.db'
+    TableCache(ttl=60, shared=SharedSnapshots(str(path))).get_values(worksheet)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(path.parent).st_mode) == 0o700
+
+
+def test_untrusted_file_is_refused(tmp_path, worksheet, monkeypatch):
+    path = tmp_path / 'cache.db'
+    web_1, _ = workers(tmp_path)
+    web_1.get_values(worksheet)
+
+    # Otro usuario podría haber escrito las copias: no se leen
+    os.chmod(path, 0o666)
+    cache = TableCache(ttl=60, shared=SharedSnapshots(str(path)))
+    worksheet.client.reset_stats()
+    cache.get_values(worksheet)
+    assert worksheet.client.calls['get_all_values'] == 1
+    assert cache.stats()['shared']['hits'] == 0
+    assert cache.stats()['shared']['errors'] > 0
+
+    os.chmod(path, 0o600)
+    monkeypatch.setattr(os, 'getuid', lambda: os.stat(path).st_uid + 1)
+    cache = TableCache(ttl=60, shared=SharedSnapshots(str(path)))
+    cache.get_values(worksheet)
+    assert cache.stats()['shared']['hits'] == 0
+    assert cache.stats()['shared']['errors'] > 0
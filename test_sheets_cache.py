@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la caché compartida de worksheets (sin conexión a Google Sheets)
+"""
+
+from gspread.utils import a1_to_rowcol
+from backend.database.fake_gspread import FakeClient
+from backend.database.sheets_cache import TableCache, cells_to_ranges, values_to_records
+
+
+class StubSpreadsheet:
+    id = 'sheet-test'
+
+
+class StubWorksheet:
+    """Worksheet mínima que cuenta las lecturas completas"""
+
+    def __init__(self, title, values):
+        self.spreadsheet = StubSpreadsheet()
+        self.title = title
+        self.values = values
+        self.reads = 0
+        self.batch_calls = 0
+
+    def get_all_values(self):
+        self.reads += 1
+        return [list(row) for row in self.values]
+
+    def append_row(self, values, **kwargs):
+        self.values.append([str(v) for v in values])
+
+    def update_cell(self, row, col, value):
+        self.values[row - 1][col - 1] = str(value)
+
+    def update(self, range_name, values=None, **kwargs):
+        row, col = a1_to_rowcol(range_name)
+        self.update_cell(row, col, values)
+
+    def batch_update(self, data, **kwargs):
+        self.batch_calls += 1
+        for item in data:
+            first = item['range'].split(':')[0]
+            row, col = a1_to_rowcol(first)
+            for offset, value in enumerate(item['values'][0]):
+                self.update_cell(row, col + offset, value)
+
+    def delete_rows(self, start_index, end_index=None):
+        del self.values[start_index - 1:(end_index or start_index)]
+
+
+def make_consultas():
+    return StubWorksheet('Consultas', [
+        ['id', 'patient_id', 'doctor'],
+        ['CON_1', '7', 'Dr. Pinto'],
+        ['CON_2', '8', 'Dra. Soto'],
+    ])
+
+
+def test_reads_are_served_from_cache():
+    cache = TableCache(ttl=60)
+    worksheet = make_consultas()
+
+    cache.get_values(worksheet)
+    cache.get_values(worksheet)
+    cache.get_records(worksheet)
+
+    assert worksheet.reads == 1
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+
+def test_ttl_expiry_reloads():
+    cache = TableCache(ttl=0)
+    worksheet = make_consultas()
+
+    cache.get_values(worksheet)
+    cache.get_values(worksheet)
+
+    assert worksheet.reads == 2
+
+
+def test_writes_update_cached_entry():
+    cache = TableCache(ttl=60)
+    worksheet = make_consultas()
+
+    cache.get_values(worksheet)
+    cache.append_row(worksheet, ['CON_3', 7, 'Dr. Rojas'])
+    assert cache.get_values(worksheet)[-1] == ['CON_3', '7', 'Dr. Rojas']
+
+    cache.delete_rows(worksheet, 2)
+    assert [row[0] for row in cache.get_values(worksheet)] == ['id', 'CON_2', 'CON_3']
+    assert cache.get_values(worksheet) == worksheet.values
+    assert worksheet.reads == 1
+
+
+def test_header_writes_invalidate_entry():
+    cache = TableCache(ttl=60)
+    worksheet = make_consultas()
+
+    cache.get_values(worksheet)
+    cache.update_cell(worksheet, 1, 3, 'medico')
+    cache.get_values(worksheet)
+
+    assert worksheet.reads == 2
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_single_cell_updates_bump_snapshot_version():
+    cache = TableCache(ttl=60)
+    worksheet = make_consultas()
+
+    records, token = cache.get_records_snapshot(worksheet)
+    cache.update(worksheet, 'C3', 'Dr. Rojas')
+
+    assert records[1]['doctor'] == 'Dr. Rojas'
+    assert cache.snapshot_token(worksheet) == (token[0], token[1] + 1)
+
+    cache.update(worksheet, 'A2:C2', [['CON_9', '7', 'Dr. Pinto']])
+    assert cache.snapshot_token(worksheet) is None
+    assert worksheet.reads == 1
+
+
+def test_cells_are_grouped_into_ranges():
+    assert cells_to_ranges([(5, 4, 'Ana'), (5, 6, '9'), (5, 5, 'Pérez'), (7, 2, 'x'), (5, 4, 'Ana María')]) == [
+        {'range': 'D5:F5', 'values': [['Ana María', 'Pérez', '9']]},
+        {'range': 'B7', 'values': [['x']]},
+    ]
+
+
+def test_batch_flushes_in_one_call():
+    cache = TableCache(ttl=60)
+    worksheet = make_consultas()
+    header = cache.get_header(worksheet)
+    assert [n for n, _ in cache.get_patient_rows(worksheet, '8')] == [3]
+
+    with cache.batch(worksheet) as batch:
+        batch.set_fields(2, header, {'patient_id': '8', 'doctor': 'Dr. Rojas', 'otro': 'x'})
+        batch.set(3, 3, 'Dr. Pinto')
+
+    assert worksheet.batch_calls == 1
+    assert cache.get_values(worksheet)[1:] == [['CON_1', '8', 'Dr. Rojas'], ['CON_2', '8', 'Dr. Pinto']]
+    assert cache.get_values(worksheet) == worksheet.values
+    assert [n for n, _ in cache.get_patient_rows(worksheet, '8')] == [2, 3]
+    assert worksheet.reads == 1
+
+
+def test_patient_index_is_maintained_incrementally():
+    cache = TableCache(ttl=60)
+    worksheet = make_consultas()
+
+    assert [n for n, _ in cache.get_patient_rows(worksheet, 7)] == [2]
+
+    cache.append_row(worksheet, ['CON_3', '7', 'Dr. Rojas'])
+    cache.append_row(worksheet, ['CON_4', '8', 'Dr. Rojas'])
+    assert [n for n, _ in cache.get_patient_rows(worksheet, '7')] == [2, 4]
+
+    cache.delete_rows(worksheet, 2)
+    assert [(n, row[0]) for n, row in cache.get_patient_rows(worksheet, '7')] == [(3, 'CON_3')]
+    assert [(n, row[0]) for n, row in cache.get_patient_rows(worksheet, '8')] == [(2, 'CON_2'), (4, 'CON_4')]
+
+    cache.update_cell(worksheet, 2, 2, '7')
+    assert [n for n, _ in cache.get_patient_rows(worksheet, '7')] == [2, 3]
+    assert [r['id'] for r in cache.get_records_by(worksheet, 'patient_id', 8)] == ['CON_4']
+    assert worksheet.reads == 1
+
+
+def test_records_match_gspread_format():
+    records = values_to_records([
+        ['id', 'email', 'telegram_id'],
+        ['1', 'ana@medconnect.cl', ''],
+        ['2', 'luis@medconnect.cl', '123456789'],
+    ])
+
+    assert records[0] == {'id': 1, 'email': 'ana@medconnect.cl', 'telegram_id': ''}
+    assert records[1]['telegram_id'] == 123456789
+    assert values_to_records([['id', 'email']]) == []
+
+
+def test_column_projection_is_cached_and_kept_in_sync():
+    client = FakeClient()
+    client.create_spreadsheet('sheet-test', {'Consultas': [
+        ['id', 'patient_id', 'doctor', 'notes'],
+        ['CON_1', 7, 'Dr. Pinto', 'texto largo'],
+        ['CON_2', 8, 'Dra. Soto', 'texto largo'],
+    ]})
+    worksheet = client.open_by_key('sheet-test').worksheet('Consultas')
+    cache = TableCache(ttl=60)
+
+    assert cache.get_columns(worksheet, 'A:C')[1] == ['CON_1', '7', 'Dr. Pinto']
+    cache.append_row(worksheet, ['CON_3', 7, 'Dr. Rojas', 'nota'])
+    cache.update_cell(worksheet, 2, 4, 'fuera de la proyección')
+    cache.delete_rows(worksheet, 3)
+
+    rows = cache.get_patient_rows(worksheet, 7, columns='A:C')
+    assert rows == [(2, ['CON_1', '7', 'Dr. Pinto']), (3, ['CON_3', '7', 'Dr. Rojas'])]
+    assert client.calls['get'] == 1
+    assert client.calls['get_all_values'] == 0
+
+
+def test_field_reads_only_header_and_column():
+    client = FakeClient()
+    client.create_spreadsheet('sheet-test', {'Examenes': [
+        ['id', 'user_id', 'exam_type'],
+        ['EXA_1', 'USR_1', 'Hemograma'],
+        ['EXA_2', 'USR_2', 'Perfil lipídico'],
+    ]})
+    worksheet = client.open_by_key('sheet-test').worksheet('Examenes')
+
+    assert TableCache(ttl=60).get_field(worksheet, 'user_id') == ['USR_1', 'USR_2']
+    assert client.calls['get'] == 2
+
+
+def make_delta_sheet():
+    client = FakeClient()
+    client.create_spreadsheet('sheet-test', {'Examenes': [
+        ['id', 'patient_id', 'exam_type'],
+        ['EXA_1', '7', 'Hemograma'],
+    ]})
+    worksheet = client.open_by_key('sheet-test').worksheet('Examenes')
+    return client, worksheet, TableCache(ttl=0, delta_sheets=['Examenes'], full_ttl=60)
+
+
+def test_delta_sync_fetches_only_appended_rows():
+    client, worksheet, cache = make_delta_sheet()
+    cache.get_values(worksheet)
+    cache.get_patient_rows(worksheet, 7)
+
+    # Otro proceso agrega una fila
+    worksheet.append_row(['EXA_2', '7', 'Perfil lipídico'])
+
+    assert [n for n, _ in cache.get_patient_rows(worksheet, 7)] == [2, 3]
+    assert client.calls['get_all_values'] == 1
+    assert client.calls['batch_get'] == 2
+    assert cache.stats()['delta_syncs'] == 2
+
+
+def test_delta_sync_falls_back_after_external_delete():
+    client, worksheet, cache = make_delta_sheet()
+    worksheet.append_row(['EXA_2', '8', 'Glicemia'])
+    cache.get_values(worksheet)
+
+    worksheet.delete_rows(2)
+
+    assert cache.get_values(worksheet) == [
+        ['id', 'patient_id', 'exam_type'], ['EXA_2', '8', 'Glicemia']
+    ]
+    assert client.calls['get_all_values'] == 2
+    assert cache.stats()['delta_fallbacks'] == 1
+
+
+def test_delta_sync_keeps_projections_current():
+    client, worksheet, cache = make_delta_sheet()
+    cache.get_columns(worksheet, 'B:C')
+    worksheet.append_row(['EXA_2', '7', 'Glicemia'])
+
+    assert cache.get_columns(worksheet, 'B:C')[-1] == ['7', 'Glicemia']
+    assert client.calls['get'] == 1
+
+
+def test_prefetch_loads_several_sheets_in_one_call():
+    client = FakeClient()
+    spreadsheet = client.create_spreadsheet('sheet-test', {
+        'Consultas': [['id', 'patient_id'], ['CON_1', '7']],
+        'Examenes': [['id', 'patient_id'], ['EXA_1', '7']],
+    })
+    worksheets = [spreadsheet._worksheets[0], spreadsheet._worksheets[1]]
+    cache = TableCache(ttl=60)
+
+    assert cache.prefetch(spreadsheet, worksheets, 'A:B') == 2
+    assert cache.prefetch(spreadsheet, worksheets, 'A:B') == 0
+
+    assert cache.get_patient_rows(worksheets[1], 7, columns='A:B') == [(2, ['EXA_1', '7'])]
+    assert dict(client.calls) == {'values_batch_get': 1}
+
+
+def test_prefetch_refreshes_append_only_sheets_incrementally():
+    client, worksheet, cache = make_delta_sheet()
+    cache.get_columns(worksheet, 'A:C')
+    worksheet.append_row(['EXA_2', '7', 'Glicemia'])
+
+    cache.prefetch(worksheet.spreadsheet, [worksheet], 'A:C')
+
+    assert [row[0] for _, row in cache.get_patient_rows(worksheet, 7, columns='A:C')] == ['EXA_1', 'EXA_2']
+    assert client.calls['values_batch_get'] == 1
+    assert cache.stats()['delta_syncs'] >= 1
+
+
+def make_sheet(title, rows=200):
+    return StubWorksheet(title, [['id', 'patient_id', 'notas']] + [
+        [f'{title}_{i}', str(i % 20), 'control ' * 10] for i in range(rows)
+    ])
+
+
+def test_entry_size_accounts_for_records_and_indexes():
+    cache = TableCache(ttl=60)
+    worksheet = make_sheet('Consultas')
+
+    cache.get_values(worksheet)
+    values_only = cache.resident_bytes()
+    assert values_only > 200 * len('control ' * 10)
+
+    cache.get_records(worksheet)
+    cache.get_patient_rows(worksheet, 3)
+    assert cache.resident_bytes() > values_only
+    assert cache.stats()['resident_bytes'] == cache.resident_bytes()
+    assert cache.sizes()[0]['rows'] == 201
+
+
+def test_least_recently_used_sheets_are_evicted_over_budget():
+    probe = TableCache(ttl=60)
+    probe.get_values(make_sheet('Probe'))
+    one_sheet = probe.resident_bytes()
+
+    cache = TableCache(ttl=60, max_bytes=int(one_sheet * 2.5))
+    consultas, examenes, medicamentos = make_sheet('Consultas'), make_sheet('Examenes'), make_sheet('Medicamentos')
+    cache.get_values(consultas)
+    cache.get_values(examenes)
+    cache.get_values(consultas)  # Examenes queda como la menos usada
+
+    cache.get_values(medicamentos)
+    assert cache.stats()['evictions'] == 1
+    assert cache.resident_bytes() <= cache.max_bytes
+
+    cache.get_values(consultas)
+    cache.get_values(examenes)
+    assert (consultas.reads, examenes.reads, medicamentos.reads) == (1, 2, 1)
+
+
+def test_entry_larger_than_budget_is_still_served():
+    cache = TableCache(ttl=60, max_bytes=1024)
+    worksheet = make_sheet('Consultas')
+
+    assert len(cache.get_records(worksheet)) == 200
+    assert cache.stats()['entries'] == 1
+    cache.get_values(make_sheet('Examenes'))
+    # Solo queda la entrada recién entregada
+    assert [size['sheet'] for size in cache.sizes()] == ['Examenes']
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la caché de handles de Spreadsheet y Worksheet
+"""
+
+import base64
+import json
+import os
+
+import pytest
+import requests
+from gspread.exceptions import WorksheetNotFound
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.sheets_cache import TableCache
+from backend.database.sheets_client import (
+    SharedClient, SheetHandles, load_service_account_info, tune_session
+)
+
+
+def make_client():
+    client = FakeClient()
+    client.create_spreadsheet('sheet-test', {
+        'Consultas': [['id', 'patient_id', 'doctor'], ['CON_1', '7', 'Dr. Pinto']]
+    })
+    return client
+
+
+def test_handles_are_reused_across_requests():
+    client = make_client()
+    handles = SheetHandles()
+
+    for _ in range(3):
+        handles.open(client, 'sheet-test').worksheet('Consultas')
+
+    assert client.calls['open_by_key'] == 1
+    assert client.calls['worksheet'] == 1
+    assert handles.stats()['metadata_calls_avoided'] == 4
+
+
+def test_missing_worksheets_are_not_cached():
+    client = make_client()
+    spreadsheet = SheetHandles().open(client, 'sheet-test')
+
+    with pytest.raises(WorksheetNotFound):
+        spreadsheet.worksheet('Recordatorios')
+    spreadsheet.add_worksheet(title='Recordatorios', rows=10, cols=3)
+    spreadsheet.worksheet('Recordatorios')
+
+    assert client.calls['worksheet'] == 1
+
+
+def test_cache_invalidation_refreshes_handle():
+    client = make_client()
+    handles = SheetHandles()
+    cache = TableCache(ttl=60)
+    cache.add_invalidation_listener(handles.forget)
+    worksheet = handles.open(client, 'sheet-test').worksheet('Consultas')
+
+    # Cambio de headers
+    cache.update_cell(worksheet, 1, 3, 'medico')
+    handles.open(client, 'sheet-test').worksheet('Consultas')
+
+    assert client.calls['worksheet'] == 2
+    assert handles.stats()['refreshes'] == 1
+
+
+def test_credentials_load_from_base64_env(monkeypatch):
+    info = {'type': 'service_account', 'client_email': 'bot@medconnect.iam'}
+    monkeypatch.delenv('GOOGLE_SERVICE_ACCOUNT_JSON', raising=False)
+    monkeypatch.setenv('GOOGLE_CREDENTIALS_FILE', base64.b64encode(json.dumps(info).encode()).decode())
+
+    assert load_service_account_info() == info
+
+
+def test_shared_client_is_created_once_per_process(monkeypatch):
+    created = []
+    monkeypatch.setattr(SharedClient, '_create', lambda self: created.append(object()) or created[-1])
+    shared = SharedClient()
+
+    assert shared.get() is shared.get()
+    assert len(created) == 1
+
+    # En un proceso hijo (fork) se crea una sesión nueva
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert shared.get() is created[1]
+
+
+def test_session_pool_is_sized_to_config():
+    class StubClient:
+        session = requests.Session()
+
+    tune_session(StubClient(), 12)
+
+    adapter = StubClient.session.get_adapter('https://sheets.googleapis.com')
+    assert adapter._pool_maxsize == 12
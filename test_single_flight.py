@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la coalescencia de lecturas concurrentes (single-flight)
+"""
+
+import threading
+import time
+
+import pytest
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.sheets_cache import TableCache
+from backend.database.single_flight import SingleFlight
+
+
+def run_concurrently(count, target):
+    """Ejecuta target() en `count` hilos que arrancan a la vez"""
+    barrier = threading.Barrier(count)
+    results, errors = [], []
+
+    def worker():
+        barrier.wait()
+        try:
+            results.append(target())
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.05)
+        return ['fila']
+
+    results, _ = run_concurrently(5, lambda: flights.do('Consultas', fetch))
+    assert calls == [1]
+    assert len(results) == 5 and all(result is results[0] for result in results)
+    assert flights.stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': 4}
+
+
+def test_waiters_receive_the_leader_error():
+    flights = SingleFlight()
+
+    def fetch():
+        time.sleep(0.05)
+        raise RuntimeError('503')
+
+    _, errors = run_concurrently(3, lambda: flights.do('Consultas', fetch))
+    assert len(errors) == 3
+    # El error no queda guardado: la siguiente llamada vuelve a ejecutar
+    with pytest.raises(ZeroDivisionError):
+        flights.do('Consultas', lambda: 1 / 0)
+
+
+@pytest.fixture
+def spreadsheet():
+    client = FakeClient(latency=0.05)
+    return client.create_spreadsheet('flight-test', {
+        'Consultas': [['id', 'patient_id'], ['CON_1', '7']],
+        'Examenes': [['id', 'patient_id'], ['EXA_1', '7']]
+    })
+
+
+def test_concurrent_misses_download_the_sheet_once(spreadsheet):
+    cache = TableCache(ttl=60)
+    worksheet = spreadsheet.worksheet('Consultas')
+    spreadsheet.client.reset_stats()
+    results, errors = run_concurrently(8, lambda: cache.get_columns(worksheet, 'A:B'))
+    assert not errors and len(results) == 8
+    assert spreadsheet.client.total_calls == 1
+    assert cache.stats()['coalesced'] >= 1
+
+
+def test_reads_wait_for_a_running_prefetch(spreadsheet):
+    cache = TableCache(ttl=60)
+    worksheets = [spreadsheet.worksheet('Consultas'), spreadsheet.worksheet('Examenes')]
+    spreadsheet.client.reset_stats()
+    prefetch = threading.Thread(target=cache.prefetch, args=(spreadsheet, worksheets, 'A:B'))
+    prefetch.start()
+    time.sleep(0.01)
+    assert cache.get_columns(worksheets[1], 'A:B')[1] == ['EXA_1', '7']
+    prefetch.join()
+    assert spreadsheet.client.total_calls == 1
+    assert cache.stats()['coalesced'] == 1
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas del backend SQLite (base de datos en memoria)
+"""
+
+import pytest
+
+from backend.database.fake_gspread import FakeClient, install
+from backend.database.schema import get_headers
+from backend.database.sheets_cache import table_cache
+from backend.database.sheets_client import sheet_handles
+from backend.database.sqlite_manager import SQLiteManager, SQLiteReplica
+from config import Config
+
+
+@pytest.fixture
+def db():
+    return SQLiteManager('sqlite:///:memory:')
+
+
+def test_users_are_found_by_indexed_columns(db):
+    user_id = db.create_user({
+        'telegram_id': 123456789, 'nombre': 'Ana', 'apellido': 'Pérez',
+        'email': 'ana@medconnect.cl', 'telefono': '912345678', 'edad': 34
+    })
+
+    assert db.get_user_by_telegram_id('123456789')['user_id'] == user_id
+    assert db.get_user_by_email('ana@medconnect.cl')['telegram_id'] == 123456789
+    assert db.get_user_by_phone(912345678)['nombre'] == 'Ana'
+    assert db.get_user_by_id(user_id)['edad'] == 34
+    assert db.get_user_by_email('nadie@medconnect.cl') is None
+
+    assert db.update_user(user_id, {'plan': 'premium', 'no_existe': 'x'})
+    assert db.get_user_by_id(user_id)['plan'] == 'premium'
+    assert not db.update_user('USR_otro', {'plan': 'premium'})
+
+
+def test_clinical_records_share_storage_logic(db):
+    db.create_atencion({'user_id': 'USR_1', 'fecha': '2024-01-10', 'especialidad': 'Cardiología'})
+    db.create_atencion({'user_id': 'USR_1', 'fecha': '2024-03-02', 'especialidad': 'Medicina general'})
+    db.create_atencion({'user_id': 'USR_2', 'fecha': '2024-02-01'})
+    db.create_medicamento({'user_id': 'USR_1', 'nombre_medicamento': 'Losartán', 'fecha_fin': ''})
+    db.authorize_family_member('USR_1', {'nombre_familiar': 'Luis', 'telegram_id': '555', 'permisos': 'admin'})
+
+    atenciones = db.get_user_atenciones('USR_1')
+    assert [a['fecha'] for a in atenciones] == ['2024-03-02', '2024-01-10']
+    assert len(db.get_user_medicamentos_activos('USR_1')) == 1
+    assert db.check_family_permission('555', 'USR_1')
+    assert not db.check_family_permission('556', 'USR_1')
+
+
+def test_update_sheet_headers_adds_columns(db):
+    db.update_sheet_headers('Usuarios', ['telegram_username'])
+    db.append_record('Usuarios', ['USR_9'])
+
+    assert db.get_records('Usuarios')[0]['telegram_username'] == ''
+
+
+@pytest.fixture
+def replica():
+    client = FakeClient()
+    users = get_headers('Usuarios') + ['telegram_username']
+    ana = {'user_id': 'USR_1', 'telegram_id': '123', 'nombre': 'Ana', 'telefono': '0912345678',
+           'telegram_username': 'ana'}
+    spreadsheet = client.create_spreadsheet(Config.GOOGLE_SHEETS_ID, {
+        'Usuarios': [
+            users,
+            [ana.get(header, '') for header in users],
+            [''] * len(users),
+            ['USR_2', '456', 'Luis'],
+        ],
+        'Medicamentos': [['medicamento_id', 'user_id', 'nombre_medicamento'], ['MED_1', 'USR_1', 'Losartán']]
+    })
+    table_cache.clear()
+    sheet_handles.clear()
+    with install(client):
+        from backend.database.sheets_manager import SheetsManager
+        primary = SheetsManager()
+    yield SQLiteReplica('sqlite:///:memory:', primary, sync_seconds=0), spreadsheet
+    table_cache.clear()
+    sheet_handles.clear()
+
+
+def test_replica_reads_what_sheets_has(replica):
+    db, spreadsheet = replica
+
+    assert db.get_user_by_telegram_id('123')['telegram_username'] == 'ana'
+    assert db.find_records('Medicamentos', 'user_id', 'USR_1')[0]['nombre_medicamento'] == 'Losartán'
+    # Sin conversión a número al copiar: se conserva el texto de la celda
+    assert db.conn.execute('SELECT telefono FROM Usuarios WHERE user_id = ?', ('USR_1',)).fetchone()[0] == '0912345678'
+
+    # Una escritura de otro proceso (app.py, el bot) se ve en la siguiente lectura
+    table_cache.append_row(spreadsheet.worksheet('Usuarios'), ['USR_3', '789', 'Eva'])
+    assert db.get_user_by_telegram_id('789')['nombre'] == 'Eva'
+    # Sin cambios en la hoja no se vuelve a copiar
+    syncs = db.syncs
+    db.get_records('Usuarios')
+    assert db.syncs == syncs
+
+
+def test_replica_writes_go_to_sheets(replica):
+    db, spreadsheet = replica
+
+    user_id = db.create_user({'telegram_id': 999, 'nombre': 'Rosa', 'email': 'rosa@medconnect.cl'})
+    assert db.update_user('USR_2', {'nombre': 'Luis Alberto'})
+    assert not db.update_user('USR_otro', {'nombre': 'x'})
+
+    users = table_cache.get_records(spreadsheet.worksheet('Usuarios'))
+    assert [u['user_id'] for u in users] == ['USR_1', '', 'USR_2', user_id]
+    assert users[2]['nombre'] == 'Luis Alberto'
+    assert db.get_user_by_id(user_id)['nombre'] == 'Rosa'
+    assert db.get_user_by_id('USR_2')['nombre'] == 'Luis Alberto'
+
+
+def test_replica_serves_last_copy_without_sheets(replica):
+    db, spreadsheet = replica
+    assert db.get_user_by_id('USR_1')['nombre'] == 'Ana'
+
+    table_cache.clear()
+    spreadsheet.client.fail_next(10)
+    assert db.get_user_by_id('USR_1')['nombre'] == 'Ana'
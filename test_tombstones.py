@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pruebas del borrado lógico y la compactación (Google Sheets simulado)
+"""
+
+import pytest
+
+from backend.database.fake_gspread import FakeClient
+from backend.database.sheets_cache import table_cache
+from backend.database.tombstones import Compactor, live_rows, mark_deleted
+
+HEADERS = ['id', 'patient_id', 'doctor', 'specialty', 'date',
+           'diagnosis', 'treatment', 'notes', 'status']
+
+
+@pytest.fixture
+def spreadsheet():
+    client = FakeClient()
+    rows = [HEADERS] + [[f'CON_{i}', 7, 'Dr. Pinto', '', '', '', '', '', 'completada']
+                        for i in range(1, 6)]
+    spreadsheet = client.create_spreadsheet('tombstones-test', {'Consultas': rows})
+    table_cache.clear()
+    yield spreadsheet
+    table_cache.clear()
+
+
+def patient_ids(worksheet):
+    rows = table_cache.get_patient_rows(worksheet, 7, columns='A:I')
+    return [row[0] for _, row in live_rows(rows, 8)]
+
+
+def test_delete_marks_one_cell_and_hides_the_row(spreadsheet):
+    worksheet = spreadsheet.worksheet('Consultas')
+    patient_ids(worksheet)
+    spreadsheet.client.reset_stats()
+
+    assert mark_deleted(worksheet, [(3, 'CON_2')], 8) == [3]
+
+    assert patient_ids(worksheet) == ['CON_1', 'CON_3', 'CON_4', 'CON_5']
+    assert worksheet.values[2][8] == 'eliminado'
+    # Una lectura de la celda id para confirmar la fila y una escritura
+    assert dict(spreadsheet.client.calls) == {'batch_get': 1, 'batch_update': 1}
+
+
+def test_compaction_removes_tombstones_in_one_request(spreadsheet):
+    worksheet = spreadsheet.worksheet('Consultas')
+    patient_ids(worksheet)
+    mark_deleted(worksheet, [(2, 'CON_1'), (4, 'CON_3'), (5, 'CON_4')], 8)
+    spreadsheet.client.reset_stats()
+
+    removed = Compactor(lambda: spreadsheet, sheets={'Consultas': 'status'}).run_once()
+
+    assert removed == {'Consultas': 3}
+    assert [row[0] for row in worksheet.values[1:]] == ['CON_2', 'CON_5']
+    assert spreadsheet.client.calls['spreadsheet_batch_update'] == 1
+    # La caché se actualizó sin volver a leer la hoja
+    assert patient_ids(worksheet) == ['CON_2', 'CON_5']
+    assert spreadsheet.client.calls['get'] == 2
+
+
+def test_delete_finds_rows_moved_by_another_process(spreadsheet):
+    worksheet = spreadsheet.worksheet('Consultas')
+    patient_ids(worksheet)
+    # Otro servicio compacta la hoja sin pasar por esta caché: CON_4 queda en la fila 3
+    worksheet.delete_rows(2, 3)
+
+    assert mark_deleted(worksheet, [(5, 'CON_4'), (2, 'CON_1')], 8) == [3]
+
+    assert [row[0] for row in worksheet.values[1:]] == ['CON_3', 'CON_4', 'CON_5']
+    assert [row[8] for row in worksheet.values[1:]] == ['completada', 'eliminado', 'completada']
+    assert patient_ids(worksheet) == ['CON_3', 'CON_5']